@@ -1,12 +1,30 @@
-import requests
 import pandas as pd
-import openai
+import argparse
 import os
+import sys
+import contextvars
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple
+
+import census_cache
+import dataset_schema
+import geography
+import metrics
+import shared_cache
+from census_client import CensusAPIError, CensusUnavailable, get_client
 
 # -------------------------------------------------
 # OPENAI API CONFIG
 # -------------------------------------------------
-openai.api_key = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
+@lru_cache(maxsize=None)
+def get_openai():
+    """The configured openai module, imported on first use (it is slow to import; most requests never need it)."""
+    import openai
+
+    openai.api_key = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
+    return openai
 
 # -------------------------------------------------
 # CENSUS CONFIG / CONSTANTS
@@ -14,12 +32,33 @@ openai.api_key = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
 
 CENSUS_API_KEY = os.getenv("CENSUS_API_KEY")
 
+# "api" fetches from api.census.gov; "local" reads the ingested store (see census_store.py)
+CENSUS_BACKEND = os.getenv("CENSUS_BACKEND", "api").strip().lower()
+
+# API host; point it at a stand-in (e.g. bench/fake_census.py) for benchmarks
+CENSUS_API_BASE = os.getenv("CENSUS_API_BASE", "https://api.census.gov").rstrip("/")
+
+# -- Vintages: the dataset uses ACS_VINTAGE; time series can use any of ACS_VINTAGES
+ACS_VINTAGE = 2021
+ACS_VINTAGES = tuple(range(2011, int(os.getenv("ACS_LATEST_VINTAGE", "2023")) + 1))  # ACS 5-year ZCTA releases
+DHC_VINTAGE = 2020
+
+# Until 2019 the API nests ZCTAs in states, so those requests need in=state:<GEO_STATE>
+ZCTA_STATE = geography.STATE
+ZCTA_UNNESTED_FROM = 2020
+
+
+def census_url(vintage, dataset):
+    """Endpoint for one vintage of a dataset, e.g. census_url(2015, "acs/acs5")."""
+    return f"{CENSUS_API_BASE}/data/{vintage}/{dataset}"
+
+
 # -- ACS endpoints (2021)
-BASE_URL = "https://api.census.gov/data/2021/acs/acs5"  # For B01001/B19001 data
-BASE_URL_SUBJECT = "https://api.census.gov/data/2021/acs/acs5/subject"  # For S2401 data
+BASE_URL = census_url(ACS_VINTAGE, "acs/acs5")  # For B01001/B19001 data
+BASE_URL_SUBJECT = census_url(ACS_VINTAGE, "acs/acs5/subject")  # For S2401 data
 
 # -- 2020 Decennial DHC endpoint (for P8 Race)
-BASE_URL_2020_DHC = "https://api.census.gov/data/2020/dec/dhc"
+BASE_URL_2020_DHC = census_url(DHC_VINTAGE, "dec/dhc")
 
 # Adjust pandas display so we can see wide DataFrames in the console
 pd.set_option("display.max_columns", None)
@@ -51,185 +90,228 @@ ROCKLAND_ZIPS_TOWNS = {
     "10994": "West Nyack"
 }
 
+# ZCTAs in scope (GEO_SCOPE: the Rockland ZIPs above by default; see geography.py)
+UNIVERSE = geography.from_env(ROCKLAND_ZIPS_TOWNS)
+
+# -------------------------------------------------
+# 0. BATCHED MULTI-ZCTA FETCH (cached on disk)
+# -------------------------------------------------
+ZCTA_GEO_COLUMN = "zip code tabulation area"
+
+# From this many uncached ZIPs on, one `zip code tabulation area:*` call replaces the ZIP list
+CENSUS_WILDCARD_MIN_ZIPS = int(os.getenv("CENSUS_WILDCARD_MIN_ZIPS", "100"))
+
+
+def census_get_rows(base_url, get_vars, zip_codes, within=None):
+    """
+    Return (headers, rows) for `get_vars` over `zip_codes` from `base_url`
+    (`within` is the parent geography older vintages need, e.g. "state:36").
+    ZIPs already in the on-disk cache (see census_cache.py) are served from it;
+    the rest are fetched in one comma-joined `zip code tabulation area:` request
+    (a `:*` wildcard pull from CENSUS_WILDCARD_MIN_ZIPS ZIPs on) and written
+    back per ZIP, including ZIPs the API has no data for.
+    If the API is unavailable, expired cache rows are served when they cover
+    every missing ZIP. Rows come back in requested ZIP order; raises
+    CensusAPIError or CensusUnavailable (see census_client.py) on failure.
+    With CENSUS_BACKEND=local the rows come from census_store instead.
+    """
+    if CENSUS_BACKEND == "local":
+        import census_store
+
+        return census_store.get_rows(base_url, get_vars, zip_codes)
+
+    zip_codes = list(zip_codes)
+    get_vars = list(get_vars)
+    headers = get_vars + [ZCTA_GEO_COLUMN]
+    cache = census_cache.get_cache()
+
+    keys = census_cache.row_keys(base_url, get_vars, zip_codes)
+    cached = cache.get_many(list(keys.values())) if cache else {}
+    to_fetch = [z for z in zip_codes if keys[z] not in cached]
+
+    fetched = {}
+    if to_fetch:
+        # Identical fetches from other workers run once (see shared_cache.py);
+        # re-read whatever they stored while we waited for the lock
+        with shared_cache.single_flight(cache, census_cache.fetch_lock_name(base_url, get_vars, to_fetch)):
+            if cache:
+                cached.update(cache.get_many([keys[z] for z in to_fetch]))
+                to_fetch = [z for z in to_fetch if keys[z] not in cached]
+            metrics.census_cache_rows.inc(len(zip_codes) - len(to_fetch), result="hit")
+            metrics.census_cache_rows.inc(len(to_fetch), result="miss")
+            if to_fetch:
+                # Large sets (a state, the nation) would not fit in a URL; pull every ZCTA instead
+                wanted = "*" if len(to_fetch) >= CENSUS_WILDCARD_MIN_ZIPS else ",".join(to_fetch)
+                params = {
+                    "get": ",".join(get_vars),
+                    "for": f"{ZCTA_GEO_COLUMN}:{wanted}",
+                    "key": CENSUS_API_KEY
+                }
+                if within:
+                    params["in"] = within
+                try:
+                    # The API answers 204/empty body when none of the ZIPs exist
+                    data = get_client().get_json(base_url, params)
+                except CensusUnavailable:
+                    stale = cache.get_many([keys[z] for z in to_fetch], include_expired=True) if cache else {}
+                    if len(stale) < len(to_fetch):
+                        raise
+                    metrics.census_cache_rows.inc(len(stale), result="stale")
+                    cached.update(stale)
+                    to_fetch = []
+                    data = []
+
+                if len(data) > 1:
+                    wanted = set(to_fetch)
+                    for row in data[1:]:
+                        record = dict(zip(data[0], row))
+                        # A wildcard answers for every ZCTA; keep the requested ones
+                        if record[ZCTA_GEO_COLUMN] in wanted:
+                            fetched[record[ZCTA_GEO_COLUMN]] = record
+                if cache and to_fetch:
+                    cache.set_many(
+                        ((keys[z], fetched.get(z, census_cache.ABSENT)) for z in to_fetch),
+                        endpoint=base_url,
+                    )
+    else:
+        metrics.census_cache_rows.inc(len(zip_codes), result="hit")
+
+    rows = []
+    for z in zip_codes:
+        record = fetched[z] if z in fetched else cached.get(keys[z])
+        if record:
+            rows.append([record.get(h) for h in headers])
+    return headers, rows
+
+
 # -------------------------------------------------
 # 1. FETCH POPULATION & INCOME DATA (ACS 2021)
 # -------------------------------------------------
-def get_population_income_data(zip_codes=ROCKLAND_ZIPS_TOWNS.keys()):
+income_vars = {
+    "B19013_001E": "MedianIncome",
+    "B19001_002E": "Income_Less_Than_10K",
+    "B19001_003E": "Income_10K_14K",
+    "B19001_004E": "Income_15K_24K",
+    "B19001_005E": "Income_25K_34K",
+    "B19001_006E": "Income_35K_49K",
+    "B19001_007E": "Income_50K_74K",
+    "B19001_008E": "Income_75K_99K",
+    "B19001_009E": "Income_100K_149K",
+    "B19001_010E": "Income_150K_199K",
+    "B19001_011E": "Income_200K_Plus"
+}
+
+# B19001 has 16 household income brackets (002-017) under the 001 total, so
+# the Income_* labels above do not match their codes past B19001_004E (e.g.
+# B19001_011E is $50,000-$59,999, not $200K+). They are kept unchanged because
+# API clients and the Pages worker use them; anything that computes with
+# brackets (medians and shares in aggregate.py, the prompt) uses this table
+# instead. It is fetched in the income table's request as the "households"
+# view, kept out of the default columns:
+# (code, label, lower bound, upper bound; None = open-ended)
+B19001_BRACKETS = (
+    ("B19001_002E", "HHIncome_Under_10K", 0, 10000),
+    ("B19001_003E", "HHIncome_10K_15K", 10000, 15000),
+    ("B19001_004E", "HHIncome_15K_20K", 15000, 20000),
+    ("B19001_005E", "HHIncome_20K_25K", 20000, 25000),
+    ("B19001_006E", "HHIncome_25K_30K", 25000, 30000),
+    ("B19001_007E", "HHIncome_30K_35K", 30000, 35000),
+    ("B19001_008E", "HHIncome_35K_40K", 35000, 40000),
+    ("B19001_009E", "HHIncome_40K_45K", 40000, 45000),
+    ("B19001_010E", "HHIncome_45K_50K", 45000, 50000),
+    ("B19001_011E", "HHIncome_50K_60K", 50000, 60000),
+    ("B19001_012E", "HHIncome_60K_75K", 60000, 75000),
+    ("B19001_013E", "HHIncome_75K_100K", 75000, 100000),
+    ("B19001_014E", "HHIncome_100K_125K", 100000, 125000),
+    ("B19001_015E", "HHIncome_125K_150K", 125000, 150000),
+    ("B19001_016E", "HHIncome_150K_200K", 150000, 200000),
+    ("B19001_017E", "HHIncome_200K_Plus", 200000, None),
+)
+household_income_labels = {"B19001_001E": "Households", **{code: label for code, label, _, _ in B19001_BRACKETS}}
+
+
+def get_population_income_data(zip_codes=UNIVERSE.zips, vintage=ACS_VINTAGE):
     """
     Fetch total population (B01001_001E) and income range data (B19001_xxx)
-    plus median income (B19013_001E) for specified ZIP codes from ACS 5-Year.
+    plus median income (B19013_001E) for specified ZIP codes from ACS 5-Year
+    (`vintage`: any of ACS_VINTAGES).
     Returns a DataFrame with columns:
         [ZCTA_Name, TotalPopulation, MedianIncome, Income_<ranges>, ZipCode, TownName]
     """
-    results = []
-    missing_zips = []
+    return _table_frame("income", zip_codes, vintage)
+
+# -------------------------------------------------
+# 2. FETCH OCCUPATION DATA (ACS 2021 Subject)
+# -------------------------------------------------
+occupation_vars = {
+    # Civilian employed population 16 years and over
+    "S2401_C01_001E": "CivEmp16Over",
     
-    income_vars = {
-        "B19013_001E": "MedianIncome",
-        "B19001_002E": "Income_Less_Than_10K",
-        "B19001_003E": "Income_10K_14K",
-        "B19001_004E": "Income_15K_24K",
-        "B19001_005E": "Income_25K_34K",
-        "B19001_006E": "Income_35K_49K",
-        "B19001_007E": "Income_50K_74K",
-        "B19001_008E": "Income_75K_99K",
-        "B19001_009E": "Income_100K_149K",
-        "B19001_010E": "Income_150K_199K",
-        "B19001_011E": "Income_200K_Plus"
-    }
+    # Management, business, science, and arts occupations
+    "S2401_C01_002E": "MgmtBusSciArts",
+    "S2401_C01_003E": "MgmtBusFin",
+    "S2401_C01_004E": "MgmtOccupations",
+    "S2401_C01_005E": "BusinessFinOps",
     
-    for zip_code in zip_codes:
-        params = {
-            "get": "NAME,B01001_001E," + ",".join(income_vars.keys()),
-            "for": f"zip code tabulation area:{zip_code}",
-            "key": CENSUS_API_KEY
-        }
-        response = requests.get(BASE_URL, params=params)
-
-        if response.status_code == 200:
-            data = response.json()
-            if len(data) > 1:
-                results.append(data[1])
-            else:
-                missing_zips.append(zip_code)
-        else:
-            print(f"Error {response.status_code} for ZIP {zip_code}: {response.text}")
-            missing_zips.append(zip_code)
-
-    df_cols = ["ZCTA_Name", "TotalPopulation"] + list(income_vars.values()) + ["ZipCode"]
-    df = pd.DataFrame(results, columns=df_cols)
-
-    # Convert to numeric
-    df["TotalPopulation"] = pd.to_numeric(df["TotalPopulation"], errors="coerce")
-    for col in income_vars.values():
-        df[col] = pd.to_numeric(df[col], errors="coerce")
+    # Computer, engineering, and science
+    "S2401_C01_006E": "CompEngSci",
+    "S2401_C01_007E": "ComputerMath",
+    "S2401_C01_008E": "ArchitectureEng",
+    "S2401_C01_009E": "LifePhysSci",
     
-    # Map to TownName
-    df["TownName"] = df["ZipCode"].map(ROCKLAND_ZIPS_TOWNS)
+    # Education, legal, community service, arts, media
+    "S2401_C01_010E": "EducLegalCommArtsMedia",
+    "S2401_C01_011E": "CommunitySocService",
+    "S2401_C01_012E": "Legal",
+    "S2401_C01_013E": "EduInstructionLibrary",
+    "S2401_C01_014E": "ArtsDesignEntertainmentSportsMedia",
     
-    # Fill missing ZIPs if any
-    if missing_zips:
-        missing_df = pd.DataFrame(missing_zips, columns=["ZipCode"])
-        missing_df["ZCTA_Name"] = "N/A"
-        missing_df["TotalPopulation"] = None
-        for col in income_vars.values():
-            missing_df[col] = None
-        missing_df["TownName"] = missing_df["ZipCode"].map(ROCKLAND_ZIPS_TOWNS)
-        df = pd.concat([df, missing_df], ignore_index=True)
+    # Healthcare practitioners/technical
+    "S2401_C01_015E": "HealthcarePracTech",
+    "S2401_C01_016E": "HealthDiagTreat",
+    "S2401_C01_017E": "HealthTechs",
     
-    return df
+    # Service occupations
+    "S2401_C01_018E": "ServiceOcc",
+    "S2401_C01_019E": "HealthcareSupport",
+    "S2401_C01_020E": "ProtectiveService",
+    "S2401_C01_021E": "FirefightingPreventionEtc",
+    "S2401_C01_022E": "LawEnforcementEtc",
+    "S2401_C01_023E": "FoodPrepServing",
+    "S2401_C01_024E": "BuildingGroundsMaint",
+    "S2401_C01_025E": "PersonalCareService",
+    
+    # Sales and office
+    "S2401_C01_026E": "SalesOfficeOcc",
+    "S2401_C01_027E": "SalesRelated",
+    "S2401_C01_028E": "OfficeAdminSupport",
+    
+    # Natural resources, construction, maintenance
+    "S2401_C01_029E": "NatResConstMaint",
+    "S2401_C01_030E": "FarmFishForestry",
+    "S2401_C01_031E": "ConstructionExtraction",
+    "S2401_C01_032E": "InstallMaintRepair",
+    
+    # Production, transportation, and material moving
+    "S2401_C01_033E": "ProdTransMoving",
+    "S2401_C01_034E": "Production",
+    "S2401_C01_035E": "Transportation",
+    "S2401_C01_036E": "MaterialMoving"
+}
 
-# -------------------------------------------------
-# 2. FETCH OCCUPATION DATA (ACS 2021 Subject)
-# -------------------------------------------------
-def get_occupation_data(zip_codes=ROCKLAND_ZIPS_TOWNS.keys()):
+def get_occupation_data(zip_codes=UNIVERSE.zips, vintage=ACS_VINTAGE):
     """
-    Fetch ACS 5-Year Subject Table S2401 occupation data for specified ZIP codes.
+    Fetch ACS 5-Year Subject Table S2401 occupation data for specified ZIP codes
+    (`vintage`: any of ACS_VINTAGES).
     Returns a DataFrame with columns for various occupation categories.
     """
-    occupation_vars = {
-        # Civilian employed population 16 years and over
-        "S2401_C01_001E": "CivEmp16Over",
-        
-        # Management, business, science, and arts occupations
-        "S2401_C01_002E": "MgmtBusSciArts",
-        "S2401_C01_003E": "MgmtBusFin",
-        "S2401_C01_004E": "MgmtOccupations",
-        "S2401_C01_005E": "BusinessFinOps",
-        
-        # Computer, engineering, and science
-        "S2401_C01_006E": "CompEngSci",
-        "S2401_C01_007E": "ComputerMath",
-        "S2401_C01_008E": "ArchitectureEng",
-        "S2401_C01_009E": "LifePhysSci",
-        
-        # Education, legal, community service, arts, media
-        "S2401_C01_010E": "EducLegalCommArtsMedia",
-        "S2401_C01_011E": "CommunitySocService",
-        "S2401_C01_012E": "Legal",
-        "S2401_C01_013E": "EduInstructionLibrary",
-        "S2401_C01_014E": "ArtsDesignEntertainmentSportsMedia",
-        
-        # Healthcare practitioners/technical
-        "S2401_C01_015E": "HealthcarePracTech",
-        "S2401_C01_016E": "HealthDiagTreat",
-        "S2401_C01_017E": "HealthTechs",
-        
-        # Service occupations
-        "S2401_C01_018E": "ServiceOcc",
-        "S2401_C01_019E": "HealthcareSupport",
-        "S2401_C01_020E": "ProtectiveService",
-        "S2401_C01_021E": "FirefightingPreventionEtc",
-        "S2401_C01_022E": "LawEnforcementEtc",
-        "S2401_C01_023E": "FoodPrepServing",
-        "S2401_C01_024E": "BuildingGroundsMaint",
-        "S2401_C01_025E": "PersonalCareService",
-        
-        # Sales and office
-        "S2401_C01_026E": "SalesOfficeOcc",
-        "S2401_C01_027E": "SalesRelated",
-        "S2401_C01_028E": "OfficeAdminSupport",
-        
-        # Natural resources, construction, maintenance
-        "S2401_C01_029E": "NatResConstMaint",
-        "S2401_C01_030E": "FarmFishForestry",
-        "S2401_C01_031E": "ConstructionExtraction",
-        "S2401_C01_032E": "InstallMaintRepair",
-        
-        # Production, transportation, and material moving
-        "S2401_C01_033E": "ProdTransMoving",
-        "S2401_C01_034E": "Production",
-        "S2401_C01_035E": "Transportation",
-        "S2401_C01_036E": "MaterialMoving"
-    }
-
-    results = []
-    missing_zips = []
-    
-    for zip_code in zip_codes:
-        params = {
-            "get": "NAME," + ",".join(occupation_vars.keys()),
-            "for": f"zip code tabulation area:{zip_code}",
-            "key": CENSUS_API_KEY
-        }
-        response = requests.get(BASE_URL_SUBJECT, params=params)
-
-        if response.status_code == 200:
-            data = response.json()
-            if len(data) > 1:
-                results.append(data[1])
-            else:
-                missing_zips.append(zip_code)
-        else:
-            print(f"Error {response.status_code} for ZIP {zip_code}: {response.text}")
-            missing_zips.append(zip_code)
-
-    cols = ["ZCTA_Name"] + list(occupation_vars.values()) + ["ZipCode"]
-    occupation_df = pd.DataFrame(results, columns=cols)
-
-    # Convert numeric
-    for col in occupation_vars.values():
-        occupation_df[col] = pd.to_numeric(occupation_df[col], errors="coerce")
-
-    # Map TownName
-    occupation_df["TownName"] = occupation_df["ZipCode"].map(ROCKLAND_ZIPS_TOWNS)
-
-    # Fill missing
-    if missing_zips:
-        missing_df = pd.DataFrame(missing_zips, columns=["ZipCode"])
-        missing_df["ZCTA_Name"] = "N/A"
-        for col in occupation_vars.values():
-            missing_df[col] = None
-        missing_df["TownName"] = missing_df["ZipCode"].map(ROCKLAND_ZIPS_TOWNS)
-        occupation_df = pd.concat([occupation_df, missing_df], ignore_index=True)
-
-    return occupation_df
+    return _table_frame("occupation", zip_codes, vintage)
 
 # -------------------------------------------------
 # 3. FETCH 2020 DHC Table P8 (Race) [63 Columns]
 # -------------------------------------------------
 
-# The Census API has a 50-variable limit, so we split the 63 P8 columns into two chunks
+# More than the API's 50-variable limit; the fetch engine splits it (see section 4)
 p8_labels = {
     "P8_001N": "Total",
     "P8_002N": "Population of one race",
@@ -296,103 +378,253 @@ p8_labels = {
     "P8_063N": "Population of five or six races"
 }
 
-p8_codes = list(p8_labels.keys())
-
-# Because we have 63 variables (plus NAME), we must split into 2 requests
-chunkA = p8_codes[:31]
-chunkB = p8_codes[31:]
-
-def fetch_p8_chunk(zip_codes, p8_chunk):
-    """Fetch a subset of P8 columns (<= ~49) for the given ZIPs from the 2020 DHC."""
-    zips_str = ",".join(zip_codes)
-    get_vars = ["NAME"] + p8_chunk
-    params = {
-        "get": ",".join(get_vars),
-        "for": f"zip code tabulation area:{zips_str}",
-        "key": CENSUS_API_KEY
-    }
-    r = requests.get(BASE_URL_2020_DHC, params=params)
-    if r.status_code != 200:
-        raise ValueError(f"Error {r.status_code}: {r.text}")
-    
-    data = r.json()
-    if len(data) <= 1:
-        return pd.DataFrame(columns=get_vars + ["zip code tabulation area"])
-    
-    headers = data[0]
-    rows = data[1:]
-    df = pd.DataFrame(rows, columns=headers)
-    return df
-
-def get_p8_race_data(zip_codes=ROCKLAND_ZIPS_TOWNS.keys()):
+def get_p8_race_data(zip_codes=UNIVERSE.zips, vintage=DHC_VINTAGE):
     """
     Retrieve all 63 columns of 2020 DHC Table P8 (race) for the specified ZIPs.
     Returns a DataFrame with numeric columns named after p8_labels.
     Also includes a 'ZipCode' column and 'TownName'.
+    DHC only exists for 2020; `vintage` is there for a uniform fetcher signature.
     """
-    # 1) chunk A
-    dfA = fetch_p8_chunk(zip_codes, chunkA)
-    # 2) chunk B
-    dfB = fetch_p8_chunk(zip_codes, chunkB)
-    
-    # Merge them on [NAME, zip code tabulation area]
-    merged = pd.merge(
-        dfA, dfB,
-        on=["NAME", "zip code tabulation area"],
-        how="outer"
+    return _table_frame("race", zip_codes, vintage)
+
+# -------------------------------------------------
+# 4. TABLE REGISTRY + CHUNKED FETCH ENGINE
+# -------------------------------------------------
+# The API accepts at most 50 "get" variables per call, NAME included
+CENSUS_VARIABLE_LIMIT = 50
+
+
+@dataclass(frozen=True)
+class CensusVariable:
+    code: str
+    label: str
+    dtype: str = dataset_schema.COUNT_DTYPE
+    view: Optional[str] = None  # column group listed apart from its table (see CensusTable.views)
+
+
+@dataclass(frozen=True)
+class CensusTable:
+    """A set of variables from one Census endpoint, fetched and joined per ZIP."""
+    name: str
+    base_url: str
+    variables: Tuple[CensusVariable, ...]
+    total: Optional[str] = None  # label of the table's denominator column
+    description: str = ""
+    vintage: Optional[int] = None  # year in base_url
+    vintages: Tuple[int, ...] = ()  # every year the endpoint is published for ZCTAs
+    # (name, total label) of column groups fetched in the table's requests but
+    # requested, and shown, on their own; a code may back a label of each
+    views: Tuple[Tuple[str, Optional[str]], ...] = ()
+
+    @property
+    def labels(self):
+        """{code: label} of the table's own columns (views excluded)."""
+        return {v.code: v.label for v in self.variables if v.view is None}
+
+    @property
+    def columns(self):
+        """{label: code} of every column the table produces, views included."""
+        return {v.label: v.code for v in self.variables}
+
+    def view_labels(self, view):
+        """Labels of the `view` columns, in registry order."""
+        return [v.label for v in self.variables if v.view == view]
+
+    @property
+    def geo_within(self):
+        """Parent geography for the ZCTA "for" clause, when the vintage needs one."""
+        if self.vintage is not None and self.vintage < ZCTA_UNNESTED_FROM:
+            return f"state:{ZCTA_STATE}"
+        return None
+
+    def at(self, vintage):
+        """
+        The same table for another vintage: same variables, that year's
+        endpoint. Raises ValueError when the table isn't published for it.
+        """
+        if vintage == self.vintage:
+            return self
+        if vintage not in self.vintages:
+            published = vintage_span(self.vintages)
+            raise ValueError(f"Table {self.name} has no {vintage} vintage (available: {published}).")
+        base_url = self.base_url.replace(f"/data/{self.vintage}/", f"/data/{vintage}/", 1)
+        return replace(self, base_url=base_url, vintage=vintage)
+
+    def chunks(self):
+        """
+        The table's "get" lists, each within CENSUS_VARIABLE_LIMIT. Only the
+        first carries NAME. Deterministic, so chunk cache keys stay stable.
+        """
+        codes = ["NAME"] + list(dict.fromkeys(v.code for v in self.variables))
+        return [
+            tuple(codes[i:i + CENSUS_VARIABLE_LIMIT])
+            for i in range(0, len(codes), CENSUS_VARIABLE_LIMIT)
+        ]
+
+
+def vintage_span(vintages):
+    """"2011-2023" for a run of years, "2020" for one."""
+    if not vintages:
+        return "none"
+    return str(vintages[0]) if len(vintages) == 1 else f"{min(vintages)}-{max(vintages)}"
+
+
+def census_table(name, base_url, labels, total=None, description="", vintage=None, vintages=(), views=None):
+    """Registry entry from a {code: label} dict; `views` maps a view name to (total label, {code: label})."""
+    variables = tuple(CensusVariable(code, label) for code, label in labels.items())
+    for view, (_, view_labels) in (views or {}).items():
+        variables += tuple(CensusVariable(code, label, view=view) for code, label in view_labels.items())
+    view_totals = tuple((view, view_total) for view, (view_total, _) in (views or {}).items())
+    return CensusTable(
+        name, base_url, variables, total, description, vintage, tuple(vintages) or (vintage,), view_totals
     )
-    
-    # Rename columns from P8_xxxN to labels + convert to numeric
-    for code, label in p8_labels.items():
-        if code in merged.columns:
-            merged.rename(columns={code: label}, inplace=True)
-            merged[label] = pd.to_numeric(merged[label], errors="coerce")
-    
-    # Convert "zip code tabulation area" into "ZipCode"
-    # so we can merge with the ACS data
-    merged["ZipCode"] = merged["zip code tabulation area"]
-    
-    # Map to TownName
-    merged["TownName"] = merged["ZipCode"].map(ROCKLAND_ZIPS_TOWNS)
 
-    return merged
+
+# Adding a table here is enough for the API, the planner and the prompt data
+CENSUS_TABLES = {
+    table.name: table
+    for table in (
+        census_table(
+            "income", BASE_URL, {"B01001_001E": "TotalPopulation", **income_vars},
+            total="TotalPopulation", description="ACS 5-year B01001/B19001/B19013",
+            vintage=ACS_VINTAGE, vintages=ACS_VINTAGES,
+            views={"households": ("Households", household_income_labels)},
+        ),
+        census_table(
+            "occupation", BASE_URL_SUBJECT, occupation_vars,
+            total="CivEmp16Over", description="ACS 5-year subject table S2401",
+            vintage=ACS_VINTAGE, vintages=ACS_VINTAGES,
+        ),
+        census_table(
+            "race", BASE_URL_2020_DHC, p8_labels,
+            total=p8_labels["P8_001N"], description="2020 DHC table P8",
+            vintage=DHC_VINTAGE,
+        ),
+    )
+}
+
+
+def fetch_chunk(table, get_vars, zip_codes):
+    """
+    One batched call for the `get_vars` chunk of `table` (see census_get_rows).
+    Returns the raw string columns indexed by ZipCode. A rejected request
+    (CensusAPIError) is logged and yields no rows, so those ZIPs read as missing;
+    the frame's attrs["rejected"] holds the error.
+    """
+    zip_codes = list(zip_codes)
+    rejected = None
+    try:
+        headers, rows = census_get_rows(table.base_url, get_vars, zip_codes, table.geo_within)
+    except CensusAPIError as exc:
+        shown = ",".join(zip_codes[:25]) + (f" (+{len(zip_codes) - 25} more)" if len(zip_codes) > 25 else "")
+        print(f"{exc} for ZIPs {shown}")
+        headers, rows, rejected = list(get_vars) + [ZCTA_GEO_COLUMN], [], str(exc)
+    df = pd.DataFrame(rows, columns=headers).set_index(ZCTA_GEO_COLUMN)
+    df.index.name = "ZipCode"
+    if rejected is not None:
+        df.attrs["rejected"] = rejected
+    return df
+
+
+def assemble_table(table, chunk_frames, zip_codes):
+    """
+    Join the chunk frames of `table` on their ZipCode index, reindexed to
+    `zip_codes` (missing ZIPs become null rows). The value block is converted
+    in one pass to the registry dtypes (see dataset_schema.py) and renamed to
+    labels. Columns: ZCTA_Name, <labels>. attrs["rejected"] lists the errors
+    of rejected chunks (see fetch_chunk), if any.
+    """
+    raw = pd.concat(chunk_frames, axis=1).reindex(pd.Index(list(zip_codes), name="ZipCode"))
+    columns = {label: code for label, code in table.columns.items() if code in raw.columns}
+    dtypes = {v.label: v.dtype for v in table.variables if v.label in columns}
+    block = dataset_schema.numeric_block(raw[list(dict.fromkeys(columns.values()))])
+    # A code shared by a view becomes one column per label
+    block = block[list(columns.values())].set_axis(list(columns), axis=1)
+    values = dataset_schema.apply_schema(block, dtypes)
+    values.insert(0, "ZCTA_Name", raw["NAME"] if "NAME" in raw.columns else None)
+    rejected = [f.attrs["rejected"] for f in chunk_frames if "rejected" in f.attrs]
+    if rejected:
+        # Incomplete: callers that keep frames for good (timeseries) must not store it
+        values.attrs["rejected"] = rejected
+    return values
+
+
+def fetch_table(table, zip_codes, chunks=None):
+    """Fetch `chunks` (default: all) of `table` in one parallel round and assemble them."""
+    zip_codes = list(zip_codes)
+    chunks = chunks or table.chunks()
+    with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+        # Each worker runs in a copy of our context so the census_client deadline applies
+        futures = [
+            pool.submit(contextvars.copy_context().run, fetch_chunk, table, chunk, zip_codes)
+            for chunk in chunks
+        ]
+        frames = [future.result() for future in futures]
+    return assemble_table(table, frames, zip_codes)
+
+
+def join_tables(table_frames, zip_codes):
+    """
+    Merged dataset from assembled table frames: one row per requested ZIP,
+    in order, with categorical ZipCode/TownName and every table's columns.
+    """
+    keys = dataset_schema.key_frame(zip_codes, UNIVERSE.towns)
+    values = [f.drop(columns="ZCTA_Name") for f in table_frames]
+    return pd.concat([keys] + values, axis=1).reset_index(drop=True)
+
+
+def tables_at(vintage, names=None):
+    """
+    Registry tables (or just `names`) for `vintage`. Tables not published
+    for it (the 2020-only DHC race table) keep their own vintage.
+    """
+    tables = [CENSUS_TABLES[name] for name in (names or CENSUS_TABLES)]
+    if vintage is None:
+        return tables
+    return [table.at(vintage) if vintage in table.vintages else table for table in tables]
+
+
+def build_dataset(zip_codes=UNIVERSE.zips, tables=None, vintage=None):
+    """Fetch every registered table (or just `tables`), at `vintage` where published, and join them per ZIP."""
+    zip_codes = list(zip_codes)
+    frames = [fetch_table(table, zip_codes) for table in tables_at(vintage, tables)]
+    return join_tables(frames, zip_codes)
+
+
+def _table_frame(name, zip_codes, vintage=None):
+    """One table in its standalone shape: [ZCTA_Name, <labels>, ZipCode, TownName]."""
+    table = CENSUS_TABLES[name]
+    df = fetch_table(table.at(vintage or table.vintage), zip_codes).reset_index()
+    df["ZCTA_Name"] = df["ZCTA_Name"].fillna("N/A")
+    df["TownName"] = df["ZipCode"].map(UNIVERSE.towns)
+    return df[["ZCTA_Name"] + list(CENSUS_TABLES[name].labels.values()) + ["ZipCode", "TownName"]]
 
 # -------------------------------------------------
-# 4. MAIN SCRIPT
+# 5. MAIN SCRIPT
 # -------------------------------------------------
-def main():
-    # A) Fetch population+income (ACS)
-    population_income_df = get_population_income_data()
-    print("Population & Income DataFrame:\n", population_income_df, "\n")
-
-    # B) Fetch occupation (ACS)
-    occupation_df = get_occupation_data()
-    print("Occupation DataFrame:\n", occupation_df, "\n")
-
-    # C) Merge them (ACS merges)
-    merged_acs = pd.merge(
-        population_income_df, 
-        occupation_df, 
-        on=["ZipCode", "TownName"], 
-        how="outer"
-    )
-    print("Merged ACS DataFrame:\n", merged_acs, "\n")
-
-    # D) Fetch 2020 DHC P8 Race data
-    race_df = get_p8_race_data()
-    print("P8 Race DataFrame:\n", race_df, "\n")
-
-    # E) Merge the ACS result with Race data
-    final_merged_df = pd.merge(
-        merged_acs, 
-        race_df, 
-        on=["ZipCode", "TownName"], 
-        how="outer"
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch the merged dataset and write an AI report, or a batch of them.")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("report", help="One report on every ZIP, printed (the default)")
+    import report_batch
+    report_batch.add_arguments(
+        sub.add_parser("batch", help="Reports for every job of a JSONL file, written to disk (see report_batch.py)")
     )
+    args = parser.parse_args(argv)
+    if args.command == "batch":
+        sys.exit(report_batch.main(args))
+
+    # A) Fetch every registered table (income, occupation, race), chunks in parallel
+    for name, table in CENSUS_TABLES.items():
+        print(f"{name}: {table.description}, {len(table.variables)} variables in {len(table.chunks())} request(s)")
+    final_merged_df = build_dataset()
     print("Final Merged (Income, Occupation, Race) DataFrame:\n", final_merged_df, "\n")
+    print("Memory:", dataset_schema.memory_report(final_merged_df), "\n")
 
-    # Convert to CSV
-    final_csv = final_merged_df.to_csv(index=False)
+    # Compact, token-budgeted CSV (see prompt_encoder.py)
+    import prompt_encoder
+    encoded = prompt_encoder.encode_dataset(final_merged_df)
+    print(f"Prompt data: {encoded.tokens} tokens ({encoded.level})\n")
 
     # ----------------------------------
     # Build GPT Prompt
@@ -401,15 +633,16 @@ def main():
         "You are an analytical assistant. Below is a merged dataset that combines:\n"
         "- Income data (from 2021 ACS, B19001/B19013)\n"
         "- Occupational data (from 2021 ACS Subject Table S2401)\n"
-        "- Race data (from 2020 Decennial Census DHC Table P8, including 63 race categories)\n\n"
-        f"Here is the data in CSV format:\n\n{final_csv}\n\n"
+        "- Race data (from 2020 Decennial Census DHC Table P8, with multi-race rollups)\n\n"
+        f"{encoded.notes}\n\n"
+        f"Here is the data in CSV format:\n\n{encoded.text}\n\n"
         "Please provide a comprehensive semantic analysis exploring the relationship between income distribution, "
         "occupational profile, and racial composition in these Rockland County ZIP codes."
     )
 
     # Send prompt to OpenAI
     try:
-        response = openai.ChatCompletion.create(
+        response = get_openai().ChatCompletion.create(
             model="gpt-4o-mini",  # or "gpt-4"/"gpt-3.5-turbo"
             messages=[{"role": "user", "content": prompt_text}],
             max_tokens=1000,
@@ -0,0 +1,243 @@
+"""
+Vectorized rollups of the merged dataset over arbitrary ZIP groupings.
+
+The county frame is turned once per dataset version into a dense float64
+ZIP x variable matrix. A request's groups become a 0/1 membership matrix, so
+every group's sums are one matrix product. On top of those sums:
+- population-weighted shares: sum of a count / sum of its table total, which
+  is the correct rollup (averaging per-ZIP percentages is not)
+- median household income interpolated from the summed B19001 brackets,
+  the way the Census Bureau derives medians from a distribution (linear
+  within the bracket holding the midpoint; a median in the open-ended
+  $200K+ bracket is reported as 200000 and flagged `top_coded`)
+- comparisons: each group minus a baseline group (by default the whole
+  universe: the county, state or nation of GEO_SCOPE), in units for counts
+  and medians and percentage points for shares
+
+Predefined groups are the universe as a whole (BASELINE) and, when the
+universe is the built-in Rockland county, its five towns and three regions.
+
+Per-ZIP medians (B19013) cannot be combined, so MedianIncome is never summed.
+ZCTAs cross town lines; each ZIP counts toward its primary town only.
+Missing values (ZIPs without data) count as zero.
+"""
+import time
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+import MainAI3 as core
+import query_plan
+
+
+def _scope_name(universe) -> str:
+    """"Rockland County", "State 36" or "United States": the name of the whole-universe group."""
+    if universe.label:
+        return universe.label
+    if universe.scope == "state":
+        return f"State {', '.join(universe.states)}"
+    return "United States"
+
+
+# The whole universe; the default baseline
+BASELINE = _scope_name(core.UNIVERSE)
+
+# Primary town (of Rockland's five) for each ZIP
+TOWN_ZIPS = {
+    "Clarkstown": ["10920", "10956", "10989", "10994"],
+    "Haverstraw": ["10923", "10927", "10993"],
+    "Orangetown": ["10913", "10960", "10962", "10964", "10965", "10968", "10976", "10983"],
+    "Ramapo": ["10901", "10931", "10952", "10970", "10974", "10977"],
+    "Stony Point": ["10980", "10986"],
+}
+REGIONS = {
+    "East county": TOWN_ZIPS["Clarkstown"] + TOWN_ZIPS["Orangetown"],
+    "West county": TOWN_ZIPS["Ramapo"],
+    "North county": TOWN_ZIPS["Haverstraw"] + TOWN_ZIPS["Stony Point"],
+}
+GROUPS = {BASELINE: list(core.UNIVERSE.zips)}
+if set(core.UNIVERSE.zips) == set(core.ROCKLAND_ZIPS_TOWNS):
+    GROUPS = {**TOWN_ZIPS, **REGIONS, **GROUPS}
+
+BRACKETS = [label for _, label, _, _ in core.B19001_BRACKETS]
+BRACKET_LOWER = np.array([lower for _, _, lower, _ in core.B19001_BRACKETS], dtype="float64")
+BRACKET_UPPER = np.array([np.inf if upper is None else upper for _, _, _, upper in core.B19001_BRACKETS])
+HOUSEHOLDS = query_plan.TABLE_TOTALS["households"]
+
+# Household income bands reported as shares, from the bracket columns
+INCOME_BANDS = {
+    "HHIncome_Under_50K": [label for label, upper in zip(BRACKETS, BRACKET_UPPER) if upper <= 50000],
+    "HHIncome_50K_100K": [label for label, lower, upper in zip(BRACKETS, BRACKET_LOWER, BRACKET_UPPER)
+                          if lower >= 50000 and upper <= 100000],
+    "HHIncome_100K_200K": [label for label, lower, upper in zip(BRACKETS, BRACKET_LOWER, BRACKET_UPPER)
+                           if lower >= 100000 and upper <= 200000],
+    "HHIncome_200K_Plus": [label for label, lower in zip(BRACKETS, BRACKET_LOWER) if lower >= 200000],
+}
+
+# Default share fields per table (the table total is the denominator)
+DEFAULT_SHARES = {
+    "occupation": ["MgmtBusSciArts", "ServiceOcc", "SalesOfficeOcc", "NatResConstMaint", "ProdTransMoving"],
+    "race": [core.p8_labels[f"P8_{n:03d}N"] for n in range(3, 10)],
+}
+# Summed counts reported per group
+DEFAULT_COUNTS = ["TotalPopulation", HOUSEHOLDS, core.CENSUS_TABLES["occupation"].total,
+                  core.CENSUS_TABLES["race"].total]
+# Columns that are not counts and never add up
+NOT_ADDITIVE = {"MedianIncome"}
+
+FIELD_TOTALS = {
+    label: total
+    for table, total in query_plan.TABLE_TOTALS.items()
+    for label in query_plan.TABLES[table] if label != total
+}
+
+
+GroupSpec = Union[Iterable[str], Dict[str, Iterable[str]]]
+
+
+def resolve_groups(spec: GroupSpec, allowed: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    {group name: ZIPs} from a list of predefined group names (GROUPS:
+    BASELINE, plus towns and regions in Rockland; case-insensitive) and/or a {name: [ZIPs]} mapping.
+    Raises ValueError on unknown names or ZIPs.
+    """
+    if not isinstance(allowed, (set, frozenset, dict)):
+        allowed = set(allowed)
+    by_name = {name.lower(): name for name in GROUPS}
+    items = spec.items() if isinstance(spec, dict) else ((name, None) for name in spec)
+    groups = {}
+    for name, zips in items:
+        if zips is None:
+            if name.strip().lower() not in by_name:
+                raise ValueError(f"Unknown group {name!r}. Use any of {list(GROUPS)} or a {{name: [zips]}} mapping.")
+            name = by_name[name.strip().lower()]
+            zips = GROUPS[name]
+        zips = list(dict.fromkeys(str(z).strip() for z in zips))
+        unknown = [z for z in zips if z not in allowed]
+        if unknown or not zips:
+            raise ValueError(f"Group {name!r}: unsupported or no ZIPs {unknown}.")
+        groups[name] = zips
+    if not groups:
+        raise ValueError("No groups given.")
+    return groups
+
+
+def interpolated_median(counts: np.ndarray, lower: np.ndarray, upper: np.ndarray):
+    """
+    Medians of bracketed distributions, one per row of `counts` (groups x
+    brackets). Returns (medians, top_coded): linear interpolation inside the
+    bracket holding the midpoint; the lower bound of an open-ended bracket
+    (top_coded True). Rows without any count give NaN.
+    """
+    totals = counts.sum(axis=1)
+    cumulative = counts.cumsum(axis=1)
+    half = totals / 2
+    index = (cumulative < half[:, None]).sum(axis=1).clip(max=counts.shape[1] - 1)
+    below = np.take_along_axis(cumulative, index[:, None], axis=1)[:, 0] - counts[np.arange(len(counts)), index]
+    inside = counts[np.arange(len(counts)), index]
+    lo, hi = lower[index], upper[index]
+    top_coded = np.isinf(hi)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        medians = np.where(top_coded, lo, lo + (half - below) / inside * (hi - lo))
+    medians = np.where(totals > 0, medians, np.nan)
+    return medians, top_coded & (totals > 0)
+
+
+class AggregateEngine:
+    """ZIP x variable matrix of one dataset version; aggregates any grouping of its ZIPs."""
+
+    def __init__(self, frame: pd.DataFrame, version: Optional[str] = None):
+        self.version = version
+        self.zips = [str(z) for z in frame["ZipCode"]]
+        self.rows = {z: i for i, z in enumerate(self.zips)}
+        numeric = [c for c in frame.columns if c not in NOT_ADDITIVE and pd.api.types.is_numeric_dtype(frame[c])]
+        self.columns = numeric
+        self._col = {c: i for i, c in enumerate(numeric)}
+        # Missing values count as zero in every sum
+        self.matrix = frame[numeric].to_numpy(dtype="float64", na_value=np.nan)
+        self.matrix = np.nan_to_num(self.matrix, nan=0.0)
+        self._brackets = [self._col[b] for b in BRACKETS if b in self._col]
+
+    def membership(self, groups: Dict[str, List[str]]) -> np.ndarray:
+        member = np.zeros((len(groups), len(self.zips)))
+        for i, zips in enumerate(groups.values()):
+            member[i, [self.rows[z] for z in zips if z in self.rows]] = 1.0
+        return member
+
+    def aggregate(self, groups: Dict[str, List[str]], fields: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        One row per group: ZIP count, summed counts, median household income
+        and population-weighted " %" shares (of DEFAULT_SHARES and the income
+        bands, plus any extra count `fields`).
+        """
+        sums = self.membership(groups) @ self.matrix
+        col = self._col
+        out = {"ZIPs": np.array([len(z) for z in groups.values()])}
+
+        for name in DEFAULT_COUNTS + [f for f in fields or [] if f not in DEFAULT_COUNTS]:
+            if name in col:
+                out[name] = sums[:, col[name]]
+
+        if len(self._brackets) == len(BRACKETS):
+            medians, top_coded = interpolated_median(sums[:, self._brackets], BRACKET_LOWER, BRACKET_UPPER)
+            out["MedianHouseholdIncome"] = medians.round(0)
+            out["MedianHouseholdIncome_top_coded"] = top_coded
+
+        shares = {label: HOUSEHOLDS for label in INCOME_BANDS}
+        for table, labels in DEFAULT_SHARES.items():
+            shares.update({label: core.CENSUS_TABLES[table].total for label in labels})
+        shares.update({f: FIELD_TOTALS[f] for f in fields or [] if f in FIELD_TOTALS})
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for label, total in shares.items():
+                if total not in col:
+                    continue
+                if label in INCOME_BANDS:
+                    members = [col[b] for b in INCOME_BANDS[label] if b in col]
+                    if not members:
+                        continue
+                    numerator = sums[:, members].sum(axis=1)
+                elif label in col:
+                    numerator = sums[:, col[label]]
+                else:
+                    continue
+                denominator = sums[:, col[total]]
+                out[f"{label} %"] = np.where(denominator > 0, numerator / denominator * 100, np.nan).round(2)
+
+        return pd.DataFrame(out, index=pd.Index(list(groups), name="Group"))
+
+
+def compare(result: pd.DataFrame, baseline: str) -> pd.DataFrame:
+    """Every other group minus `baseline` (shares in percentage points)."""
+    numeric = [c for c in result.columns if c not in ("ZIPs",) and not c.endswith("_top_coded")]
+    return (result.loc[result.index != baseline, numeric] - result.loc[baseline, numeric]).round(2)
+
+
+def run(engine: AggregateEngine, spec: GroupSpec, fields: Optional[List[str]] = None,
+        baseline: Optional[str] = None) -> dict:
+    """Aggregate `spec` (plus the baseline group, BASELINE by default) and compare against it."""
+    groups = resolve_groups(spec, engine.rows)
+    baseline = baseline or BASELINE
+    if baseline not in groups:
+        groups.update(resolve_groups([baseline], engine.rows))
+    started = time.perf_counter()
+    result = engine.aggregate(groups, fields)
+    differences = compare(result, baseline)
+    elapsed = time.perf_counter() - started
+    return {
+        "groups": groups,
+        "result": result,
+        "baseline": baseline,
+        "differences": differences,
+        "elapsed_us": round(elapsed * 1e6, 1),
+    }
+
+
+def prompt_table(result: pd.DataFrame) -> str:
+    """Compact CSV of an aggregate result for the LLM prompt."""
+    table = result.drop(columns=[c for c in result.columns if c.endswith("_top_coded")])
+    top = [g for g in result.index if result.get("MedianHouseholdIncome_top_coded", pd.Series(dtype=bool)).get(g)]
+    text = table.round(1).to_csv()
+    if top:
+        text += f"(MedianHouseholdIncome for {', '.join(top)} is at least 200000: top-coded bracket)\n"
+    return text
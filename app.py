@@ -3,25 +3,83 @@ FastAPI wrapper around the MainAI3 data pipeline.
 
 Endpoints
 - GET /api/health
-- GET /api/zip-data?zips=10901,10952
-- POST /api/ai-report   { "zips": [...], "temperature": 0.85 }
+- GET /api/zip-data?zips=10901,10952[&format=records|split|columnar|arrow|parquet]
+      [&tables=income,occupation,race][&fields=MedianIncome,...]
+- POST /api/aggregate   { "groups": ["Ramapo", "East county"] | {"name": [zips]}, "fields": [...] }
+      exact group rollups (see aggregate.py); GET /api/aggregate/groups lists the names
+- GET /api/zip-data/series?zips=...&from=2012&to=2021[&tables=...][&fields=...][&format=...]
+      one row per ZIP and vintage (see timeseries.py)
+- POST /api/ai-report   { "zips": [...], "temperature": 0.85, "mode": "single" | "map_reduce",
+                          "latency_target": 8 }
+      map_reduce: cached per-ZIP fragments combined in one pass (see narratives.py)
+      latency_target: seconds; picks model and output budget, falls back within it (see llm_router.py)
+- POST /api/ai-report/stream   same body; Server-Sent Events (data, token..., done)
+- POST /api/ai-report/jobs   same body + "priority" (0-9); 202 with a job ID
+- GET /api/ai-report/jobs/{id}[?wait=30]   status, plus the report once done
+- GET /api/ai-report/jobs/{id}/events   Server-Sent Events (status..., done|error)
+- GET /api/metrics   Prometheus text format (see metrics.py)
+
+The data endpoints are async: every Census request (tables are split into
+chunks under the API's 50-variable limit) runs concurrently (bounded by
+CENSUS_MAX_CONCURRENCY), so latency tracks the slowest request.
+The merged dataset for all ZIPs is materialized at startup and refreshed every
+DATASET_REFRESH_SECONDS; requests slice it instead of calling the Census API.
+Census rows, the dataset and AI reports are cached in stores every worker
+process shares, so scaling out (uvicorn --workers, replicas) keeps one warm
+cache and one upstream refresh per key (see shared_cache.py).
+Every response carries a Server-Timing header with the pipeline stages it ran.
 """
+import asyncio
+import hashlib
+import json
 import os
-from typing import List, Optional
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 
 import pandas as pd
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
 # Unset SSLKEYLOGFILE so urllib3/requests don't try to write to it in the uvicorn subprocess (avoids PermissionError on virtual paths)
 os.environ.pop("SSLKEYLOGFILE", None)
 
+import aggregate
+import census_client
+import llm_router
 import MainAI3 as core
+import metrics
+import narratives
+import prompt_encoder
+import query_plan
+import report_cache
+import report_jobs
+import response_formats
+import dataset_store
+import shared_cache
+import snapshot
+import timeseries
+from dataset_store import CountyDataset, index_by_zip, slice_frame
 
 # --- Config ---
-ALLOWED_ZIPS = list(core.ROCKLAND_ZIPS_TOWNS.keys())
+ALLOWED_ZIPS = core.UNIVERSE.zips
+AREA = f"{core.UNIVERSE.label} " if core.UNIVERSE.label else ""
+# Most ZIPs one request may name; beyond county scope a request must name its ZIPs
+GEO_MAX_ZIPS = int(os.getenv("GEO_MAX_ZIPS", "1000"))
 DEFAULT_TEMPERATURE = 0.85
+OPENAI_MODEL = "gpt-4o-mini"
+OPENAI_MAX_TOKENS = 1000
+# Slack past a narrative deadline for the router's own work (template, cache write)
+ROUTE_GRACE_SECONDS = 1.0
+OPENAI_RATE_PER_MINUTE = float(os.getenv("OPENAI_RATE_PER_MINUTE", "0"))
+OPENAI_RATE_BURST = int(os.getenv("OPENAI_RATE_BURST", "5"))
+CENSUS_MAX_CONCURRENCY = int(os.getenv("CENSUS_MAX_CONCURRENCY", "4"))
+CENSUS_PIPELINE_DEADLINE = float(os.getenv("CENSUS_PIPELINE_DEADLINE", "60"))
+DATASET_REFRESH_SECONDS = float(os.getenv("DATASET_REFRESH_SECONDS", str(24 * 3600)))
+PRELOAD_DATASET = os.getenv("PRELOAD_DATASET", "1").strip().lower() not in ("0", "false", "no")
 
 ALLOWED_ORIGINS = [
     origin.strip()
@@ -32,23 +90,35 @@ ALLOWED_ORIGINS = [
 # --- Helpers ---
 
 
+def _all_zips() -> List[str]:
+    if len(ALLOWED_ZIPS) > GEO_MAX_ZIPS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Name the ZIPs (up to {GEO_MAX_ZIPS}); GEO_SCOPE={core.UNIVERSE.scope} has {len(ALLOWED_ZIPS)}.",
+        )
+    return ALLOWED_ZIPS
+
+
 def _validated_zip_list(zips: Optional[List[str]]) -> List[str]:
-    """Return a cleaned list of ZIPs limited to Rockland set; default to all."""
+    """Return a cleaned list of ZIPs limited to the GEO_SCOPE universe; default to all."""
     if not zips:
-        return ALLOWED_ZIPS
+        return _all_zips()
     cleaned = []
     for z in zips:
         zc = z.strip()
         if not zc:
             continue
-        if zc not in core.ROCKLAND_ZIPS_TOWNS:
+        if zc not in core.UNIVERSE:
+            hint = f"one of {ALLOWED_ZIPS}" if len(ALLOWED_ZIPS) <= 50 else "a ZIP listed by /api/geography"
             raise HTTPException(
                 status_code=400,
-                detail=f"ZIP {zc} is not allowed. Use one of {ALLOWED_ZIPS}.",
+                detail=f"ZIP {zc} is not allowed. Use {hint}.",
             )
         cleaned.append(zc)
     if not cleaned:
-        return ALLOWED_ZIPS
+        return _all_zips()
+    if len(cleaned) > GEO_MAX_ZIPS:
+        raise HTTPException(status_code=400, detail=f"At most {GEO_MAX_ZIPS} ZIPs per request.")
     return cleaned
 
 
@@ -61,26 +131,59 @@ def _require_env(key: str) -> str:
 
 def build_final_dataset(zip_codes: List[str]) -> pd.DataFrame:
     """Run the existing pipeline to produce the merged dataset."""
-    population_income_df = core.get_population_income_data(zip_codes)
-    occupation_df = core.get_occupation_data(zip_codes)
-    merged_acs = pd.merge(
-        population_income_df,
-        occupation_df,
-        on=["ZipCode", "TownName"],
-        how="outer",
-    )
-    race_df = core.get_p8_race_data(zip_codes)
-    final_df = pd.merge(
-        merged_acs,
-        race_df,
-        on=["ZipCode", "TownName"],
-        how="outer",
-    )
-    return final_df
+    with census_client.deadline(CENSUS_PIPELINE_DEADLINE), metrics.stage("census"):
+        return core.build_dataset(zip_codes)
+
+
+_census_slots = asyncio.Semaphore(CENSUS_MAX_CONCURRENCY)
+
+
+async def _bounded(func, *args):
+    """Run a blocking Census fetch in a worker thread, at most CENSUS_MAX_CONCURRENCY at once."""
+    async with _census_slots:
+        return await asyncio.to_thread(func, *args)
+
+
+async def fetch_tables_async(
+    chunks: List[Tuple[core.CensusTable, Tuple[str, ...]]], zip_codes: List[str]
+) -> List[pd.DataFrame]:
+    """
+    Fetch every (table, chunk) concurrently in one round and assemble each
+    table (tables may be different vintages of the same one). Returns one
+    frame per table, in first-seen order.
+    """
+    jobs = [_bounded(core.fetch_chunk, table, chunk, zip_codes) for table, chunk in chunks]
+    with census_client.deadline(CENSUS_PIPELINE_DEADLINE), metrics.stage("census"):
+        results = await asyncio.gather(*jobs)
+
+    with metrics.stage("assemble"):
+        chunk_frames = {}
+        for (table, _), frame in zip(chunks, results):
+            chunk_frames.setdefault(table, []).append(frame)
+        return [core.assemble_table(table, frames, zip_codes) for table, frames in chunk_frames.items()]
+
+
+async def build_final_dataset_async(
+    zip_codes: List[str], plan: query_plan.QueryPlan = query_plan.FULL_PLAN
+) -> pd.DataFrame:
+    """
+    Same result as build_final_dataset, with every chunk of every table
+    fetched concurrently in one round. A narrower `plan` fetches and joins
+    only the tables (and chunks) it needs.
+    """
+    chunks = [(core.CENSUS_TABLES[name], chunk) for name, chunk in plan.chunks]
+    tables = await fetch_tables_async(chunks, zip_codes)
+    with metrics.stage("assemble"):
+        return query_plan.project(core.join_tables(tables, zip_codes), plan)
+
 
+async def _build_vintages(tables: List[core.CensusTable], zip_codes: List[str]) -> List[pd.DataFrame]:
+    """timeseries builder: every chunk of every vintage in one bounded round."""
+    return await fetch_tables_async([(table, chunk) for table in tables for chunk in table.chunks()], zip_codes)
 
-def build_prompt(final_df: pd.DataFrame, user_prompt: Optional[str]) -> str:
-    final_csv = final_df.to_csv(index=False)
+
+def _prompt_sections(user_prompt: Optional[str], aggregates: Optional[pd.DataFrame] = None) -> str:
+    """Exact group figures and the user's request, as appended to a report prompt."""
     user_section = ""
     if user_prompt:
         trimmed = user_prompt.strip()
@@ -91,24 +194,327 @@ def build_prompt(final_df: pd.DataFrame, user_prompt: Optional[str]) -> str:
             f"{trimmed}\n\n"
             "Incorporate the user's request above while staying data-grounded."
         )
+    aggregate_section = ""
+    if aggregates is not None:
+        aggregate_section = (
+            "\nExact group figures, computed from the full ZIP data (counts are sums, "
+            "% are shares of the group's total, MedianHouseholdIncome is interpolated from "
+            "B19001 brackets). Use these for any group totals or comparisons instead of "
+            f"adding up rows:\n\n{aggregate.prompt_table(aggregates)}"
+        )
+    return f"{aggregate_section}{user_section}"
+
+
+def build_prompt(final_df: pd.DataFrame, user_prompt: Optional[str], aggregates: Optional[pd.DataFrame] = None) -> str:
+    with metrics.stage("prompt"):
+        encoded = prompt_encoder.encode_dataset(final_df, model=OPENAI_MODEL)
+    metrics.prompt_tokens.observe(encoded.tokens)
     return (
         "You are an analytical assistant. Below is a merged dataset that combines:\n"
         "- Income data (from 2021 ACS, B19001/B19013)\n"
         "- Occupational data (from 2021 ACS Subject Table S2401)\n"
-        "- Race data (from 2020 Decennial Census DHC Table P8, including 63 race categories)\n\n"
-        f"Here is the data in CSV format:\n\n{final_csv}\n"
-        f"{user_section}"
+        "- Race data (from 2020 Decennial Census DHC Table P8, with multi-race rollups)\n\n"
+        f"{encoded.notes}\n\n"
+        f"Here is the data in CSV format:\n\n{encoded.text}\n"
+        f"{_prompt_sections(user_prompt, aggregates)}"
         "Please provide a comprehensive semantic analysis exploring the relationship between income "
-        "distribution, occupational profile, and racial composition in these Rockland County ZIP codes."
+        f"distribution, occupational profile, and racial composition in these {AREA}ZIP codes."
     )
 
 
+def _plan_or_400(tables, fields, with_totals: bool = False, with_views: bool = False) -> query_plan.QueryPlan:
+    try:
+        return query_plan.plan_query(tables, fields, with_totals=with_totals, with_views=with_views)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+async def _planned_frame(zip_list: List[str], plan: query_plan.QueryPlan) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    (frame, version) able to answer `plan`: the materialized county frame when
+    it is loaded (or the plan needs everything anyway), otherwise an ad hoc
+    frame holding only the planned tables for `zip_list` (version None).
+    """
+    if plan.is_full or county_dataset.frame is not None:
+        return await county_dataset.snapshot()
+    return index_by_zip(await build_final_dataset_async(zip_list, plan)), None
+
+
+async def _planned_slice(zip_list: List[str], plan: query_plan.QueryPlan) -> pd.DataFrame:
+    frame, _ = await _planned_frame(zip_list, plan)
+    return query_plan.project(slice_frame(frame, zip_list), plan)
+
+
 def _ensure_openai_key():
     _require_env("OPENAI_API_KEY")
 
 
+# Model calls for the whole process (0 = unlimited); cached reports and fragments take none
+openai_limiter = census_client.TokenBucket(OPENAI_RATE_PER_MINUTE / 60, OPENAI_RATE_BURST)
+
+
+def _chat_completion(
+    prompt_text: str, model: str, temperature: float, max_tokens: int, timeout: Optional[float] = None
+) -> str:
+    openai_limiter.acquire()
+    # Using legacy openai.ChatCompletion to match existing dependency
+    with metrics.stage("openai"):
+        try:
+            response = core.get_openai().ChatCompletion.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt_text}],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                request_timeout=timeout,
+            )
+        except Exception:
+            metrics.openai_requests.inc(mode="complete", outcome="error")
+            raise
+    metrics.openai_requests.inc(mode="complete", outcome="ok")
+    usage = response.get("usage") or {}
+    metrics.openai_tokens.inc(usage.get("prompt_tokens", 0), kind="prompt")
+    metrics.openai_tokens.inc(usage.get("completion_tokens", 0), kind="completion")
+    return response.choices[0].message.content.strip()
+
+
+def _stream_chat_completion(
+    prompt_text: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    emit,
+    stop: threading.Event,
+    timeout: Optional[float] = None,
+) -> str:
+    """Blocking: pass each content delta to `emit` until the model finishes or `stop` is set."""
+    openai_limiter.acquire()
+    parts = []
+    with metrics.stage("openai"):
+        try:
+            stream = core.get_openai().ChatCompletion.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt_text}],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                request_timeout=timeout,
+            )
+            try:
+                for chunk in stream:
+                    if stop.is_set():
+                        break
+                    delta = chunk.choices[0].delta.get("content")
+                    if delta:
+                        parts.append(delta)
+                        emit(delta)
+            finally:
+                # Closing the generator drops the upstream HTTP response
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+        except Exception:
+            metrics.openai_requests.inc(mode="stream", outcome="error")
+            raise
+    metrics.openai_requests.inc(mode="stream", outcome="stopped" if stop.is_set() else "ok")
+    # Streamed responses carry no usage; each content chunk is about one token
+    metrics.openai_tokens.inc(prompt_encoder.count_tokens(prompt_text, model), kind="prompt")
+    metrics.openai_tokens.inc(len(parts), kind="completion")
+    return "".join(parts).strip()
+
+
+def _sse(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+reports = report_cache.from_env()
+llm = llm_router.from_env(_chat_completion, OPENAI_MODEL, OPENAI_MAX_TOKENS)
+
+
+vintages = timeseries.VintageStore(ALLOWED_ZIPS, timeseries.store_from_env(), _build_vintages)
+
+
+county_dataset = CountyDataset(
+    build_final_dataset_async,
+    ALLOWED_ZIPS,
+    DATASET_REFRESH_SECONDS,
+    store=dataset_store.from_env(),
+    # A registry change must not load another deploy's frame from the shared store
+    store_key=hashlib.sha1(repr(core.CENSUS_TABLES).encode("utf-8")).hexdigest(),
+)
+
+
+_engine: Optional[aggregate.AggregateEngine] = None
+
+
+async def _aggregate_engine() -> aggregate.AggregateEngine:
+    """Aggregation matrix of the current county dataset build; rebuilt when its version changes."""
+    global _engine
+    frame, version = await county_dataset.snapshot()
+    if _engine is None or _engine.version != version:
+        _engine = aggregate.AggregateEngine(frame, version)
+    return _engine
+
+
+class ReportParams(NamedTuple):
+    zips: List[str]
+    temperature: float
+    plan: query_plan.QueryPlan
+    user_prompt: Optional[str]
+    groups: Optional[Dict[str, List[str]]]  # resolved aggregate groups for the prompt
+    mode: str  # narratives.MODES
+    latency_target: Optional[float] = None  # seconds; None: no target, LLM_DEADLINE_SECONDS applies
+    columns: Optional[List[str]] = None  # response data columns; the plan adds views for the prompt
+
+
+async def _report_data(params: ReportParams) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """The ZIP slice for a report and, when groups were asked for, their exact aggregates."""
+    try:
+        final_df = await _planned_slice(params.zips, params.plan)
+        engine = await _aggregate_engine() if params.groups else None
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc)) from exc
+    if engine is None:
+        return final_df, None
+    try:
+        return final_df, aggregate.run(engine, params.groups)["result"]
+    except ValueError as exc:
+        # An unknown group or ZIP (see aggregate.resolve_groups), as on /api/aggregate
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+def _report_rows(final_df: pd.DataFrame, params: ReportParams) -> str:
+    """The report's `data` as a JSON array, without the columns only the prompt needed."""
+    if params.columns is not None:
+        final_df = final_df.reindex(columns=params.columns)
+    return response_formats.records_json(final_df)
+
+
+async def _complete(prompt_text: str, **params) -> str:
+    return await asyncio.to_thread(_chat_completion, prompt_text, **params)
+
+
+async def _report_prompt(
+    params: ReportParams, final_df: pd.DataFrame, aggregates: Optional[pd.DataFrame]
+) -> Tuple[str, Optional[dict]]:
+    """
+    (prompt, narrative info) for the final completion. In map_reduce mode the
+    per-ZIP fragments are fetched or generated first; the info says how many.
+    """
+    if params.mode != "map_reduce":
+        return build_prompt(final_df, params.user_prompt, aggregates), None
+    try:
+        fragments = await narratives.map_fragments(final_df, reports, _complete, OPENAI_MODEL, AREA)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"OpenAI API error: {exc}") from exc
+    prompt_text = narratives.combine_prompt(fragments, AREA, _prompt_sections(params.user_prompt, aggregates))
+    generated = sum(1 for f in fragments if f.cache == "miss")
+    return prompt_text, {"mode": "map_reduce", "fragments": len(fragments), "generated": generated}
+
+
+def _deadline(params: ReportParams, started: float) -> float:
+    """time.monotonic() by which a report's narrative must be served."""
+    return started + (params.latency_target or llm.deadline)
+
+
+async def _prompt_by(
+    params: ReportParams, final_df: pd.DataFrame, aggregates: Optional[pd.DataFrame], deadline: float
+) -> Tuple[Optional[str], Optional[dict]]:
+    """_report_prompt, or (None, info) once `deadline` passes (shielded fragments still fill the cache)."""
+    try:
+        return await asyncio.wait_for(
+            _report_prompt(params, final_df, aggregates), max(0.0, deadline - time.monotonic())
+        )
+    except asyncio.TimeoutError:
+        return None, {"mode": params.mode, "timed_out": True}
+
+
+def _route_for(prompt_text: str, params: ReportParams) -> Tuple[Optional[llm_router.Route], int]:
+    """(planned route or None, prompt tokens) for the final completion."""
+    prompt_tokens = prompt_encoder.count_tokens(prompt_text, OPENAI_MODEL)
+    return llm.plan(prompt_tokens, params.latency_target), prompt_tokens
+
+
+async def _generate_report(params: ReportParams) -> str:
+    """Dataset slice + narrative for one report, as the encoded JSON response body."""
+    zip_list, temperature = params.zips, params.temperature
+    started = time.monotonic()
+    deadline = _deadline(params, started)
+    final_df, aggregates = await _report_data(params)
+
+    def template() -> str:
+        return narratives.template_summary(final_df, aggregates, AREA)
+
+    prompt_text, narrative = await _prompt_by(params, final_df, aggregates, deadline)
+    route, prompt_tokens = _route_for(prompt_text, params) if prompt_text is not None else (None, 0)
+    if route is None:
+        error = "deadline passed before the prompt was ready" if prompt_text is None else "no model fits the target"
+        routed = llm.served(template(), "template", None, started, error)
+        ai_text, cache_status = routed.text, "miss"
+    else:
+        # Keyed by the planned model and budget: without a target that is the previous fixed call
+        routed = None
+        key = report_cache.report_key(
+            prompt_text, model=route.model, temperature=temperature, max_tokens=route.max_tokens
+        )
+
+        async def create() -> str:
+            nonlocal routed
+            routed = await llm.run(route, prompt_text, temperature, template, deadline, prompt_tokens)
+            # Only the planned answer is the report for this key; stand-ins serve this request alone
+            return routed.text if routed.path == "planned" else report_cache.Uncached(routed.text)
+
+        try:
+            ai_text, cache_status = await asyncio.wait_for(
+                reports.get_or_create(key, create), max(0.0, deadline - time.monotonic()) + ROUTE_GRACE_SECONDS
+            )
+        except asyncio.TimeoutError:
+            # Joined another request's call (or worker's lock) that outlasts this deadline
+            routed = llm.served(template(), "template", route, started, "deadline passed waiting on another request")
+            ai_text, cache_status = routed.text, "miss"
+        except Exception as exc:
+            raise HTTPException(status_code=500, detail=f"Report cache error: {exc}") from exc
+        metrics.report_cache_results.inc(source=cache_status)
+
+    with metrics.stage("serialize"):
+        raw = {"data": _report_rows(final_df, params)}
+        if aggregates is not None:
+            raw["aggregates"] = response_formats.records_json(aggregates.reset_index())
+        fields = {"zips": zip_list, "ai_summary": ai_text, "ai_cache": cache_status}
+        # hit / coalesced: served by another request's route
+        fields["ai_route"] = routed.info() if routed is not None else {"path": "cache"}
+        if narrative is not None:
+            fields["narrative"] = narrative
+        body = response_formats.raw_json_object(fields, raw)
+    metrics.response_bytes.observe(len(body), route="/api/ai-report", format="records")
+    return body
+
+
+report_queue = report_jobs.from_env(_generate_report)
+
+
+def seed_from_snapshot() -> bool:
+    """Seed county_dataset from the prebuilt snapshot (see snapshot.py), if there is one for this registry."""
+    path = snapshot.snapshot_path()
+    prebuilt = snapshot.read(path, county_dataset.key) if path else None
+    if prebuilt is not None:
+        county_dataset.seed(*prebuilt)
+    return prebuilt is not None
+
+
 # --- FastAPI app ---
-app = FastAPI(title="Rockland Census API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # A prebuilt snapshot answers from the first request on; the refresh loop takes over when it is due
+    seed_from_snapshot()
+    if PRELOAD_DATASET:
+        county_dataset.start()
+    report_queue.start()
+    yield
+    await report_queue.stop()
+    await county_dataset.stop()
+
+
+app = FastAPI(title="Rockland Census API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -116,13 +522,74 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing"],
 )
 
 
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Per-request stage timings (Server-Timing), request metrics and opt-in profiling."""
+    started = time.perf_counter()
+    with metrics.request_timings() as timings:
+        if metrics.profiling_requested(request.headers, request.query_params):
+            with metrics.profiled(f"{request.method} {request.url.path}") as profile:
+                response = await call_next(request)
+            if profile is not None:
+                response.headers["X-Profile-File"] = os.path.basename(profile.path)
+                # Requests served alongside it on the loop, and so in the profile too
+                response.headers["X-Profile-Overlap"] = str(profile.overlap)
+        else:
+            response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.http_requests.inc(method=request.method, route=route, status=response.status_code)
+    metrics.http_seconds.observe(elapsed, method=request.method, route=route)
+    # Streaming bodies are still being produced; only stages so far are included
+    response.headers["Server-Timing"] = metrics.server_timing(timings, elapsed)
+    return response
+
+
 class AiReportRequest(BaseModel):
     zips: Optional[List[str]] = None
     temperature: Optional[float] = DEFAULT_TEMPERATURE
     user_prompt: Optional[str] = None
+    tables: Optional[List[str]] = None
+    fields: Optional[List[str]] = None
+    # Group names (see /api/aggregate/groups) or {name: [zips]}; exact rollups go into the prompt
+    groups: Optional[Union[List[str], Dict[str, List[str]]]] = None
+    # single | map_reduce (cached per-ZIP fragments, see narratives.py); default NARRATIVE_MODE
+    mode: Optional[str] = None
+    # Seconds the narrative may take; picks the model and output budget (see llm_router.py)
+    latency_target: Optional[float] = Field(None, gt=0, le=300)
+
+
+class AiReportJobRequest(AiReportRequest):
+    # 0 runs first; jobs of equal priority run in submission order
+    priority: int = Field(report_jobs.DEFAULT_PRIORITY, ge=0, le=9)
+
+
+def _groups_or_400(spec) -> Dict[str, List[str]]:
+    try:
+        return aggregate.resolve_groups(spec, core.UNIVERSE.towns)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+def _report_params(payload: AiReportRequest) -> ReportParams:
+    """Validate a report request up front; the argument for _generate_report."""
+    _ensure_openai_key()
+    zip_list = _validated_zip_list(payload.zips)
+    temperature = payload.temperature or DEFAULT_TEMPERATURE
+    plan = _plan_or_400(payload.tables, payload.fields, with_totals=True, with_views=True)
+    columns = query_plan.output_columns(_plan_or_400(payload.tables, payload.fields, with_totals=True))
+    groups = _groups_or_400(payload.groups) if payload.groups else None
+    mode = (payload.mode or narratives.MODE).strip().lower()
+    if mode not in narratives.MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {list(narratives.MODES)}.")
+    return ReportParams(
+        zip_list, temperature, plan, payload.user_prompt, groups, mode, payload.latency_target, columns
+    )
 
 
 @app.get("/api/health")
@@ -136,46 +603,325 @@ def health():
         "openai_key": openai_key_set,
         "census_key": census_key_set,
         "allowed_origins": ALLOWED_ORIGINS,
+        "dataset_built_at": county_dataset.built_at,
+        "dataset_source": county_dataset.source,
+        "dataset_memory": county_dataset.memory,
+        "census_backend": core.CENSUS_BACKEND,
+        "geo_scope": core.UNIVERSE.scope,
+        "universe_zips": len(core.UNIVERSE),
+        "cache_backend": shared_cache.BACKEND,
+        "census_circuit": census_client.get_client().breaker.state,
+        "report_jobs": report_queue.stats(),
     }
 
 
+@app.get("/api/metrics")
+def get_metrics():
+    """Prometheus text-format metrics."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/zip-data")
-def get_zip_data(zips: Optional[str] = Query(None, description="Comma-separated ZIPs")):
+async def get_zip_data(
+    request: Request,
+    zips: Optional[str] = Query(None, description="Comma-separated ZIPs"),
+    format: Optional[str] = Query(None, description="records (default), split, columnar, arrow or parquet"),
+    tables: Optional[str] = Query(None, description="Comma-separated tables: income, occupation, race, households"),
+    fields: Optional[str] = Query(None, description="Comma-separated column names"),
+):
     zip_list = _validated_zip_list(zips.split(",") if zips else None)
+    fmt = response_formats.negotiate_format(format, request.headers.get("accept"))
+    plan = _plan_or_400(tables, fields)
     try:
-        final_df = build_final_dataset(zip_list)
+        frame, version = await _planned_frame(zip_list, plan)
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc)) from exc
-    return {"zips": zip_list, "data": final_df.to_dict(orient="records")}
+    columns = query_plan.output_columns(plan)
+    return response_formats.dataset_response(request, frame, version, zip_list, fmt, columns)
+
+
+@app.get("/api/geography")
+def get_geography(
+    zips: Optional[str] = Query(None, description="Comma-separated ZIPs to look up"),
+    state: Optional[str] = Query(None, description="State FIPS, e.g. 36"),
+    county: Optional[str] = Query(None, description="County FIPS (36087) or name prefix (Rockland)"),
+    town: Optional[str] = Query(None, description="Town name substring"),
+    limit: int = Query(1000, ge=1, le=50000),
+):
+    """ZIP -> town / county / state from the GEO_SCOPE universe (see geography.py)."""
+    universe = core.UNIVERSE
+    if zips:
+        rows = universe.lookup(z.strip() for z in zips.split(","))
+    else:
+        rows = universe.search(state, county, town)
+    page = rows.head(limit).reset_index()
+    return {
+        "scope": universe.scope,
+        "universe_zips": len(universe),
+        "matches": len(rows),
+        "data": page.astype(object).where(page.notna(), None).to_dict("records"),
+    }
 
 
-@app.post("/api/ai-report")
-def ai_report(payload: AiReportRequest):
-    _ensure_openai_key()
-    zip_list = _validated_zip_list(payload.zips)
-    temperature = payload.temperature or DEFAULT_TEMPERATURE
+class AggregateRequest(BaseModel):
+    groups: Union[List[str], Dict[str, List[str]]]
+    fields: Optional[List[str]] = None
+    baseline: Optional[str] = None
+
+
+@app.get("/api/aggregate/groups")
+def aggregate_groups():
+    """Predefined groups: the whole universe (the baseline) and, in Rockland, its towns and regions."""
+    return {"groups": aggregate.GROUPS, "baseline": aggregate.BASELINE}
 
+
+@app.post("/api/aggregate")
+async def post_aggregate(payload: AggregateRequest):
+    """
+    Exact rollups over ZIP groups from the materialized dataset: summed
+    counts, population-weighted shares, interpolated median household
+    income, and each group's difference from `baseline` (default: the whole
+    universe, aggregate.BASELINE).
+    """
+    unknown = [f for f in payload.fields or [] if f not in query_plan.FIELD_TABLES or f in aggregate.NOT_ADDITIVE]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown or non-additive fields {unknown}.")
+    groups = _groups_or_400(payload.groups)
     try:
-        final_df = build_final_dataset(zip_list)
+        engine = await _aggregate_engine()
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc)) from exc
-
-    prompt_text = build_prompt(final_df, payload.user_prompt)
-
     try:
-        # Using legacy openai.ChatCompletion to match existing dependency
-        response = core.openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt_text}],
-            max_tokens=1000,
-            temperature=temperature,
+        out = aggregate.run(engine, groups, payload.fields, payload.baseline)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    with metrics.stage("serialize"):
+        body = response_formats.raw_json_object(
+            {"version": engine.version, "baseline": out["baseline"], "groups": out["groups"],
+             "elapsed_us": out["elapsed_us"]},
+            {"data": response_formats.records_json(out["result"].reset_index()),
+             "differences": response_formats.records_json(out["differences"].reset_index())},
         )
-        ai_text = response.choices[0].message.content.strip()
+    return Response(content=body, media_type="application/json")
+
+
+@app.get("/api/zip-data/series")
+async def get_zip_data_series(
+    request: Request,
+    zips: Optional[str] = Query(None, description="Comma-separated ZIPs"),
+    start: Optional[int] = Query(None, alias="from", description="First vintage (default: ten years back)"),
+    end: Optional[int] = Query(None, alias="to", description=f"Last vintage (default: {core.ACS_VINTAGE})"),
+    format: Optional[str] = Query(None, description="records (default), split, columnar, arrow or parquet"),
+    tables: Optional[str] = Query(None, description="Comma-separated tables (default: income, occupation)"),
+    fields: Optional[str] = Query(None, description="Comma-separated column names"),
+):
+    """
+    One row per ZIP and vintage (Vintage column) for the requested tables or
+    fields. Stored vintages are served without Census calls; missing ones are
+    fetched together in one round and kept (see timeseries.py).
+    """
+    zip_list = _validated_zip_list(zips.split(",") if zips else None)
+    fmt = response_formats.negotiate_format(format, request.headers.get("accept"))
+    plan = _plan_or_400(tables or ("" if fields else "income,occupation"), fields)
+    years = list(range(start or min(timeseries.default_vintages()), (end or core.ACS_VINTAGE) + 1))
+    if not years or len(years) > len(core.ACS_VINTAGES):
+        raise HTTPException(status_code=400, detail=f"Use vintages within {core.vintage_span(core.ACS_VINTAGES)}.")
+    try:
+        frame, version = await vintages.series(plan.tables, years)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
     except Exception as exc:
-        raise HTTPException(status_code=500, detail=f"OpenAI API error: {exc}") from exc
+        raise HTTPException(status_code=500, detail=str(exc)) from exc
+    columns = ["Vintage"] + query_plan.output_columns(plan)
+    return response_formats.dataset_response(
+        request, frame, version, zip_list, fmt, columns, route="/api/zip-data/series"
+    )
+
+
+@app.post("/api/ai-report")
+async def ai_report(payload: AiReportRequest):
+    body = await _generate_report(_report_params(payload))
+    return Response(content=body, media_type="application/json")
+
+
+def _job_or_404(job_id: str) -> report_jobs.Job:
+    job = report_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job {job_id}.")
+    return job
+
 
+def _job_status(job: report_jobs.Job) -> dict:
     return {
-        "zips": zip_list,
-        "data": final_df.to_dict(orient="records"),
-        "ai_summary": ai_text,
+        **job.info(),
+        "queue_position": report_queue.position(job),
+        "status_url": f"/api/ai-report/jobs/{job.id}",
     }
+
+
+@app.post("/api/ai-report/jobs", status_code=202)
+async def submit_ai_report_job(payload: AiReportJobRequest):
+    """
+    Queue a report and return its job right away (202). Poll the status URL
+    (with ?wait= to long-poll) or subscribe to /events for the result.
+    """
+    params = _report_params(payload)
+    try:
+        job = report_queue.submit(params, payload.priority)
+    except report_jobs.QueueFull as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "5"}) from exc
+    return Response(
+        content=json.dumps(_job_status(job)),
+        status_code=202,
+        media_type="application/json",
+        headers={"Location": f"/api/ai-report/jobs/{job.id}"},
+    )
+
+
+@app.get("/api/ai-report/jobs/{job_id}")
+async def get_ai_report_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=60, description="Seconds to wait for a status change"),
+):
+    """Job status; once done, `result` holds the same body /api/ai-report returns."""
+    job = _job_or_404(job_id)
+    if wait:
+        await job.wait_change(wait)
+    raw = {"result": job.result} if job.result is not None else {}
+    return Response(content=response_formats.raw_json_object(_job_status(job), raw), media_type="application/json")
+
+
+@app.get("/api/ai-report/jobs/{job_id}/events")
+async def ai_report_job_events(job_id: str):
+    """Server-Sent Events: `status` on every change, then `done` (with the result) or `error`."""
+    job = _job_or_404(job_id)
+
+    async def events():
+        async for info in report_queue.events(job):
+            if info is None:
+                yield ": keep-alive\n\n"
+            elif job.status == "done":
+                yield f"event: done\ndata: {job.result}\n\n"
+            elif job.status == "error":
+                yield _sse("error", {"detail": job.error})
+            else:
+                yield _sse("status", _job_status(job))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/ai-report/stream")
+async def ai_report_stream(payload: AiReportRequest):
+    """
+    Streaming variant of /api/ai-report (Server-Sent Events):
+    `data` with the dataset first, then `token` events as the narrative is
+    generated, then `done` (or `error`). When the client disconnects,
+    Starlette cancels the generator and the upstream stream is abandoned.
+    The planned model streams until the deadline; if it fails or times out
+    before its first token, the template summary is sent instead.
+    """
+    report = _report_params(payload)
+    zip_list, temperature = report.zips, report.temperature
+    started = time.monotonic()
+    deadline = _deadline(report, started)
+    final_df, aggregates = await _report_data(report)
+
+    async def events():
+        data = response_formats.raw_json_object({"zips": zip_list}, {"data": _report_rows(final_df, report)})
+        yield f"event: data\ndata: {data}\n\n"
+
+        # After the data event: in map_reduce mode this waits for the fragments
+        try:
+            prompt_text, narrative = await _prompt_by(report, final_df, aggregates, deadline)
+        except HTTPException as exc:
+            yield _sse("error", {"detail": exc.detail})
+            return
+        extra = {"narrative": narrative} if narrative is not None else {}
+        route, prompt_tokens = _route_for(prompt_text, report) if prompt_text is not None else (None, 0)
+
+        def template(error: str) -> List[str]:
+            text = narratives.template_summary(final_df, aggregates, AREA)
+            routed = llm.served(text, "template", route, started, error)
+            metrics.report_cache_results.inc(source="miss")
+            done = {"ai_cache": "miss", "ai_route": routed.info(), **extra}
+            return [_sse("token", {"text": text}), _sse("done", done)]
+
+        if route is None:
+            for event in template("deadline passed before the prompt was ready" if prompt_text is None
+                                  else "no model fits the target"):
+                yield event
+            return
+        params = {"model": route.model, "temperature": temperature, "max_tokens": route.max_tokens}
+        key = report_cache.report_key(prompt_text, **params)
+
+        cached = await reports.lookup(key)
+        if cached is not None:
+            metrics.report_cache_results.inc(source="hit")
+            yield _sse("token", {"text": cached})
+            yield _sse("done", {"ai_cache": "hit", "ai_route": {"path": "cache"}, **extra})
+            return
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def emit(text):
+            loop.call_soon_threadsafe(queue.put_nowait, text)
+
+        # A stream cannot switch models midway: past the deadline it stops, and the text so far is the answer
+        timer = loop.call_later(max(0.0, deadline - time.monotonic()), stop.set)
+        begun = time.monotonic()
+        worker = asyncio.ensure_future(asyncio.to_thread(
+            _stream_chat_completion, prompt_text, emit=emit, stop=stop,
+            timeout=max(1.0, deadline - time.monotonic()), **params,
+        ))
+        # Sentinel once the thread finishes; emit() calls made before it are already queued
+        worker.add_done_callback(lambda _: queue.put_nowait(None))
+        streamed = False
+        try:
+            while True:
+                text = await queue.get()
+                if text is None:
+                    break
+                streamed = True
+                yield _sse("token", {"text": text})
+            try:
+                ai_text = worker.result()
+            except Exception as exc:
+                if not streamed:
+                    # Nothing sent yet: the template still answers within the deadline
+                    for event in template(f"{route.model}: {llm_router.describe(exc)}"):
+                        yield event
+                    return
+                yield _sse("error", {"detail": f"OpenAI API error: {exc}"})
+                return
+            if stop.is_set():
+                if not streamed:
+                    for event in template(f"deadline ({deadline - started:.1f}s) passed"):
+                        yield event
+                    return
+                # Cut off by the deadline: served, but not the full report for this key
+                routed = llm.served(ai_text, "planned", route, started)
+                info = {**routed.info(), "truncated": True}
+            else:
+                llm.observe(route.model, prompt_tokens, prompt_encoder.count_tokens(ai_text, route.model),
+                            time.monotonic() - begun)
+                routed = llm.served(ai_text, "planned", route, started)
+                info = routed.info()
+                await reports.save(key, ai_text)
+            metrics.report_cache_results.inc(source="miss")
+            yield _sse("done", {"ai_cache": "miss", "ai_route": info, **extra})
+        finally:
+            timer.cancel()
+            # Client went away (generator cancelled/closed): stop reading upstream
+            stop.set()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
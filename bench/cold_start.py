@@ -0,0 +1,99 @@
+"""
+Time to first useful response of a fresh app process, with and without a
+prebuilt dataset snapshot (see snapshot.py).
+
+Each run starts uvicorn on app.py (PRELOAD_DATASET=1, empty caches) against
+bench/fake_census.py and measures, from process start:
+- ready_ms   first 200 from /api/health
+- first_ms   first 200 from /api/zip-data for every ZIP
+plus the Census calls the process made before that first answer. The
+snapshot runs read one built once beforehand against the same stand-in.
+
+    python bench/cold_start.py [--runs 3] [--census-latency 0.2] [--json out.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import fake_census  # noqa: E402
+from run import ALL_ZIPS, AppServer  # noqa: E402
+
+
+def _first_ok(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=60).ok:
+                return time.perf_counter()
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"no 200 from {url}")
+
+
+def build_snapshot(census_url, out):
+    env = dict(os.environ, CENSUS_API_BASE=census_url, CENSUS_CACHE_DISABLED="1", DATASET_CACHE_DISABLED="1",
+               CENSUS_RATE_PER_SECOND="1000", CENSUS_RATE_BURST="1000")
+    subprocess.run([sys.executable, "snapshot.py", "build", "--out", out], cwd=ROOT, env=env, check=True)
+
+
+def one_run(census, snapshot_dir, timeout=120):
+    env = {"PRELOAD_DATASET": "1"}
+    if snapshot_dir:
+        env.update({"SNAPSHOT_DISABLED": "0", "SNAPSHOT_PATH": snapshot_dir})
+    calls = census.stats["requests"]
+    started = time.perf_counter()
+    app = AppServer(census.url, "http://127.0.0.1:9", env)
+    try:
+        deadline = started + timeout
+        ready = _first_ok(f"{app.url}/api/health", deadline)
+        first = _first_ok(f"{app.url}/api/zip-data?zips={','.join(ALL_ZIPS)}", deadline)
+        source = requests.get(f"{app.url}/api/health", timeout=5).json().get("dataset_source")
+    finally:
+        app.stop()
+    return {
+        "ready_ms": round((ready - started) * 1000, 1),
+        "first_ms": round((first - started) * 1000, 1),
+        "census_calls": census.stats["requests"] - calls,
+        "source": source,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold start with and without a dataset snapshot.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--census-latency", type=float, default=0.2)
+    parser.add_argument("--fixtures", default=fake_census.DEFAULT_FIXTURES)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    census = fake_census.start(fixtures_path=args.fixtures, latency=args.census_latency)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-snapshot-") as tmp:
+        snapshot_dir = os.path.join(tmp, "snapshot")
+        build_snapshot(census.url, snapshot_dir)
+        for mode, path in (("fetch", None), ("snapshot", snapshot_dir)):
+            runs = [one_run(census, path) for _ in range(args.runs)]
+            results[mode] = runs
+            print(f"{mode:<9} ready p50 {statistics.median(r['ready_ms'] for r in runs):>8.1f} ms   "
+                  f"first zip-data p50 {statistics.median(r['first_ms'] for r in runs):>8.1f} ms   "
+                  f"census calls {runs[-1]['census_calls']}   source {runs[-1]['source']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Local stand-in for api.census.gov, used by the benchmarks.
+
+Answers GET /data/<dataset>?get=...&for=zip code tabulation area:<zips|*>
+from a fixture file shaped {dataset path: {zcta: {variable: value}}}.
+Anything the fixtures lack is synthesized deterministically, so every table
+in the registry answers even without recorded data. Unknown ZCTAs are simply
+left out of the response, and a request matching none gets a 204, like the
+real API. Like the real API, vintages before 2020 reject ZCTA requests that
+lack `in=state:NN`.
+
+    python bench/fake_census.py [--port 8901] [--latency 0.2] [--jitter 0.05]
+                                [--error-rate 0.02] [--error-status 503]
+    python bench/fake_census.py record [--zips 10901,...]
+
+`record` captures real responses for every registry table into the fixture
+file (needs network and, ideally, CENSUS_API_KEY). Run the app against the
+fake with CENSUS_API_BASE=http://127.0.0.1:8901.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FIXTURES = os.path.join(ROOT, "bench", "fixtures", "census.json")
+ZCTA_GEO_COLUMN = "zip code tabulation area"
+
+
+def load_fixtures(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def synthesize(dataset, variable, zcta):
+    """Stable fake estimate for (dataset, variable, zcta)."""
+    if variable == "NAME":
+        return f"ZCTA5 {zcta}"
+    digest = hashlib.md5(f"{dataset}|{variable}|{zcta}".encode()).digest()
+    return str(int.from_bytes(digest[:4], "big") % 50000)
+
+
+class CensusHandler(BaseHTTPRequestHandler):
+    server_version = "FakeCensus/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.count("requests")
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        server.delay()
+
+        if server.rng_uniform() < server.error_rate:
+            server.count("errors")
+            headers = {"Retry-After": "1"} if server.error_status == 429 else {}
+            return self._send(server.error_status, b"injected error", "text/plain", headers)
+
+        dataset = url.path.split("/data/", 1)[-1].strip("/")
+        if not url.path.startswith("/data/") or "get" not in query or "for" not in query:
+            return self._send(400, b"error: unknown/unsupported geography hierarchy", "text/plain")
+        get_vars = query["get"][0].split(",")
+        geo, _, wanted = query["for"][0].partition(":")
+        if geo != ZCTA_GEO_COLUMN:
+            return self._send(400, b"error: unknown/unsupported geography hierarchy", "text/plain")
+        year = dataset.split("/", 1)[0]
+        if year.isdigit() and int(year) < 2020 and not query.get("in", [""])[0].startswith("state:"):
+            return self._send(400, b"error: unknown/unsupported geography hierarchy", "text/plain")
+
+        known = server.fixtures.get(dataset, {})
+        zctas = sorted(set(known) | set(server.universe)) if wanted == "*" else wanted.split(",")
+        zctas = [z for z in zctas if z in known or z in server.universe]
+        if not zctas:
+            return self._send(204, b"", "application/json")
+
+        rows = [get_vars + [ZCTA_GEO_COLUMN]]
+        for zcta in zctas:
+            record = known.get(zcta, {})
+            rows.append([record.get(v, synthesize(dataset, v, zcta)) for v in get_vars] + [zcta])
+        self._send(200, json.dumps(rows).encode("utf-8"), "application/json")
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeCensusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures=None, universe=(), latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=503, seed=0):
+        super().__init__(address, CensusHandler)
+        self.fixtures = fixtures or {}
+        self.universe = set(universe)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stats = {"requests": 0, "errors": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def rng_uniform(self):
+        with self._lock:
+            return self._rng.random()
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self.jitter * (2 * self.rng_uniform() - 1)))
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start(port=0, fixtures_path=DEFAULT_FIXTURES, universe=None, **options):
+    """Run a fake in a daemon thread; returns the server (see .url, .stats)."""
+    if universe is None:
+        sys.path.insert(0, ROOT)
+        import MainAI3 as core
+
+        universe = core.UNIVERSE.zips
+    server = FakeCensusServer(("127.0.0.1", port), load_fixtures(fixtures_path), universe, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def record(zip_codes, fixtures_path):
+    """Fetch every registry table from the real API and merge it into the fixtures."""
+    sys.path.insert(0, ROOT)
+    import MainAI3 as core
+    from census_client import get_client
+
+    fixtures = load_fixtures(fixtures_path)
+    for table in core.CENSUS_TABLES.values():
+        dataset = urlparse(table.base_url).path.split("/data/", 1)[-1].strip("/")
+        for chunk in table.chunks():
+            params = {"get": ",".join(chunk), "for": f"{ZCTA_GEO_COLUMN}:{','.join(zip_codes)}"}
+            if core.CENSUS_API_KEY:
+                params["key"] = core.CENSUS_API_KEY
+            data = get_client().get_json(table.base_url, params)
+            for row in data[1:]:
+                record = dict(zip(data[0], row))
+                zcta = record.pop(ZCTA_GEO_COLUMN)
+                fixtures.setdefault(dataset, {}).setdefault(zcta, {}).update(record)
+        print(f"Recorded {table.name} ({len(table.chunks())} request(s))")
+
+    os.makedirs(os.path.dirname(fixtures_path), exist_ok=True)
+    with open(fixtures_path, "w") as f:
+        json.dump(fixtures, f, indent=1, sort_keys=True)
+    print(f"Wrote {fixtures_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for api.census.gov.")
+    parser.add_argument("command", nargs="?", choices=["serve", "record"], default="serve")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="Fixture JSON file")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of uniform jitter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503, help="Status for injected errors (429 adds Retry-After)")
+    parser.add_argument("--zips", help="ZIPs to record (default: all Rockland ZIPs)")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        sys.path.insert(0, ROOT)
+        import MainAI3 as core
+
+        zips = [z.strip() for z in args.zips.split(",") if z.strip()] if args.zips else list(core.ROCKLAND_ZIPS_TOWNS)
+        record(zips, args.fixtures)
+        return
+
+    server = start(
+        args.port, args.fixtures, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, error_status=args.error_status,
+    )
+    print(f"Fake Census API on {server.url} (CENSUS_API_BASE={server.url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Local stand-in for the OpenAI chat-completions endpoint, used by the benchmarks.
+
+POST /v1/chat/completions returns a canned narrative of `--completion-tokens`
+words (capped by the request's max_tokens). It waits `--latency` seconds
+before the first token and then emits `--tokens-per-second`. With
+"stream": true it sends chat.completion.chunk events and a final [DONE].
+`--model NAME:LATENCY[:TOKENS_PER_SECOND[:ERROR_RATE]]` overrides these for one
+model, e.g. a slow primary and a fast fallback for the LLM router (see
+llm_router.py).
+`.stats["models"]` counts requests per model.
+
+    python bench/fake_openai.py [--port 8902] [--latency 0.3] [--tokens-per-second 400]
+                                [--completion-tokens 200] [--error-rate 0.0]
+                                [--model gpt-4o-mini:8:40 ...]
+
+Point the app at it with OPENAI_API_BASE=http://127.0.0.1:8902/v1 (read by
+the openai client) and any OPENAI_API_KEY.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "Rockland County ZIP codes show a wide spread of household incomes, with "
+    "management and professional occupations concentrated where median income "
+    "is highest and service work more common elsewhere"
+).split()
+
+
+class ChatHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        server.count("requests")
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": "not found"}})
+        model = body.get("model", "fake")
+        server.count_model(model)
+        latency, tokens_per_second, error_rate = server.models.get(
+            model, (server.latency, server.tokens_per_second, server.error_rate)
+        )
+        if server.rng_uniform() < error_rate:
+            server.count("errors")
+            return self._send_json(server.error_status, {"error": {"message": "injected error", "type": "server_error"}})
+
+        n_tokens = min(server.completion_tokens, int(body.get("max_tokens") or server.completion_tokens))
+        words = [WORDS[i % len(WORDS)] for i in range(n_tokens)]
+        time.sleep(latency)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for word in words:
+                chunk = {
+                    "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                time.sleep(1 / tokens_per_second)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+            return
+
+        time.sleep(n_tokens / tokens_per_second)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        self._send_json(200, {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": n_tokens, "total_tokens": prompt_tokens + n_tokens},
+        })
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.3, tokens_per_second=400.0, completion_tokens=200,
+                 error_rate=0.0, error_status=500, seed=0, models=None):
+        super().__init__(address, ChatHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        # model -> (latency, tokens_per_second, error_rate)
+        self.models = {
+            name: tuple(values) + (latency, tokens_per_second, error_rate)[len(values):]
+            for name, values in (models or {}).items()
+        }
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stats = {"requests": 0, "errors": 0, "models": {}}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def count_model(self, model):
+        with self._lock:
+            self.stats["models"][model] = self.stats["models"].get(model, 0) + 1
+
+    def rng_uniform(self):
+        with self._lock:
+            return self._rng.random()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start(port=0, **options):
+    """Run a fake in a daemon thread; returns the server (see .url, .stats)."""
+    server = FakeOpenAIServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for OpenAI chat completions.")
+    parser.add_argument("--port", type=int, default=8902)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--model", action="append", default=[], metavar="NAME:LATENCY[:TOKENS_PER_SECOND[:ERROR_RATE]]",
+                        help="Latency, speed and error rate of one model")
+    args = parser.parse_args(argv)
+
+    models = {}
+    for spec in args.model:
+        name, *values = spec.split(":")
+        models[name] = tuple(float(v) for v in values)
+    server = start(
+        args.port, latency=args.latency, tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens, error_rate=args.error_rate, error_status=args.error_status,
+        models=models,
+    )
+    print(f"Fake OpenAI API on {server.url} (OPENAI_API_BASE={server.url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
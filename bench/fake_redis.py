@@ -0,0 +1,157 @@
+"""
+Local stand-in for a Redis server, used by the benchmarks and for trying
+CACHE_BACKEND=redis without installing Redis.
+
+It speaks RESP2 and implements only what shared_cache.RedisCache uses: PING,
+AUTH, SELECT, GET, MGET, SET (EX/PX/NX), DEL, SCAN (MATCH/COUNT), DBSIZE and
+FLUSHDB, on one in-memory keyspace with key expiry. Nothing is persisted.
+
+    python bench/fake_redis.py [--port 6379]
+
+Point the app at it with CACHE_BACKEND=redis CACHE_REDIS_URL=redis://127.0.0.1:6379/0.
+"""
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+
+
+class Status(str):
+    """Simple-string reply (+OK), as opposed to a bulk string value."""
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            self.server.count("commands")
+            try:
+                reply = self.server.dispatch([part.decode("utf-8") for part in command])
+            except Exception as exc:
+                reply = RuntimeError(f"ERR {exc}")
+            self.wfile.write(_encode(reply))
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command (e.g. from telnet / redis-cli --no-raw)
+            return line.strip().split()
+        parts = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            parts.append(self.rfile.read(size + 2)[:-2])
+        return parts
+
+
+def _encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, RuntimeError):
+        return f"-{reply}\r\n".encode("utf-8")
+    if isinstance(reply, Status):
+        return f"+{reply}\r\n".encode("utf-8")
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode("utf-8")
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(_encode(item) for item in reply)
+    data = reply.encode("utf-8") if isinstance(reply, str) else reply
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, RespHandler)
+        self.data = {}  # key -> (value, expires_at or None)
+        self.stats = {"commands": 0}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            return None
+        return entry
+
+    def dispatch(self, args):
+        name, args = args[0].upper(), args[1:]
+        with self._lock:
+            if name == "PING":
+                return Status("PONG")
+            if name in ("AUTH", "SELECT"):
+                return Status("OK")
+            if name == "GET":
+                entry = self._live(args[0])
+                return entry[0] if entry else None
+            if name == "MGET":
+                return [entry[0] if entry else None for entry in map(self._live, args)]
+            if name == "SET":
+                return self._set(args)
+            if name == "DEL":
+                return sum(1 for key in args if self._live(key) and self.data.pop(key))
+            if name == "SCAN":
+                options = {args[i].upper(): args[i + 1] for i in range(1, len(args) - 1, 2)}
+                pattern = options.get("MATCH", "*")
+                # One pass returns everything; cursor 0 ends the iteration
+                return ["0", [key for key in list(self.data) if self._live(key) and fnmatch.fnmatchcase(key, pattern)]]
+            if name == "DBSIZE":
+                return sum(1 for key in list(self.data) if self._live(key))
+            if name == "FLUSHDB":
+                self.data.clear()
+                return Status("OK")
+        return RuntimeError(f"ERR unknown command '{name}'")
+
+    def _set(self, args):
+        key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+        expires = None
+        if "PX" in options:
+            expires = time.time() + int(args[2 + options.index("PX") + 1]) / 1000
+        elif "EX" in options:
+            expires = time.time() + int(args[2 + options.index("EX") + 1])
+        if "NX" in options and self._live(key):
+            return None
+        self.data[key] = (value, expires)
+        return Status("OK")
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+
+def start(port=0):
+    """Run a fake in a daemon thread; returns the server (see .url, .stats)."""
+    server = FakeRedisServer(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for a Redis server.")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args(argv)
+
+    server = start(args.port)
+    print(f"Fake Redis on {server.url} (CACHE_REDIS_URL={server.url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Body size of every /api/zip-data format for the county frame, raw and with
+each Content-Encoding, against bench/fake_census.py.
+
+Exits 1 when a binary format (arrow, parquet) is larger than the default
+JSON body (records) under the same encoding, so CI catches schema metadata
+or writer options creeping back in. Columnar JSON is listed for reference:
+at 23 rows Arrow and Parquet pay ~100 bytes of framing per column, so they
+only undercut it once a response has a few dozen rows.
+
+    python bench/payload_sizes.py [--json out.json]
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import fake_census  # noqa: E402
+
+BINARY = ("arrow", "parquet")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure(fixtures_path):
+    """{format: {encoding: bytes}} for the default county response."""
+    port = _free_port()
+    # MainAI3 reads these on import
+    os.environ.update(
+        CENSUS_API_BASE=f"http://127.0.0.1:{port}",
+        CENSUS_CACHE_PATH=os.path.join(tempfile.mkdtemp(prefix="bench-sizes-"), "census.sqlite3"),
+        CENSUS_RATE_PER_SECOND="1000",
+        CENSUS_RATE_BURST="1000",
+    )
+    fake_census.start(port=port, fixtures_path=fixtures_path)
+    import MainAI3 as core
+    import query_plan
+    import response_formats
+    from dataset_store import index_by_zip
+
+    zips = list(core.ROCKLAND_ZIPS_TOWNS)
+    frame = index_by_zip(core.build_dataset(zips)).reindex(columns=query_plan.DEFAULT_COLUMNS)
+    sizes = {}
+    for fmt in response_formats.FORMATS:
+        body = response_formats.serialize(frame, zips, fmt)
+        sizes[fmt] = {
+            encoding: len(response_formats.compress(body, encoding) if encoding != "identity" else body)
+            for encoding in ("identity", "gzip", "br")
+        }
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare /api/zip-data body sizes per format.")
+    parser.add_argument("--fixtures", default=fake_census.DEFAULT_FIXTURES)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    sizes = measure(args.fixtures)
+    print(f"{'format':<10}{'identity':>10}{'gzip':>10}{'br':>10}")
+    for fmt, by_encoding in sizes.items():
+        print(f"{fmt:<10}" + "".join(f"{n:>10}" for n in by_encoding.values()))
+
+    failures = [
+        f"{fmt} {encoding}: {n} > records {sizes['records'][encoding]}"
+        for fmt in BINARY if fmt in sizes
+        for encoding, n in sizes[fmt].items() if n > sizes["records"][encoding]
+    ]
+    for failure in failures:
+        print(f"larger than JSON: {failure}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "sizes": sizes}, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
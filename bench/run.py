@@ -0,0 +1,277 @@
+"""
+Load scenarios for /api/zip-data and /api/ai-report against local stand-ins.
+
+Each scenario starts the fakes (bench/fake_census.py, bench/fake_openai.py),
+then a fresh uvicorn process of app.py pointed at them with empty cache
+files. It fires `--requests` requests from N concurrent clients and reports
+throughput and p50/p95/p99 latency.
+
+Scenarios are the product of
+- endpoint     zip-data | ai-report
+- cache        cold (fresh process and caches, no warm-up; ai-report prompts
+               are unique so every report misses) | warm (one warm-up round
+               first, identical prompts)
+- ZIPs         --zips, default 1 and 23 (1 rotates through the county)
+- clients      --concurrency, default 1 and 8
+
+`--workers N` runs the app with N uvicorn worker processes, on the shared
+SQLite caches or, with `--cache-backend redis`, on bench/fake_redis.py.
+
+    python bench/run.py [--endpoints zip-data,ai-report] [--cache cold,warm]
+                        [--zips 1,23] [--concurrency 1,8] [--requests 40]
+                        [--workers 1] [--cache-backend sqlite|redis]
+                        [--census-latency 0.2] [--census-error-rate 0.0]
+                        [--openai-latency 0.3] [--json out.json]
+                        [--compare baseline.json --tolerance 0.25]
+
+With --compare, exits 1 when any scenario's p95 is more than `tolerance`
+slower than the baseline, so CI can catch regressions.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import fake_census  # noqa: E402
+import fake_openai  # noqa: E402
+import fake_redis  # noqa: E402
+from MainAI3 import ROCKLAND_ZIPS_TOWNS  # noqa: E402
+
+ALL_ZIPS = list(ROCKLAND_ZIPS_TOWNS)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class AppServer:
+    """app.py under uvicorn in a subprocess, with its own cache files."""
+
+    def __init__(self, census_url, openai_url, extra_env=None, workers=1):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._tmp = tempfile.TemporaryDirectory(prefix="bench-")
+        env = dict(os.environ)
+        env.update({
+            "CENSUS_API_BASE": census_url,
+            "OPENAI_API_BASE": openai_url,
+            "OPENAI_API_KEY": "sk-bench",
+            "CENSUS_CACHE_PATH": os.path.join(self._tmp.name, "census.sqlite3"),
+            "REPORT_CACHE_PATH": os.path.join(self._tmp.name, "reports.sqlite3"),
+            "DATASET_CACHE_PATH": os.path.join(self._tmp.name, "dataset.sqlite3"),
+            "PRELOAD_DATASET": "0",
+            # Measure the fetch path, not a snapshot left in the checkout
+            "SNAPSHOT_DISABLED": "1",
+        })
+        # Don't let the production rate limit throttle the stand-in
+        env.setdefault("CENSUS_RATE_PER_SECOND", "1000")
+        env.setdefault("CENSUS_RATE_BURST", "1000")
+        env.update(extra_env or {})
+        self._proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--port", str(self.port), "--log-level", "warning",
+             "--workers", str(workers)],
+            cwd=ROOT, env=env,
+        )
+
+    def wait_ready(self, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self._proc.poll() is not None:
+                raise RuntimeError(f"app exited with {self._proc.returncode}")
+            try:
+                if requests.get(f"{self.url}/api/health", timeout=1).ok:
+                    return
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError("app did not become ready")
+
+    def stop(self):
+        self._proc.terminate()
+        try:
+            self._proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+        self._tmp.cleanup()
+
+
+def _request_factory(endpoint, cache, n_zips):
+    """Returns make(i) -> (method, path, json_body) for request number i."""
+    def zips_for(i):
+        if n_zips >= len(ALL_ZIPS):
+            return ALL_ZIPS
+        start = (i * n_zips) % len(ALL_ZIPS)
+        return (ALL_ZIPS * 2)[start:start + n_zips]
+
+    def make(i):
+        zips = zips_for(i)
+        if endpoint == "zip-data":
+            return "GET", f"/api/zip-data?zips={','.join(zips)}", None
+        prompt = f"bench {uuid.uuid4().hex}" if cache == "cold" else "bench"
+        return "POST", "/api/ai-report", {"zips": zips, "user_prompt": prompt}
+
+    return make
+
+
+def run_scenario(app_url, endpoint, cache, n_zips, concurrency, n_requests):
+    make = _request_factory(endpoint, cache, n_zips)
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def one(i):
+        method, path, body = make(i)
+        started = time.perf_counter()
+        try:
+            response = session().request(method, app_url + path, json=body, timeout=300)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    if cache == "warm":
+        # Touch every ZIP (and the shared prompt) once
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(max(1, len(ALL_ZIPS) // max(n_zips, 1)))))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(n_requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, ok in results if ok)
+    return {
+        "scenario": f"{endpoint}/{cache}/{n_zips}zip/{concurrency}c",
+        "requests": n_requests,
+        "errors": sum(1 for _, ok in results if not ok),
+        "rps": round(n_requests / elapsed, 2),
+        "first_ms": round(results[0][0] * 1000, 1),
+        "p50_ms": _round(percentile(latencies, 50)),
+        "p95_ms": _round(percentile(latencies, 95)),
+        "p99_ms": _round(percentile(latencies, 99)),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+def _csv(value, cast=str):
+    return [cast(part.strip()) for part in value.split(",") if part.strip()]
+
+
+def _print_table(rows):
+    columns = ["scenario", "requests", "errors", "rps", "first_ms", "p50_ms", "p95_ms", "p99_ms"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(widths[c]) for c in columns))
+
+
+def compare(rows, baseline_path, tolerance):
+    """Scenarios whose p95 regressed beyond `tolerance` versus the baseline file."""
+    with open(baseline_path) as f:
+        baseline = {row["scenario"]: row for row in json.load(f)["results"]}
+    regressions = []
+    for row in rows:
+        before = baseline.get(row["scenario"])
+        if before and before.get("p95_ms") and row["p95_ms"] is not None:
+            if row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{row['scenario']}: p95 {before['p95_ms']} -> {row['p95_ms']} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API against local stand-ins.")
+    parser.add_argument("--endpoints", default="zip-data,ai-report")
+    parser.add_argument("--cache", default="cold,warm")
+    parser.add_argument("--zips", default="1,23", help="ZIPs per request")
+    parser.add_argument("--concurrency", default="1,8", help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per scenario")
+    parser.add_argument("--census-latency", type=float, default=0.2)
+    parser.add_argument("--census-jitter", type=float, default=0.05)
+    parser.add_argument("--census-error-rate", type=float, default=0.0)
+    parser.add_argument("--census-error-status", type=int, default=503)
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--openai-tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--cache-backend", choices=["sqlite", "redis"], default="sqlite")
+    parser.add_argument("--fixtures", default=fake_census.DEFAULT_FIXTURES)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Baseline results file (from --json)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 slowdown vs baseline")
+    args = parser.parse_args(argv)
+
+    census = fake_census.start(
+        fixtures_path=args.fixtures, latency=args.census_latency, jitter=args.census_jitter,
+        error_rate=args.census_error_rate, error_status=args.census_error_status,
+    )
+    openai_fake = fake_openai.start(
+        latency=args.openai_latency, tokens_per_second=args.openai_tokens_per_second,
+    )
+
+    redis = fake_redis.start() if args.cache_backend == "redis" else None
+    cache_env = {"CACHE_BACKEND": "redis", "CACHE_REDIS_URL": redis.url} if redis else {}
+
+    rows = []
+    scenarios = itertools.product(
+        _csv(args.endpoints), _csv(args.cache), _csv(args.zips, int), _csv(args.concurrency, int)
+    )
+    for endpoint, cache, n_zips, concurrency in scenarios:
+        if redis:
+            redis.dispatch(["FLUSHDB"])
+        app = AppServer(census.url, openai_fake.url, cache_env, workers=args.workers)
+        try:
+            app.wait_ready()
+            rows.append(run_scenario(app.url, endpoint, cache, n_zips, concurrency, args.requests))
+        finally:
+            app.stop()
+        print(f"  {rows[-1]['scenario']}: p95 {rows[-1]['p95_ms']} ms", file=sys.stderr)
+
+    _print_table(rows)
+    print(f"\nCensus stand-in: {census.stats}; OpenAI stand-in: {openai_fake.stats}")
+    if redis:
+        print(f"Redis stand-in: {redis.stats}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+    if args.compare:
+        regressions = compare(rows, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Persistent on-disk cache for Census API responses.
+
+Rows are stored one per ZIP in a local SQLite file, keyed by endpoint URL
+(which carries the vintage, e.g. /data/2021/acs/acs5), the requested variable
+list and the ZCTA. A full-county warm-up therefore also serves any subset of
+ZIPs, and the cache survives restarts.
+
+Config (env)
+- CENSUS_CACHE_PATH       SQLite file (default: .cache/census_cache.sqlite3)
+- CENSUS_CACHE_TTL        seconds before an entry expires; 0 = never (default: 30 days)
+- CENSUS_CACHE_MAX_BYTES  size bound; least recently used rows are evicted (default: 64 MB)
+- CENSUS_CACHE_DISABLED   set to 1 to bypass the cache entirely
+- CACHE_BACKEND           sqlite | redis; see shared_cache.py for running
+                          several workers or replicas on one cache
+
+CLI
+    python census_cache.py warm [--zips 10901,10952]
+    python census_cache.py purge [--expired] [--endpoint URL]
+    python census_cache.py stats
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import closing, contextmanager
+
+import shared_cache
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "census_cache.sqlite3")
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Stored in place of a row when the API answered but had no data for the ZIP
+ABSENT = {}
+# Keys per SELECT; stays under SQLite's bound-parameter limit for national key sets
+MAX_KEYS_PER_QUERY = 900
+
+
+class SqliteCache:
+    """Small key/value store on SQLite with TTL expiry and LRU size eviction."""
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " endpoint TEXT,"
+                " value TEXT,"
+                " size INTEGER,"
+                " created REAL,"
+                " accessed REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, token TEXT, expires REAL)")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation keeps this safe across
+        # threads and processes; SQLite handles the file locking. The inner
+        # `with` commits (or rolls back); closing() releases the file handle.
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            with conn:
+                yield conn
+
+    def _expired(self, created, now):
+        return bool(self.ttl) and now - created > self.ttl
+
+    def get_many(self, keys, include_expired=False):
+        """Return {key: value} for every key present (and not expired, unless `include_expired`)."""
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        keys = list(keys)
+        with self._connect() as conn:
+            rows = []
+            for start in range(0, len(keys), MAX_KEYS_PER_QUERY):
+                batch = keys[start:start + MAX_KEYS_PER_QUERY]
+                rows += conn.execute(
+                    f"SELECT key, value, created FROM entries WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+            hits = []
+            for key, value, created in rows:
+                if not include_expired and self._expired(created, now):
+                    continue
+                found[key] = json.loads(value)
+                hits.append(key)
+            if hits:
+                conn.executemany("UPDATE entries SET accessed = ? WHERE key = ?", [(now, k) for k in hits])
+        return found
+
+    def set_many(self, items, endpoint=""):
+        """Store an iterable of (key, value) pairs, then enforce the size bound."""
+        now = time.time()
+        rows = []
+        for key, value in items:
+            text = json.dumps(value)
+            rows.append((key, endpoint, text, len(text), now, now))
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._evict(conn)
+
+    def _evict(self, conn):
+        if not self.max_bytes:
+            return
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def purge(self, expired_only=False, endpoint=None):
+        """Delete entries (all, expired only, and/or for one endpoint). Returns the count removed."""
+        clauses, args = [], []
+        if expired_only:
+            if not self.ttl:
+                return 0
+            clauses.append("created < ?")
+            args.append(time.time() - self.ttl)
+        if endpoint:
+            clauses.append("endpoint = ?")
+            args.append(endpoint)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            return conn.execute(f"DELETE FROM entries{where}", args).rowcount
+
+    def delete_many(self, keys):
+        """Delete the entries for `keys`. Returns the count removed."""
+        with self._connect() as conn:
+            return conn.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in keys]).rowcount
+
+    def keys(self, endpoint=None):
+        """Every stored key (or only those written for `endpoint`)."""
+        where, args = (" WHERE endpoint = ?", [endpoint]) if endpoint else ("", [])
+        with self._connect() as conn:
+            return [key for (key,) in conn.execute(f"SELECT key FROM entries{where}", args)]
+
+    def try_lock(self, name, ttl):
+        """Take lock `name` for `ttl` seconds unless someone holds it; returns a token or None."""
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM locks WHERE name = ? AND expires < ?", (name, now))
+            # The primary key makes this atomic across processes: one insert wins
+            taken = conn.execute("INSERT OR IGNORE INTO locks VALUES (?, ?, ?)", (name, token, now + ttl)).rowcount
+        return token if taken else None
+
+    def unlock(self, name, token):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM locks WHERE name = ? AND token = ?", (name, token))
+
+    def stats(self):
+        with self._connect() as conn:
+            per_endpoint = conn.execute(
+                "SELECT endpoint, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY endpoint"
+            ).fetchall()
+        return {
+            "path": self.path,
+            "ttl": self.ttl,
+            "max_bytes": self.max_bytes,
+            "entries": sum(n for _, n, _ in per_endpoint),
+            "bytes": sum(b for _, _, b in per_endpoint),
+            "endpoints": {ep: {"entries": n, "bytes": b} for ep, n, b in per_endpoint},
+        }
+
+
+def row_key(base_url, get_vars, zip_code):
+    """Cache key for one ZIP's row: endpoint (incl. vintage) + variable list + geography."""
+    raw = json.dumps([base_url, list(get_vars), f"zip code tabulation area:{zip_code}"])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def row_keys(base_url, get_vars, zip_codes):
+    """{zip: row_key(...)} for many ZIPs; the shared JSON prefix is serialized once."""
+    prefix = json.dumps([base_url, list(get_vars)])[:-1] + ", "
+    return {
+        z: hashlib.sha256(f"{prefix}{json.dumps(f'zip code tabulation area:{z}')}]".encode("utf-8")).hexdigest()
+        for z in zip_codes
+    }
+
+
+def fetch_lock_name(base_url, get_vars, zip_codes):
+    """Lock for one upstream request, so identical fetches from several workers run once."""
+    raw = json.dumps([base_url, list(get_vars), sorted(zip_codes)])
+    return "fetch:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def open_store(namespace, path, ttl, max_bytes):
+    """The SqliteCache at `path`, or the `namespace` of the shared Redis store with CACHE_BACKEND=redis."""
+    if shared_cache.BACKEND == "redis":
+        return shared_cache.RedisCache(shared_cache.REDIS_URL, namespace, ttl=ttl, max_bytes=max_bytes)
+    return SqliteCache(path, ttl=ttl, max_bytes=max_bytes)
+
+
+def _from_env():
+    if os.getenv("CENSUS_CACHE_DISABLED", "").strip().lower() in ("1", "true", "yes"):
+        return None
+    return open_store(
+        "census",
+        os.getenv("CENSUS_CACHE_PATH", DEFAULT_PATH),
+        ttl=int(os.getenv("CENSUS_CACHE_TTL", DEFAULT_TTL)),
+        max_bytes=int(os.getenv("CENSUS_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+    )
+
+
+_cache = None
+_cache_loaded = False
+
+
+def get_cache():
+    """Return the process-wide census cache, or None when disabled."""
+    global _cache, _cache_loaded
+    if not _cache_loaded:
+        _cache = _from_env()
+        _cache_loaded = True
+    return _cache
+
+
+# -------------------------------------------------
+# CLI
+# -------------------------------------------------
+def _warm(zip_codes):
+    import MainAI3 as core
+
+    started = time.time()
+    core.build_dataset(zip_codes)
+    print(f"Warmed {len(zip_codes)} ZIPs in {time.time() - started:.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the on-disk Census response cache.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    warm = sub.add_parser("warm", help="Fetch and cache every table for the given ZIPs")
+    warm.add_argument("--zips", help="Comma-separated ZIPs (default: every ZIP in GEO_SCOPE)")
+
+    purge = sub.add_parser("purge", help="Delete cached entries")
+    purge.add_argument("--expired", action="store_true", help="Only delete entries past their TTL")
+    purge.add_argument("--endpoint", help="Only delete entries for this endpoint URL")
+
+    sub.add_parser("stats", help="Show cache size per endpoint")
+
+    args = parser.parse_args(argv)
+    cache = get_cache()
+    if cache is None:
+        parser.error("cache is disabled (CENSUS_CACHE_DISABLED is set)")
+
+    if args.command == "warm":
+        import MainAI3 as core
+
+        zips = [z.strip() for z in args.zips.split(",") if z.strip()] if args.zips else core.UNIVERSE.zips
+        _warm(zips)
+    elif args.command == "purge":
+        removed = cache.purge(expired_only=args.expired, endpoint=args.endpoint)
+        print(f"Removed {removed} entries")
+    else:
+        print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
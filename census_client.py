@@ -0,0 +1,320 @@
+"""
+Shared HTTP client for every Census API call.
+
+- One pooled keep-alive requests.Session for the whole process
+- Per-call (connect, read) timeouts plus an optional per-pipeline deadline
+  (see `deadline`), which every call and retry inside it respects
+- Jittered exponential backoff on 429/5xx and connection errors
+  (Retry-After is honoured when the API sends it)
+- A token-bucket rate limiter kept under the Census quota
+- A circuit breaker: after repeated failures calls fail fast for a cooldown,
+  and the last known-good response for the same request is served instead
+
+Config (env)
+- CENSUS_CONNECT_TIMEOUT / CENSUS_READ_TIMEOUT   seconds (default 3.05 / 20)
+- CENSUS_MAX_RETRIES                             retries after the first try (default 3)
+- CENSUS_BACKOFF_BASE / CENSUS_BACKOFF_MAX       seconds (default 0.5 / 8)
+- CENSUS_RATE_PER_SECOND / CENSUS_RATE_BURST     token bucket (default 5 / 10)
+- CENSUS_BREAKER_THRESHOLD                       consecutive failures to open (default 5)
+- CENSUS_BREAKER_COOLDOWN                        seconds to stay open (default 60)
+- CENSUS_POOL_SIZE                               keep-alive connections per host (default 10)
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+LAST_GOOD_ENTRIES = 256
+
+
+class CensusAPIError(ValueError):
+    """Raised when the Census API rejects a request: a non-retryable status, or a 200 that is not JSON."""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"Error {status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+class CensusUnavailable(RuntimeError):
+    """Raised when the Census API cannot be reached in time (retries, deadline or open circuit)."""
+
+
+# -------------------------------------------------
+# Deadlines
+# -------------------------------------------------
+_deadline = contextvars.ContextVar("census_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Bound every Census call made inside this block (including worker threads
+    started with asyncio.to_thread, which copy the context) to `seconds` total.
+    Nested deadlines can only shorten the outer one.
+    """
+    if not seconds:
+        yield
+        return
+    until = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(min(until, outer) if outer else until)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """Seconds left before the current deadline, or None when there is none."""
+    until = _deadline.get()
+    return None if until is None else until - time.monotonic()
+
+
+# -------------------------------------------------
+# Rate limiting and circuit breaking
+# -------------------------------------------------
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `burst` stored."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting up to `timeout` seconds. Returns False on timeout."""
+        if not self.rate:
+            return True
+        give_up = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if give_up is not None and now + wait > give_up:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; lets one trial call through after `cooldown`."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self.threshold and (self._failures >= self.threshold or self._opened_at is not None):
+                self._opened_at = time.monotonic()
+
+
+# -------------------------------------------------
+# Client
+# -------------------------------------------------
+class CensusClient:
+    def __init__(
+        self,
+        connect_timeout=3.05,
+        read_timeout=20.0,
+        max_retries=3,
+        backoff_base=0.5,
+        backoff_max=8.0,
+        rate_per_second=5.0,
+        rate_burst=10,
+        breaker_threshold=5,
+        breaker_cooldown=60.0,
+        pool_size=10,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = TokenBucket(rate_per_second, rate_burst)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._last_good = OrderedDict()
+        self._last_good_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            connect_timeout=float(os.getenv("CENSUS_CONNECT_TIMEOUT", "3.05")),
+            read_timeout=float(os.getenv("CENSUS_READ_TIMEOUT", "20")),
+            max_retries=int(os.getenv("CENSUS_MAX_RETRIES", "3")),
+            backoff_base=float(os.getenv("CENSUS_BACKOFF_BASE", "0.5")),
+            backoff_max=float(os.getenv("CENSUS_BACKOFF_MAX", "8")),
+            rate_per_second=float(os.getenv("CENSUS_RATE_PER_SECOND", "5")),
+            rate_burst=int(os.getenv("CENSUS_RATE_BURST", "10")),
+            breaker_threshold=int(os.getenv("CENSUS_BREAKER_THRESHOLD", "5")),
+            breaker_cooldown=float(os.getenv("CENSUS_BREAKER_COOLDOWN", "60")),
+            pool_size=int(os.getenv("CENSUS_POOL_SIZE", "10")),
+        )
+
+    # --- last known-good responses ---
+    @staticmethod
+    def _request_key(url, params):
+        # The API key never affects the payload, so leave it out of the key
+        return json.dumps([url, sorted((k, v) for k, v in params.items() if k != "key")])
+
+    def _remember(self, key, data):
+        with self._last_good_lock:
+            self._last_good[key] = data
+            self._last_good.move_to_end(key)
+            while len(self._last_good) > LAST_GOOD_ENTRIES:
+                self._last_good.popitem(last=False)
+
+    def _fallback(self, key, reason):
+        with self._last_good_lock:
+            data = self._last_good.get(key)
+        if data is None:
+            metrics.census_requests.inc(outcome="unavailable")
+            raise CensusUnavailable(reason)
+        metrics.census_requests.inc(outcome="last_known_good")
+        logger.warning("Census API unavailable (%s); serving last known-good response", reason)
+        return data
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # "Full jitter" exponential backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _timeout(self):
+        left = remaining_time()
+        if left is None:
+            return (self.connect_timeout, self.read_timeout)
+        return (min(self.connect_timeout, left), min(self.read_timeout, left))
+
+    def get_json(self, url, params):
+        """
+        GET `url` and return the decoded JSON body ([] for an empty 200/204).
+        Raises CensusAPIError for non-retryable errors (e.g. 400 bad variable)
+        and CensusUnavailable when retries, the deadline or the breaker give
+        out and no last known-good response exists for this request.
+        """
+        key = self._request_key(url, params)
+        if not self.breaker.allow():
+            return self._fallback(key, "circuit open")
+
+        last_error = "no attempt made"
+        for attempt in range(self.max_retries + 1):
+            left = remaining_time()
+            if left is not None and left <= 0:
+                last_error = "deadline exceeded"
+                break
+            if not self.limiter.acquire(timeout=left):
+                last_error = "deadline exceeded waiting for rate limiter"
+                break
+
+            retry_after = None
+            try:
+                response = self.session.get(url, params=params, timeout=self._timeout())
+            except requests.RequestException as exc:
+                metrics.census_requests.inc(outcome="network_error")
+                last_error = f"{type(exc).__name__}: {exc}"
+            else:
+                metrics.census_bytes.inc(len(response.content))
+                if response.status_code in (200, 204):
+                    try:
+                        data = response.json() if response.text else []
+                    except ValueError:
+                        # e.g. the HTML page served for an invalid key: the API is up, the request is wrong
+                        metrics.census_requests.inc(outcome="rejected")
+                        self.breaker.record_success()
+                        raise CensusAPIError(response.status_code, f"not JSON: {response.text[:200]}") from None
+                    metrics.census_requests.inc(outcome="ok")
+                    self.breaker.record_success()
+                    self._remember(key, data)
+                    return data
+                if response.status_code not in RETRY_STATUSES:
+                    # The API is up; the request itself is wrong
+                    metrics.census_requests.inc(outcome="rejected")
+                    self.breaker.record_success()
+                    raise CensusAPIError(response.status_code, response.text)
+                metrics.census_requests.inc(outcome="retryable")
+                last_error = f"HTTP {response.status_code}"
+                header = response.headers.get("Retry-After", "")
+                retry_after = float(header) if header.isdigit() else None
+
+            if attempt == self.max_retries:
+                break
+            pause = self._backoff(attempt, retry_after)
+            left = remaining_time()
+            if left is not None and pause >= left:
+                last_error += " (deadline too close to retry)"
+                break
+            time.sleep(pause)
+
+        self.breaker.record_failure()
+        return self._fallback(key, last_error)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide CensusClient, created from env on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = CensusClient.from_env()
+    return _client
@@ -0,0 +1,268 @@
+"""
+Local columnar store of Census tables, built from downloaded files.
+
+`ingest` streams ACS 5-year ZCTA table files (data.census.gov CSV exports or
+pipe-delimited table-based summary files) and DHC P8 files in bounded chunks
+into one Parquet file per source under CENSUS_STORE_PATH/<dataset>/, where
+<dataset> is the API path of the endpoint (e.g. 2021_acs_acs5). Only ZCTA rows
+and estimate columns are kept; summary-file codes (B19001_E002) are renamed to
+their API form (B19001_002E).
+
+With CENSUS_BACKEND=local, MainAI3.census_get_rows reads from this store
+instead of the Census API: same (headers, rows) contract, no network.
+
+Config (env)
+- CENSUS_STORE_PATH   store directory (default: .cache/census_store)
+- CENSUS_BACKEND      "api" (default) or "local" (see MainAI3.py)
+
+CLI
+    python census_store.py ingest --dataset income|2021/acs/acs5|URL [--zips ...] FILE...
+    python census_store.py list
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import time
+from functools import lru_cache
+from urllib.parse import urlparse
+
+import pandas as pd
+
+from census_client import CensusAPIError
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional; only the local backend needs it
+    pa = None
+    pq = None
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "census_store")
+CHUNK_ROWS = 50_000
+
+ZCTA_GEO_COLUMN = "zip code tabulation area"
+GEO_COLUMNS = ("GEO_ID", "NAME", ZCTA_GEO_COLUMN)
+# GEO_ID of a ZCTA, e.g. 860Z200US10901
+ZCTA_GEO_ID = r"^860\w*US(\d{5})$"
+API_CODE = re.compile(r"^[A-Z][A-Z0-9]*(_C\d{2})?_\d{3}[EN]$")
+SUMMARY_FILE_CODE = re.compile(r"^([A-Z][A-Z0-9]*)_E(\d{3})$")
+
+
+def store_path():
+    return os.getenv("CENSUS_STORE_PATH", DEFAULT_PATH)
+
+
+def dataset_key(base_url):
+    """'https://api.census.gov/data/2021/acs/acs5' (or '2021/acs/acs5') -> '2021_acs_acs5'."""
+    path = urlparse(base_url).path if "://" in base_url else base_url
+    path = path.split("/data/", 1)[-1]
+    return "_".join(part for part in path.split("/") if part)
+
+
+def normalize_code(column):
+    """API variable code for a file column, or None if it is not an estimate."""
+    column = column.strip()
+    match = SUMMARY_FILE_CODE.match(column)
+    if match:
+        return f"{match.group(1)}_{match.group(2)}E"
+    return column if API_CODE.match(column) else None
+
+
+def _keep_column(column):
+    return column.strip() in GEO_COLUMNS or normalize_code(column) is not None
+
+
+def _zcta_series(chunk):
+    if "GEO_ID" in chunk.columns:
+        return chunk["GEO_ID"].str.strip().str.extract(ZCTA_GEO_ID)[0]
+    if ZCTA_GEO_COLUMN in chunk.columns:
+        return chunk[ZCTA_GEO_COLUMN].str.strip().where(lambda s: s.str.fullmatch(r"\d{5}"))
+    raise ValueError(f"No GEO_ID or '{ZCTA_GEO_COLUMN}' column; columns are {list(chunk.columns)[:8]}...")
+
+
+def _normalize(chunk, zip_filter=None):
+    """ZCTA rows of one file chunk as [ZipCode, NAME?, <codes>] with numeric codes."""
+    chunk = chunk.rename(columns=lambda c: c.strip())
+    zips = _zcta_series(chunk)
+    keep = zips.notna()
+    if zip_filter is not None:
+        keep &= zips.isin(zip_filter)
+
+    codes = {c: code for c in chunk.columns if (code := normalize_code(c))}
+    frame = chunk.loc[keep, list(codes)].rename(columns=codes)
+    # Annotations such as "-" or "250,000+" become nulls
+    frame = frame.apply(pd.to_numeric, errors="coerce").astype("float64")
+    if "NAME" in chunk.columns:
+        frame.insert(0, "NAME", chunk.loc[keep, "NAME"])
+    frame.insert(0, "ZipCode", zips[keep])
+    return frame
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise RuntimeError("The local Census store needs pyarrow (pip install pyarrow).")
+
+
+def ingest_file(path, directory, chunk_rows=CHUNK_ROWS, sep=None, zip_filter=None):
+    """
+    Stream one file into <directory>/<file stem>.parquet, one row group per
+    chunk of `chunk_rows` input rows. Returns the number of ZCTA rows written.
+    """
+    _require_pyarrow()
+    if sep is None:
+        sep = "|" if re.search(r"\.(dat|txt)(\.gz|\.zip)?$", path) else ","
+    stem = os.path.basename(path).split(".")[0]
+    out = os.path.join(directory, f"{stem}.parquet")
+    tmp = out + ".tmp"
+    os.makedirs(directory, exist_ok=True)
+
+    reader = pd.read_csv(path, sep=sep, dtype=str, usecols=_keep_column, chunksize=chunk_rows)
+    writer = None
+    written = 0
+    try:
+        for chunk in reader:
+            frame = _normalize(chunk, zip_filter)
+            if writer is None:
+                fields = [pa.field("ZipCode", pa.string())]
+                fields += [pa.field(c, pa.string() if c == "NAME" else pa.float64()) for c in frame.columns[1:]]
+                writer = pq.ParquetWriter(tmp, pa.schema(fields), compression="zstd")
+            if len(frame):
+                writer.write_table(pa.Table.from_pandas(frame, schema=writer.schema, preserve_index=False))
+                written += len(frame)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError(f"{path} has no rows")
+    os.replace(tmp, out)
+    _schema.cache_clear()
+    return written
+
+
+def ingest(paths, base_url, root=None, **options):
+    """Ingest every file in `paths` into the store for the `base_url` dataset."""
+    directory = os.path.join(root or store_path(), dataset_key(base_url))
+    for path in paths:
+        started = time.time()
+        rows = ingest_file(path, directory, **options)
+        print(f"{path}: {rows} ZCTA rows -> {directory} in {time.time() - started:.2f}s")
+
+
+@lru_cache(maxsize=None)
+def _schema(path):
+    return pq.read_schema(path)
+
+
+def get_rows(base_url, get_vars, zip_codes, root=None):
+    """
+    (headers, rows) for `get_vars` over `zip_codes` from the local store, in
+    the shape of MainAI3.census_get_rows. Raises CensusAPIError (404) when a
+    variable was never ingested for this dataset.
+    """
+    _require_pyarrow()
+    zip_codes = list(zip_codes)
+    get_vars = list(get_vars)
+    headers = get_vars + [ZCTA_GEO_COLUMN]
+    directory = os.path.join(root or store_path(), dataset_key(base_url))
+
+    needed = [v for v in get_vars if v != "NAME"]
+    found = set()
+    names = None
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.parquet"))):
+        available = set(_schema(path).names)
+        columns = [v for v in needed if v in available and v not in found]
+        read_name = "NAME" in get_vars and names is None and "NAME" in available
+        if not columns and not read_name:
+            continue
+        table = pq.read_table(
+            path,
+            columns=["ZipCode"] + (["NAME"] if read_name else []) + columns,
+            filters=[("ZipCode", "in", zip_codes)],
+            memory_map=True,
+        )
+        frame = table.to_pandas().drop_duplicates("ZipCode").set_index("ZipCode")
+        if read_name:
+            names = frame.pop("NAME")
+        frames.append(frame)
+        found.update(columns)
+
+    missing = [v for v in needed if v not in found]
+    if missing:
+        raise CensusAPIError(404, f"{missing} not in the local store {directory}; run census_store.py ingest")
+
+    data = pd.concat(frames, axis=1) if frames else pd.DataFrame(index=pd.Index([], name="ZipCode"))
+    if "NAME" in get_vars:
+        # Summary files carry no names; use the API's ZCTA naming
+        fallback = pd.Series("ZCTA5 " + data.index, index=data.index)
+        data["NAME"] = names.reindex(data.index).fillna(fallback) if names is not None else fallback
+    data = data.astype(object).where(data.notna(), None)
+
+    present = [z for z in zip_codes if z in data.index]
+    values = data.reindex(present)[get_vars].values.tolist()
+    return headers, [row + [z] for row, z in zip(values, present)]
+
+
+def summary(root=None):
+    """Per dataset: files, ZCTA rows, variable count and size on disk."""
+    _require_pyarrow()
+    root = root or store_path()
+    out = {}
+    for directory in sorted(glob.glob(os.path.join(root, "*"))):
+        files = sorted(glob.glob(os.path.join(directory, "*.parquet")))
+        out[os.path.basename(directory)] = {
+            os.path.basename(path): {
+                "rows": pq.ParquetFile(path).metadata.num_rows,
+                "variables": len([n for n in _schema(path).names if n not in ("ZipCode", "NAME")]),
+                "bytes": os.path.getsize(path),
+            }
+            for path in files
+        }
+    return out
+
+
+# -------------------------------------------------
+# CLI
+# -------------------------------------------------
+def _resolve_dataset(value):
+    """A registry table name (income, occupation, race), an API path or a URL."""
+    import MainAI3 as core
+
+    table = core.CENSUS_TABLES.get(value)
+    return table.base_url if table else value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the local columnar Census store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest_cmd = sub.add_parser("ingest", help="Stream downloaded table files into the store")
+    ingest_cmd.add_argument("files", nargs="+", help="CSV / pipe-delimited files (.gz/.zip ok)")
+    ingest_cmd.add_argument(
+        "--dataset", required=True,
+        help="Registry table (income, occupation, race), API path (2021/acs/acs5) or endpoint URL",
+    )
+    ingest_cmd.add_argument("--zips", help="Only keep these comma-separated ZIPs (default: every ZCTA)")
+    ingest_cmd.add_argument("--sep", help="Field separator (default: | for .dat/.txt, else ,)")
+    ingest_cmd.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="Rows read per chunk")
+
+    sub.add_parser("list", help="Show ingested datasets")
+
+    args = parser.parse_args(argv)
+    if pq is None:
+        parser.error("pyarrow is not installed")
+
+    if args.command == "ingest":
+        zips = {z.strip() for z in args.zips.split(",") if z.strip()} if args.zips else None
+        ingest(
+            args.files, _resolve_dataset(args.dataset),
+            chunk_rows=args.chunk_rows, sep=args.sep, zip_filter=zips,
+        )
+    else:
+        print(json.dumps(summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Compact typed schema for the merged dataset, plus memory accounting.
+
+Census values arrive as JSON strings. They are converted in one vectorized
+pass over the whole block (a single pd.to_numeric call) and cast once to the
+registry dtypes:
+- counts and dollar amounts: nullable Int32 (populations and incomes fit)
+- shares computed from them: float32
+- ZipCode / TownName: categorical
+Census annotation values (large negative sentinels such as -666666666 for
+"not computed") become nulls. Redundant name/geo columns are not kept.
+
+    python dataset_schema.py [--zips 10901,10952]   # bytes-per-ZIP report
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+COUNT_DTYPE = "Int32"
+SHARE_DTYPE = "float32"
+KEY_COLUMNS = ["ZipCode", "TownName"]
+
+
+def numeric_block(raw: pd.DataFrame) -> pd.DataFrame:
+    """Every cell of `raw` to float64 with one pd.to_numeric call; sentinels -> NaN."""
+    values = pd.to_numeric(pd.Series(raw.to_numpy(dtype=object).ravel()), errors="coerce")
+    values = values.to_numpy(dtype="float64", copy=True).reshape(raw.shape)
+    # Estimates are never negative; negatives are annotation codes
+    values[values < 0] = np.nan
+    return pd.DataFrame(values, index=raw.index, columns=raw.columns)
+
+
+def apply_schema(block: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """Cast a float64 block to `dtypes` in one astype; integer targets are rounded first."""
+    integer = [c for c, dtype in dtypes.items() if pd.api.types.is_integer_dtype(pd.api.types.pandas_dtype(dtype))]
+    if integer:
+        block = block.copy()
+        block[integer] = block[integer].round()
+    return block.astype(dtypes)
+
+
+def key_frame(zip_codes, towns: dict) -> pd.DataFrame:
+    """Categorical ZipCode/TownName columns for `zip_codes`, indexed by ZIP."""
+    zip_codes = list(zip_codes)
+    return pd.DataFrame(
+        {
+            "ZipCode": pd.Categorical(zip_codes),
+            "TownName": pd.Categorical([towns.get(z) for z in zip_codes]),
+        },
+        index=zip_codes,
+    )
+
+
+def memory_report(df: pd.DataFrame) -> dict:
+    """
+    Deep memory use of `df`: total, per ZIP row and per dtype, next to what
+    the same data costs as float64 values with string keys.
+    """
+    usage = df.memory_usage(deep=True, index=False)
+    by_dtype = {}
+    for column, size in usage.items():
+        dtype = str(df[column].dtype)
+        by_dtype[dtype] = by_dtype.get(dtype, 0) + int(size)
+
+    loose = df.astype({c: object if c in KEY_COLUMNS else "float64" for c in df.columns})
+    rows = max(len(df), 1)
+    total = int(usage.sum())
+    loose_total = int(loose.memory_usage(deep=True, index=False).sum())
+    return {
+        "rows": len(df),
+        "columns": df.shape[1],
+        "bytes": total,
+        "bytes_per_zip": round(total / rows, 1),
+        "float64_bytes_per_zip": round(loose_total / rows, 1),
+        "by_dtype": by_dtype,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the merged dataset's memory use.")
+    parser.add_argument("--zips", help="Comma-separated ZIPs (default: every ZIP in GEO_SCOPE)")
+    args = parser.parse_args(argv)
+
+    import MainAI3 as core
+
+    zips = [z.strip() for z in args.zips.split(",") if z.strip()] if args.zips else core.UNIVERSE.zips
+    print(json.dumps(memory_report(core.build_dataset(zips)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
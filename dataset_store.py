@@ -0,0 +1,191 @@
+"""
+In-memory materialized county dataset.
+
+The merged frame for the whole ZIP universe is built once (at startup or on
+first use), indexed by ZipCode, and refreshed in the background. Requests are
+answered by slicing it with .loc, so no Census calls or merges happen on the
+request path once it is loaded. Each build gets a content hash (`version`)
+that response caching and ETags key on.
+
+A prebuilt snapshot (see snapshot.py) can seed the frame at startup; it is
+served until it is `refresh_seconds` old.
+
+With a shared store (see shared_cache.py) only one worker process builds the
+frame per refresh cycle; the others load that build, version included, so
+every worker serves the same data and the same ETags.
+
+Config (env)
+- DATASET_CACHE_PATH      SQLite file (default: .cache/dataset_cache.sqlite3)
+- DATASET_CACHE_DISABLED  set to 1 to build the dataset in every process
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import pandas as pd
+
+import shared_cache
+from census_cache import open_store
+from dataset_schema import memory_report
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "dataset_cache.sqlite3")
+ENDPOINT = "county-dataset"
+# Longest a worker may hold the build lock; covers a cold Census build
+LOCK_TTL = 300
+
+
+class CountyDataset:
+    """Holds the merged dataset for every ZIP in `zip_codes`, indexed by ZipCode."""
+
+    def __init__(
+        self,
+        builder: Callable[[List[str]], Awaitable[pd.DataFrame]],
+        zip_codes: List[str],
+        refresh_seconds: float,
+        store=None,
+        store_key: str = "county",
+    ):
+        self._builder = builder
+        self.zip_codes = list(zip_codes)
+        self.refresh_seconds = refresh_seconds
+        self.store = store
+        self.key = hashlib.sha1(f"{store_key}|{','.join(self.zip_codes)}".encode("utf-8")).hexdigest()
+        self.frame: Optional[pd.DataFrame] = None
+        self.built_at: Optional[float] = None
+        self.source: Optional[str] = None  # built | loaded (shared store) | seeded (snapshot)
+        self.version: Optional[str] = None
+        self.memory: Optional[dict] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def build(self) -> Tuple[pd.DataFrame, str, float]:
+        """(frame, version, built_at) of a fresh build, without publishing it."""
+        frame = index_by_zip(await self._builder(self.zip_codes))
+        version = hashlib.sha1(pd.util.hash_pandas_object(frame).values.tobytes())
+        version.update(",".join(map(str, frame.columns)).encode("utf-8"))
+        return frame, version.hexdigest()[:16], time.time()
+
+    def _load_shared(self) -> Optional[Tuple[pd.DataFrame, str, float]]:
+        """This cycle's build from the shared store, if another worker already made it."""
+        entry = self.store.get_many([self.key]).get(self.key)
+        # Half a cycle: builds from this cycle count, the previous cycle's don't
+        if entry is None or time.time() - entry["built_at"] > self.refresh_seconds / 2:
+            return None
+        return index_by_zip(decode_frame(entry["frame"])), entry["version"], entry["built_at"]
+
+    def _save_shared(self, frame: pd.DataFrame, version: str, built_at: float):
+        entry = {"frame": encode_frame(frame.reset_index(drop=True)), "version": version, "built_at": built_at}
+        self.store.set_many([(self.key, entry)], ENDPOINT)
+
+    async def _rebuild(self) -> pd.DataFrame:
+        source = "built"
+        if self.store is None:
+            frame, version, built_at = await self.build()
+        else:
+            async with shared_cache.single_flight_async(self.store, f"dataset:{self.key}", ttl=LOCK_TTL):
+                shared = await asyncio.to_thread(self._load_shared)
+                if shared is not None:
+                    frame, version, built_at = shared
+                    source = "loaded"
+                else:
+                    frame, version, built_at = await self.build()
+                    await asyncio.to_thread(self._save_shared, frame, version, built_at)
+        self._publish(frame, version, built_at, source)
+        return frame
+
+    def _publish(self, frame: pd.DataFrame, version: str, built_at: float, source: str):
+        # Frame and version change together (no await in between)
+        self.frame, self.version = frame, version
+        self.built_at, self.source = built_at, source
+        self.memory = memory_report(frame)
+        logger.info("County dataset %s %s: %s", self.version, source, self.memory)
+
+    def seed(self, frame: pd.DataFrame, version: str, built_at: float):
+        """Serve a prebuilt frame (see snapshot.py) until it is due for refresh."""
+        self._publish(frame, version, built_at, "seeded")
+
+    async def refresh(self) -> pd.DataFrame:
+        """Rebuild the frame and swap it in; readers keep the old one until then."""
+        async with self._lock:
+            return await self._rebuild()
+
+    async def get(self) -> pd.DataFrame:
+        """Return the materialized frame, building it first if nothing is loaded yet."""
+        if self.frame is None:
+            async with self._lock:
+                if self.frame is None:
+                    await self._rebuild()
+        return self.frame
+
+    async def snapshot(self) -> Tuple[pd.DataFrame, str]:
+        """Return (frame, version) from the same build."""
+        await self.get()
+        return self.frame, self.version
+
+    async def slice(self, zip_codes: List[str]) -> pd.DataFrame:
+        frame = await self.get()
+        return slice_frame(frame, zip_codes)
+
+    async def _refresh_loop(self):
+        if self.built_at is not None:
+            # Seeded: the first refresh is due when the seed is refresh_seconds old
+            await asyncio.sleep(max(0.0, self.built_at + self.refresh_seconds - time.time()))
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                # Keep serving the previous frame; try again next cycle
+                logger.exception("County dataset refresh failed")
+            await asyncio.sleep(self.refresh_seconds)
+
+    def start(self):
+        """Build now and keep refreshing every `refresh_seconds` in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def encode_frame(frame: pd.DataFrame) -> dict:
+    """JSON-safe form of a frame that keeps its dtypes (Int32, float32, category, ...)."""
+    return {
+        "columns": [str(c) for c in frame.columns],
+        "dtypes": [str(dtype) for dtype in frame.dtypes],
+        "data": frame.astype(object).where(frame.notna(), None).values.tolist(),
+    }
+
+
+def decode_frame(encoded: dict) -> pd.DataFrame:
+    frame = pd.DataFrame(encoded["data"], columns=encoded["columns"])
+    return frame.astype(dict(zip(encoded["columns"], encoded["dtypes"])))
+
+
+def from_env():
+    """Shared store for the county dataset, or None when disabled."""
+    if os.getenv("DATASET_CACHE_DISABLED", "").strip().lower() in ("1", "true", "yes"):
+        return None
+    # Freshness is decided by refresh_seconds; the TTL only drops abandoned entries
+    return open_store("dataset", os.getenv("DATASET_CACHE_PATH", DEFAULT_PATH), ttl=7 * 24 * 3600, max_bytes=0)
+
+
+def index_by_zip(frame: pd.DataFrame) -> pd.DataFrame:
+    """Index a merged frame by ZipCode, keeping the ZipCode column."""
+    frame = frame.set_index("ZipCode", drop=False)
+    frame.index.name = None
+    return frame
+
+
+def slice_frame(frame: pd.DataFrame, zip_codes: List[str]) -> pd.DataFrame:
+    return frame.loc[list(zip_codes)].reset_index(drop=True)
@@ -0,0 +1,208 @@
+"""
+Geography universe: the ZCTAs the service covers and their town, county and state.
+
+GEO_SCOPE picks the universe:
+- county (default): the 23 Rockland ZIPs of MainAI3.ROCKLAND_ZIPS_TOWNS, or
+  with GEO_COUNTY set to another county FIPS, that county's ZCTAs from the
+  crosswalk
+- state: every ZCTA of GEO_STATE in the crosswalk (New York: ~1,800)
+- nation: every ZCTA in the crosswalk (~33,800)
+
+The crosswalk is a local file, read once into a ZIP-indexed lookup. Accepted
+inputs are the Census ZCTA-to-county relationship file
+(tab20_zcta520_county20_natl.txt, pipe-delimited), HUD's ZIP-county
+crosswalk, or any CSV with zip/zcta, town/city, county, county_fips and state
+(FIPS) columns. A ZCTA spanning several counties belongs to the one with the
+largest share (land area / ratio column). Files without town names fall back
+to the county name; the Rockland ZIPs always keep their curated town names.
+
+Above CENSUS_WILDCARD_MIN_ZIPS ZIPs, MainAI3.census_get_rows pulls each chunk
+with one `zip code tabulation area:*` call instead of listing ZIPs.
+
+Config (env)
+- GEO_SCOPE            county | state | nation (default: county)
+- GEO_STATE            state FIPS for GEO_SCOPE=state and pre-2020 vintages (default: 36)
+- GEO_COUNTY           county FIPS for GEO_SCOPE=county (default: 36087, Rockland)
+- GEO_CROSSWALK_PATH   crosswalk file (default: data/zcta_crosswalk.csv)
+
+CLI
+    python geography.py build FILE... [--out data/zcta_crosswalk.csv]
+    python geography.py info
+    python geography.py lookup 10901,90210
+"""
+import argparse
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+SCOPES = ("county", "state", "nation")
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "zcta_crosswalk.csv")
+ROCKLAND_FIPS = "36087"
+
+SCOPE = os.getenv("GEO_SCOPE", "county").strip().lower()
+STATE = os.getenv("GEO_STATE", "36").strip()
+COUNTY = os.getenv("GEO_COUNTY", ROCKLAND_FIPS).strip()
+
+COLUMNS = ["ZipCode", "TownName", "County", "CountyFips", "State"]
+# Accepted header names per column (matched case-insensitively)
+ALIASES = {
+    "ZipCode": ("zipcode", "zip", "zip_code", "zcta", "zcta5", "geoid_zcta5_20", "zcta5ce20"),
+    "TownName": ("townname", "town", "city", "usps_zip_pref_city", "po_name"),
+    "County": ("county", "county_name", "namelsad_county_20"),
+    "CountyFips": ("countyfips", "county_fips", "geoid_county_20"),
+    "State": ("state", "state_fips", "statefp"),
+    "Weight": ("weight", "arealand_part", "res_ratio", "tot_ratio", "afact"),
+}
+
+
+class Universe:
+    """ZCTAs in scope, in ZIP order, with a ZIP-keyed lookup of town, county and state."""
+
+    def __init__(self, scope: str, frame: pd.DataFrame):
+        self.scope = scope
+        self.frame = frame.sort_index()
+        self.zips: List[str] = list(self.frame.index)
+        self.towns: Dict[str, str] = self.frame["TownName"].to_dict()
+        self.states = sorted(self.frame["State"].dropna().unique())
+        # How prompts refer to the area ("Rockland County"); empty for a state or the nation
+        counties = self.frame["County"].dropna().unique()
+        self.label = counties[0] if scope == "county" and len(counties) == 1 else ""
+
+    def __contains__(self, zip_code) -> bool:
+        return zip_code in self.towns
+
+    def __len__(self) -> int:
+        return len(self.zips)
+
+    def lookup(self, zip_codes: Iterable[str]) -> pd.DataFrame:
+        """Rows for the known ZIPs among `zip_codes`, in the order given."""
+        return self.frame.loc[[z for z in zip_codes if z in self.towns]]
+
+    def search(self, state: Optional[str] = None, county: Optional[str] = None,
+               town: Optional[str] = None) -> pd.DataFrame:
+        """ZIPs by state FIPS, county (FIPS or name prefix) and/or town name substring."""
+        frame = self.frame
+        if state:
+            frame = frame[frame["State"] == state]
+        if county:
+            by_name = frame["County"].str.lower().str.startswith(county.lower(), na=False)
+            frame = frame[(frame["CountyFips"] == county) | by_name]
+        if town:
+            frame = frame[frame["TownName"].str.contains(town, case=False, regex=False, na=False)]
+        return frame
+
+
+def _column(frame: pd.DataFrame, name: str) -> Optional[str]:
+    headers = {str(c).strip().lower(): c for c in frame.columns}
+    return next((headers[alias] for alias in ALIASES[name] if alias in headers), None)
+
+
+def read_crosswalk(path: str) -> pd.DataFrame:
+    """
+    One crosswalk file as [ZipCode, TownName, County, CountyFips, State] plus
+    Weight, one row per (ZCTA, county) pair it lists.
+    """
+    sep = "|" if re.search(r"\.(txt|dat)$", path) else ","
+    raw = pd.read_csv(path, sep=sep, dtype=str)
+    zips = _column(raw, "ZipCode")
+    if zips is None:
+        raise ValueError(f"{path}: no ZIP/ZCTA column (one of {ALIASES['ZipCode']})")
+    frame = pd.DataFrame({"ZipCode": raw[zips].str.strip().str.zfill(5)})
+    for name in COLUMNS[1:] + ["Weight"]:
+        source = _column(raw, name)
+        frame[name] = raw[source].str.strip() if source is not None else None
+    frame["Weight"] = pd.to_numeric(frame["Weight"], errors="coerce")
+    frame["State"] = frame["State"].fillna(frame["CountyFips"].str[:2])
+    # The relationship file also lists counties without any ZCTA
+    return frame[frame["ZipCode"].str.fullmatch(r"\d{5}", na=False)]
+
+
+def build_crosswalk(paths: List[str]) -> pd.DataFrame:
+    """
+    Merge crosswalk files into one row per ZCTA (its primary county), indexed
+    by ZipCode. Earlier files win; later ones fill their gaps (e.g. town names).
+    """
+    merged = None
+    for path in paths:
+        frame = read_crosswalk(path).sort_values("Weight", ascending=False, na_position="last")
+        frame = frame.drop_duplicates("ZipCode").set_index("ZipCode")[COLUMNS[1:]]
+        merged = frame if merged is None else merged.combine_first(frame)
+    merged["TownName"] = merged["TownName"].fillna(merged["County"])
+    return merged.sort_index()
+
+
+def load(scope: str, towns: Dict[str, str], path: Optional[str] = None) -> Universe:
+    """
+    The universe for `scope`. `towns` is the built-in county (ZIP -> town
+    name), used as is for the default county and overlaid on the crosswalk.
+    """
+    if scope not in SCOPES:
+        raise ValueError(f"GEO_SCOPE must be one of {SCOPES}, not {scope!r}")
+    builtin = pd.DataFrame(
+        {"TownName": pd.Series(towns), "County": "Rockland County", "CountyFips": ROCKLAND_FIPS, "State": "36"}
+    )
+    builtin.index.name = "ZipCode"
+    if scope == "county" and COUNTY == ROCKLAND_FIPS:
+        return Universe(scope, builtin)
+
+    path = path or os.getenv("GEO_CROSSWALK_PATH", DEFAULT_PATH)
+    if not os.path.exists(path):
+        raise RuntimeError(
+            f"GEO_SCOPE={scope} needs a ZCTA crosswalk at {path} (GEO_CROSSWALK_PATH); "
+            "build one with `python geography.py build FILE...`"
+        )
+    frame = build_crosswalk([path])
+    frame.loc[builtin.index.intersection(frame.index), "TownName"] = builtin["TownName"]
+    if scope == "state":
+        frame = frame[frame["State"] == STATE]
+    elif scope == "county":
+        frame = frame[frame["CountyFips"] == COUNTY]
+    if frame.empty:
+        raise RuntimeError(f"No ZCTAs for GEO_SCOPE={scope} (GEO_STATE={STATE}, GEO_COUNTY={COUNTY}) in {path}")
+    return Universe(scope, frame)
+
+
+def from_env(towns: Dict[str, str]) -> Universe:
+    return load(SCOPE, towns)
+
+
+# -------------------------------------------------
+# CLI
+# -------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the ZCTA crosswalk.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Merge crosswalk files into one compact CSV")
+    build.add_argument("files", nargs="+", help="Census relationship file, HUD crosswalk or CSV")
+    build.add_argument("--out", default=os.getenv("GEO_CROSSWALK_PATH", DEFAULT_PATH))
+
+    sub.add_parser("info", help="Show the configured universe")
+
+    lookup = sub.add_parser("lookup", help="Town, county and state of ZIPs")
+    lookup.add_argument("zips", help="Comma-separated ZIPs")
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        frame = build_crosswalk(args.files)
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        frame.to_csv(args.out)
+        print(f"{len(frame)} ZCTAs in {frame['State'].nunique()} states -> {args.out}")
+        return
+
+    import MainAI3 as core
+
+    universe = core.UNIVERSE
+    if args.command == "info":
+        counts = universe.frame["State"].value_counts().sort_index().to_dict()
+        print(json.dumps({"scope": universe.scope, "zips": len(universe), "zips_per_state": counts}, indent=2))
+    else:
+        zips = [z.strip() for z in args.zips.split(",") if z.strip()]
+        print(universe.lookup(zips).to_string())
+
+
+if __name__ == "__main__":
+    main()
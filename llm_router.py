@@ -0,0 +1,288 @@
+"""
+Latency-aware routing for the narrative chat completion.
+
+Instead of one fixed call (gpt-4o-mini, max_tokens=1000, no deadline), a
+narrative goes through `Router`:
+- plan: LLM_MODELS lists the models best first, fastest last. Each has a
+  latency estimate, overhead + prompt_tokens / prefill rate + max_tokens /
+  output rate from LLM_MODEL_PROFILES, times a scale learned from its calls
+  (a moving average of observed / estimated time; an abandoned call counts
+  as at least as slow as it got). With a latency target, the plan is the first model that can write
+  at least the smallest LLM_OUTPUT_TIERS budget within LLM_PLAN_SHARE of the
+  target, with the largest budget that fits. Without one, it is the first
+  model with the full budget (the previous behaviour).
+- deadline: the request's latency target, else LLM_DEADLINE_SECONDS. Past
+  it nothing is awaited any more (the upstream call also gets it as its
+  request timeout).
+- hedge / fallback: when the planned call runs LLM_HEDGE_FACTOR times its
+  estimate, or would otherwise leave the next model less than that factor
+  times its own, or fails, the next faster model starts with the budget that fits the time
+  left; the first answer wins. If no model answers in time,
+  the caller's template (a deterministic summary of the data) is served.
+- each result records the path that served it (planned, hedge, fallback or
+  template), the model and the budget; metrics count them (llm_route_total).
+
+Only planned answers should be cached; a hedge, fallback or template answer
+is a degraded stand-in for one request.
+
+Config (env)
+- LLM_MODELS            models in preference order (default: gpt-4o-mini,gpt-4.1-nano)
+- LLM_MODEL_PROFILES    model=overhead_s/prefill_tps/output_tps, comma-separated
+                        (defaults: PROFILES below)
+- LLM_DEADLINE_SECONDS  hard deadline without a latency target (default: 45)
+- LLM_OUTPUT_TIERS      output budgets to choose from (default: 1000,600,300)
+- LLM_PLAN_SHARE        share of the target a plan may use (default: 0.8)
+- LLM_HEDGE_FACTOR      hedge once a call runs this many times its estimate (default: 1.5)
+
+Run against bench/fake_openai.py with per-model latencies, e.g.
+    python bench/fake_openai.py --model gpt-4o-mini:20:30 --model gpt-4.1-nano:0.3:400
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import metrics
+import prompt_encoder
+
+logger = logging.getLogger(__name__)
+
+# Seconds of overhead, prompt tokens per second, output tokens per second
+PROFILES = {
+    "gpt-4o-mini": (0.6, 5000.0, 60.0),
+    "gpt-4.1-nano": (0.4, 10000.0, 120.0),
+    "gpt-4o": (0.8, 3000.0, 40.0),
+    "gpt-3.5-turbo": (0.4, 8000.0, 90.0),
+}
+DEFAULT_PROFILE = (0.8, 3000.0, 40.0)
+# Weight of each observed call in a model's latency scale, and the most one call may move it
+LEARNING_RATE = 0.2
+SCALE_BOUNDS = (0.25, 4.0)
+
+PATHS = ("planned", "hedge", "fallback", "template")
+
+
+class Route(NamedTuple):
+    model: str
+    max_tokens: int
+    predicted: float  # seconds
+
+
+class Routed(NamedTuple):
+    text: str
+    path: str  # PATHS
+    model: Optional[str]  # None for the template
+    max_tokens: int
+    elapsed: float
+    predicted: float
+    error: Optional[str] = None  # why the planned call did not serve, if it did not
+
+    def info(self) -> dict:
+        info = {
+            "path": self.path, "model": self.model, "max_tokens": self.max_tokens,
+            "elapsed_ms": round(self.elapsed * 1000, 1), "predicted_ms": round(self.predicted * 1000, 1),
+        }
+        if self.error:
+            info["error"] = self.error
+        return info
+
+
+def _profiles_from_env() -> Dict[str, tuple]:
+    profiles = dict(PROFILES)
+    for item in os.getenv("LLM_MODEL_PROFILES", "").split(","):
+        if "=" in item:
+            name, values = item.split("=", 1)
+            profiles[name.strip()] = tuple(float(v) for v in values.split("/"))
+    return profiles
+
+
+def describe(exc: BaseException) -> str:
+    """One short line for an upstream error (openai errors carry the whole response in str())."""
+    message = (getattr(exc, "user_message", None) or str(exc)).strip()
+    message = message.splitlines()[0] if message else ""
+    return f"{type(exc).__name__}: {message[:120]}" if message else type(exc).__name__
+
+
+class Router:
+    """
+    Plans and runs chat completions through `call`, a blocking
+    (prompt, model=, temperature=, max_tokens=, timeout=) -> text.
+    """
+
+    def __init__(
+        self,
+        call: Callable[..., str],
+        models: List[str],
+        profiles: Optional[Dict[str, tuple]] = None,
+        tiers: tuple = (1000, 600, 300),
+        deadline: float = 45.0,
+        plan_share: float = 0.8,
+        hedge_factor: float = 1.5,
+    ):
+        self._call = call
+        self.models = list(models)
+        self.profiles = {m: (profiles or PROFILES).get(m, DEFAULT_PROFILE) for m in self.models}
+        self.scales = {m: 1.0 for m in self.models}
+        self.tiers = sorted(tiers, reverse=True)
+        self.deadline = deadline
+        self.plan_share = plan_share
+        self.hedge_factor = hedge_factor
+        self._lock = threading.Lock()
+
+    def _estimate(self, model: str, prompt_tokens: int, max_tokens: int) -> float:
+        overhead, prefill, output = self.profiles[model]
+        return overhead + prompt_tokens / prefill + max_tokens / output
+
+    def predict(self, model: str, prompt_tokens: int, max_tokens: int) -> float:
+        """Seconds a call of `model` writing up to `max_tokens` is expected to take."""
+        return self.scales[model] * self._estimate(model, prompt_tokens, max_tokens)
+
+    def _fit(self, model: str, prompt_tokens: int, seconds: float) -> Optional[Route]:
+        """The largest budget of `model` predicted to finish within `seconds`, if any."""
+        for tier in self.tiers:
+            predicted = self.predict(model, prompt_tokens, tier)
+            if predicted <= seconds:
+                return Route(model, tier, predicted)
+        return None
+
+    def plan(self, prompt_tokens: int, target: Optional[float] = None) -> Optional[Route]:
+        """The route for a prompt: best model and budget for `target` seconds (None: no target)."""
+        if not target:
+            model = self.models[0]
+            return Route(model, self.tiers[0], self.predict(model, prompt_tokens, self.tiers[0]))
+        for model in self.models:
+            route = self._fit(model, prompt_tokens, target * self.plan_share)
+            if route is not None:
+                return route
+        # Nothing fits the plan share; try the fastest model with whatever time there is
+        return self._fit(self.models[-1], prompt_tokens, target)
+
+    def observe(
+        self, model: str, prompt_tokens: int, completion_tokens: int, elapsed: float, at_least: bool = False
+    ):
+        """
+        Update `model`'s latency scale from a call that wrote `completion_tokens`
+        in `elapsed` seconds (`at_least`: had not finished by then).
+        """
+        ratio = elapsed / self._estimate(model, prompt_tokens, max(1, completion_tokens))
+        with self._lock:
+            scale = self.scales[model]
+            if at_least and ratio <= scale:
+                return
+            ratio = min(max(ratio, scale * SCALE_BOUNDS[0]), scale * SCALE_BOUNDS[1])
+            self.scales[model] = (1 - LEARNING_RATE) * scale + LEARNING_RATE * ratio
+
+    async def run(
+        self,
+        route: Optional[Route],
+        prompt: str,
+        temperature: float,
+        template: Callable[[], str],
+        deadline: float,
+        prompt_tokens: Optional[int] = None,
+    ) -> Routed:
+        """
+        Answer `prompt` by `deadline` (time.monotonic()): `route` (a plan) first,
+        then faster models as hedge or fallback, else `template()`. Never raises.
+        """
+        started = time.monotonic()
+        if prompt_tokens is None:
+            prompt_tokens = prompt_encoder.count_tokens(prompt)
+        planned = route
+        later = self.models[self.models.index(route.model) + 1:] if route is not None else []
+        running: Dict[asyncio.Future, tuple] = {}
+        error = None if route is not None else "no model fits the latency target"
+
+        async def attempt(route: Route) -> str:
+            begun = time.monotonic()
+            text = await asyncio.to_thread(
+                self._call, prompt, model=route.model, temperature=temperature,
+                max_tokens=route.max_tokens, timeout=max(1.0, deadline - begun),
+            )
+            self.observe(route.model, prompt_tokens, prompt_encoder.count_tokens(text, route.model),
+                         time.monotonic() - begun)
+            return text
+
+        def start(route: Route, path: str, at: float):
+            running[asyncio.ensure_future(attempt(route))] = (path, route, at + route.predicted * self.hedge_factor, at)
+
+        def next_route() -> Optional[Route]:
+            # The next faster model that can still finish before the deadline
+            while later:
+                route = self._fit(later.pop(0), prompt_tokens, deadline - time.monotonic())
+                if route is not None:
+                    return route
+            return None
+
+        if route is not None:
+            start(route, "planned", started)
+        try:
+            while running:
+                now = time.monotonic()
+                hedge_at = deadline
+                if later:
+                    # When the running calls are late, or while the next model still has time to spare
+                    last_start = deadline - self.predict(later[0], prompt_tokens, self.tiers[-1]) * self.hedge_factor
+                    hedge_at = min([last_start] + [at for _, _, at, _ in running.values()])
+                done, _ = await asyncio.wait(
+                    list(running), timeout=max(0.0, min(deadline, hedge_at) - now),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    path, route, _, _ = running.pop(task)
+                    if task.exception() is None:
+                        return self.served(task.result(), path, route, started, error)
+                    error = f"{route.model}: {describe(task.exception())}"
+                    logger.warning("Narrative call failed (%s)", error)
+                    fallback = next_route()
+                    if fallback is not None:
+                        start(fallback, "fallback", time.monotonic())
+                now = time.monotonic()
+                if now >= deadline:
+                    error = error or f"deadline ({deadline - started:.1f}s) passed"
+                    break
+                if not done and later and now >= hedge_at:
+                    hedge = next_route()
+                    if hedge is not None:
+                        # The slow call keeps running; whichever answers first wins
+                        for task, (path, route, _, begun) in list(running.items()):
+                            running[task] = (path, route, float("inf"), begun)
+                        start(hedge, "hedge", now)
+        finally:
+            now = time.monotonic()
+            for task, (_, route, _, begun) in running.items():
+                # Abandoned: it took at least this long without finishing its budget
+                self.observe(route.model, prompt_tokens, route.max_tokens, now - begun, at_least=True)
+                task.cancel()
+        return self.served(template(), "template", planned, started, error)
+
+    def served(
+        self, text: str, path: str, route: Optional[Route], started: float, error: Optional[str] = None
+    ) -> Routed:
+        """
+        The result of a request started at `started`, counted in llm_route_total.
+        `route` is the one that answered; for the template, the plan (if any).
+        """
+        predicted = route.predicted if route is not None else 0.0
+        if path == "template":
+            metrics.llm_routes.inc(path=path, model="")
+            return Routed(text, path, None, 0, time.monotonic() - started, predicted, error)
+        metrics.llm_routes.inc(path=path, model=route.model)
+        return Routed(text, path, route.model, route.max_tokens, time.monotonic() - started, predicted,
+                      None if path == "planned" else error)
+
+
+def from_env(call: Callable[..., str], default_model: str, default_max_tokens: int) -> Router:
+    models = [m.strip() for m in os.getenv("LLM_MODELS", f"{default_model},gpt-4.1-nano").split(",") if m.strip()]
+    tiers = os.getenv("LLM_OUTPUT_TIERS", f"{default_max_tokens},600,300")
+    return Router(
+        call,
+        models,
+        _profiles_from_env(),
+        tiers=tuple(int(t) for t in tiers.split(",") if t.strip()),
+        deadline=float(os.getenv("LLM_DEADLINE_SECONDS", "45")),
+        plan_share=float(os.getenv("LLM_PLAN_SHARE", "0.8")),
+        hedge_factor=float(os.getenv("LLM_HEDGE_FACTOR", "1.5")),
+    )
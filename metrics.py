@@ -0,0 +1,249 @@
+"""
+Process metrics, per-request stage timings and opt-in profiling.
+
+- Counters and histograms are rendered in the Prometheus text format by
+  `render()` (served at /api/metrics). No client library is needed.
+- `stage(name)` times a block of work: it feeds the `stage_seconds` histogram
+  and, inside a request (see `request_timings`), the request's Server-Timing
+  header. Timings follow the context into asyncio.to_thread workers.
+- With PROFILE_DIR set, requests sending `X-Profile: 1` (or ?profile=1) are
+  run under cProfile and dumped to PROFILE_DIR as .prof files. Open them with
+  snakeviz for a flame/icicle view, or with `python -m pstats`. Only the event
+  loop thread is profiled, which is where the pandas/serialization work runs.
+  One profile runs at a time. cProfile records the whole thread, so requests
+  served concurrently on the same loop show up in the profile too; the
+  X-Profile-Overlap response header counts them (0 = a clean profile).
+
+Config (env)
+- PROFILE_DIR   directory for per-request profiles; unset = profiling off.
+                Profiles include any requests running at the same time.
+"""
+import contextvars
+import cProfile
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _label_text(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.labels, key)} {value:g}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        # key -> ([count per bucket], sum, count)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, ([*entry[0]], entry[1], entry[2])) for key, entry in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            for bound, n in zip(self.buckets, counts):
+                labels = _label_text(self.labels + ("le",), key + (f"{bound:g}",))
+                lines.append(f"{self.name}_bucket{labels} {n}")
+            lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total:g}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# -------------------------------------------------
+# Metric definitions
+# -------------------------------------------------
+http_requests = Counter("http_requests_total", "HTTP requests handled.", ("method", "route", "status"))
+http_seconds = Histogram("http_request_seconds", "HTTP request latency.", ("method", "route"))
+stage_seconds = Histogram("stage_seconds", "Time spent per pipeline stage.", ("stage",))
+response_bytes = Histogram(
+    "response_body_bytes", "Encoded response body size.", ("route", "format"), buckets=SIZE_BUCKETS
+)
+
+census_requests = Counter("census_upstream_requests_total", "Census API attempts by outcome.", ("outcome",))
+census_bytes = Counter("census_upstream_bytes_total", "Census API response bytes received.")
+census_cache_rows = Counter("census_cache_rows_total", "Per-ZIP Census cache lookups.", ("result",))
+
+openai_requests = Counter("openai_requests_total", "Chat completion calls by outcome.", ("mode", "outcome"))
+openai_tokens = Counter("openai_tokens_total", "Tokens sent to and received from the model.", ("kind",))
+prompt_tokens = Histogram("prompt_data_tokens", "Tokens in the encoded prompt data.", buckets=TOKEN_BUCKETS)
+report_cache_results = Counter("ai_report_cache_total", "AI report cache results.", ("source",))
+narrative_fragments = Counter(
+    "ai_narrative_fragments_total", "Map-reduce narrative fragments by cache result.", ("source",)
+)
+llm_routes = Counter("llm_route_total", "Narratives by the route that served them.", ("path", "model"))
+cache_locks = Counter("shared_cache_locks_total", "Cross-process refresh locks by result.", ("result",))
+
+
+# -------------------------------------------------
+# Stage timing / Server-Timing
+# -------------------------------------------------
+_timings: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block as pipeline stage `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+# Requests in flight and started so far, for the overlap of a profile
+_requests = {"in_flight": 0, "started": 0}
+
+
+@contextmanager
+def request_timings():
+    """Collect the stages run while handling one request; yields the list."""
+    timings: List[Tuple[str, float]] = []
+    token = _timings.set(timings)
+    _requests["in_flight"] += 1
+    _requests["started"] += 1
+    try:
+        yield timings
+    finally:
+        _requests["in_flight"] -= 1
+        _timings.reset(token)
+
+
+def server_timing(timings: List[Tuple[str, float]], total: Optional[float] = None) -> str:
+    """Server-Timing header value; repeated stages are summed."""
+    merged: Dict[str, List[float]] = {}
+    for name, seconds in timings:
+        entry = merged.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = [
+        f"{name};dur={seconds * 1000:.1f}" + (f';desc="x{count}"' if count > 1 else "")
+        for name, (seconds, count) in merged.items()
+    ]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# -------------------------------------------------
+# Opt-in profiling
+# -------------------------------------------------
+_profile_lock = threading.Lock()
+
+
+class ProfileRun:
+    """A running profile: its file and, once done, how many other requests overlapped it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.overlap = 0
+
+
+def profiling_requested(headers, query_params) -> bool:
+    return bool(PROFILE_DIR) and (headers.get("x-profile") == "1" or query_params.get("profile") == "1")
+
+
+@contextmanager
+def profiled(label: str):
+    """
+    Run the block (one request, inside its request_timings) under cProfile
+    and dump it to PROFILE_DIR; yields a ProfileRun, or None when another
+    profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        yield None
+        return
+    stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+    run = ProfileRun(os.path.join(PROFILE_DIR, f"{stamp}-{re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_')}.prof"))
+    # Others already running, plus those that start before the block ends
+    running, started = _requests["in_flight"] - 1, _requests["started"]
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        yield run
+    finally:
+        profiler.disable()
+        run.overlap = running + _requests["started"] - started
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(run.path)
+        _profile_lock.release()
@@ -0,0 +1,188 @@
+"""
+Map-reduce AI narratives: cached per-cluster fragments, then one combining pass.
+
+A single-prompt report (app.build_prompt) grows with the selection and is
+regenerated whole whenever one ZIP changes. In map_reduce mode:
+- map: the selected ZIPs are grouped into clusters, fixed blocks of
+  NARRATIVE_CLUSTER_SIZE consecutive ZIPs of the universe (1 = one fragment
+  per ZIP), so adding a ZIP to a selection only changes its own cluster. Each
+  cluster gets a short factual fragment written from its own encoded rows.
+  Fragments ignore the user's question and use a fixed temperature, so their
+  cache key (report_cache.report_key of the fragment prompt, which embeds the
+  data) only changes when the data does. They go through the report cache,
+  at most NARRATIVE_MAP_CONCURRENCY at once per request: cached fragments are
+  reused, concurrent requests share in-flight ones, and only the rest call
+  the model.
+- reduce: the fragments, in ZIP order, plus exact group aggregates and the
+  user's question go into one final prompt. Its narrative is cached like any
+  other report.
+
+Config (env)
+- NARRATIVE_MODE             single | map_reduce, for requests without `mode` (default: single)
+- NARRATIVE_CLUSTER_SIZE     ZIPs per fragment (default: 1)
+- NARRATIVE_MAP_CONCURRENCY  fragments generated at once per request (default: 8)
+- NARRATIVE_FRAGMENT_TOKENS  max_tokens per fragment (default: 200)
+
+template_summary() is the deterministic stand-in served when no model
+answers within a request's deadline (see llm_router.py).
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+
+import pandas as pd
+
+import MainAI3 as core
+import metrics
+import prompt_encoder
+import report_cache
+
+MODES = ("single", "map_reduce")
+MODE = os.getenv("NARRATIVE_MODE", "single").strip().lower()
+CLUSTER_SIZE = max(1, int(os.getenv("NARRATIVE_CLUSTER_SIZE", "1")))
+MAP_CONCURRENCY = max(1, int(os.getenv("NARRATIVE_MAP_CONCURRENCY", "8")))
+FRAGMENT_MAX_TOKENS = int(os.getenv("NARRATIVE_FRAGMENT_TOKENS", "200"))
+# Fragments are reused across requests, so they must not vary with the request's temperature
+FRAGMENT_TEMPERATURE = 0.2
+
+# async (prompt, model=, temperature=, max_tokens=) -> completion text
+Complete = Callable[..., Awaitable[str]]
+
+_position = {z: i for i, z in enumerate(core.UNIVERSE.zips)}
+
+
+class Fragment(NamedTuple):
+    zips: List[str]
+    text: str
+    cache: str  # hit | coalesced | miss (see report_cache.ReportCache.get_or_create)
+
+
+def clusters(zip_codes: List[str], size: int = CLUSTER_SIZE) -> List[List[str]]:
+    """`zip_codes` grouped by their block of `size` ZIPs in the universe, in universe order."""
+    blocks = {}
+    for z in sorted(zip_codes, key=lambda z: _position.get(z, -1)):
+        blocks.setdefault(_position.get(z, -1) // size, []).append(z)
+    return list(blocks.values())
+
+
+def fragment_prompt(encoded: prompt_encoder.EncodedDataset, zips: List[str], area: str = "") -> str:
+    """Prompt for the factual notes on one cluster's encoded rows (no user question)."""
+    return (
+        f"Below is Census data for {len(zips)} {area}ZIP code(s):\n"
+        "- Income data (from 2021 ACS, B19001/B19013)\n"
+        "- Occupational data (from 2021 ACS Subject Table S2401)\n"
+        "- Race data (from 2020 Decennial Census DHC Table P8, with multi-race rollups)\n\n"
+        f"{encoded.notes}\n\n"
+        f"{encoded.text}\n"
+        "Write compact factual notes (at most 120 words) on each ZIP above: population, median income "
+        "and income distribution, occupational profile and racial composition, and what stands out. "
+        "Name each ZIP and town, quote figures exactly as given, and do not speculate or recommend."
+    )
+
+
+def combine_prompt(fragments: List[Fragment], area: str = "", sections: str = "") -> str:
+    """Final prompt over the fragments; `sections` carries exact aggregates and the user request."""
+    notes = "\n\n".join(f"[{', '.join(f.zips)}]\n{f.text}" for f in fragments)
+    return (
+        "You are an analytical assistant. Below are factual notes, each written from the Census data "
+        "of the ZIP code(s) in brackets (2021 ACS income B19001/B19013 and occupations S2401, "
+        "2020 Decennial DHC race P8):\n\n"
+        f"{notes}\n"
+        f"{sections}"
+        "Please combine these notes into a comprehensive semantic analysis exploring the relationship "
+        f"between income distribution, occupational profile, and racial composition in these {area}ZIP "
+        "codes. Compare the ZIPs with each other and rely only on the figures given."
+    )
+
+
+async def map_fragments(
+    final_df: pd.DataFrame,
+    cache: report_cache.ReportCache,
+    complete: Complete,
+    model: str,
+    area: str = "",
+    size: int = CLUSTER_SIZE,
+    concurrency: int = MAP_CONCURRENCY,
+) -> List[Fragment]:
+    """One fragment per cluster of `final_df`'s ZIPs, from the cache or generated in parallel."""
+    groups = clusters([str(z) for z in final_df["ZipCode"]], size)
+    with metrics.stage("prompt"):
+        encoded = prompt_encoder.encode_groups(final_df, groups, model=model)
+    for part in encoded:
+        metrics.prompt_tokens.observe(part.tokens)
+    slots = asyncio.Semaphore(concurrency)
+    params = {"model": model, "temperature": FRAGMENT_TEMPERATURE, "max_tokens": FRAGMENT_MAX_TOKENS}
+
+    async def one(zips: List[str], prompt: str) -> Fragment:
+        async def create() -> str:
+            async with slots:
+                return await complete(prompt, **params)
+
+        text, source = await cache.get_or_create(report_cache.report_key(prompt, **params), create)
+        metrics.narrative_fragments.inc(source=source)
+        return Fragment(zips, text, source)
+
+    prompts = [fragment_prompt(part, zips, area) for zips, part in zip(groups, encoded)]
+    return list(await asyncio.gather(*(one(zips, prompt) for zips, prompt in zip(groups, prompts))))
+
+
+# -------------------------------------------------
+# Template summary (no model)
+# -------------------------------------------------
+def _number(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(series, errors="coerce").astype("float64")
+
+
+def _place(final_df: pd.DataFrame, i) -> str:
+    row = final_df.loc[i]
+    town = row.get("TownName")
+    return f"{row['ZipCode']} ({town})" if isinstance(town, str) and town else str(row["ZipCode"])
+
+
+def _top_shares(final_df: pd.DataFrame, labels: List[str], total: str, count: int = 3) -> str:
+    labels = [label for label in labels if label in final_df.columns]
+    denominator = _number(final_df[total]).sum() if total in final_df.columns else 0
+    if not labels or not denominator:
+        return ""
+    shares = {label: _number(final_df[label]).sum() / denominator * 100 for label in labels}
+    top = sorted(shares.items(), key=lambda item: -item[1])[:count]
+    return ", ".join(f"{label} {share:.1f}%" for label, share in top)
+
+
+def template_summary(final_df: pd.DataFrame, aggregates: Optional[pd.DataFrame] = None, area: str = "") -> str:
+    """
+    Factual summary of `final_df` (and group `aggregates`) without a model:
+    population, median income range, leading occupations and races. Columns
+    the request left out are skipped.
+    """
+    final_df = final_df.reset_index(drop=True)
+    lines = [f"Summary of the Census data for {len(final_df)} {area}ZIP code(s), computed directly from the "
+             "figures (the AI narrative was not available in time)."]
+    if "TotalPopulation" in final_df.columns:
+        population = _number(final_df["TotalPopulation"])
+        if population.notna().any():
+            lines.append(f"- Population: {population.sum():,.0f} in total; the largest ZIP is "
+                         f"{_place(final_df, population.idxmax())} with {population.max():,.0f}.")
+    if "MedianIncome" in final_df.columns:
+        income = _number(final_df["MedianIncome"])
+        if income.notna().any():
+            lines.append(f"- Median household income ranges from ${income.min():,.0f} in "
+                         f"{_place(final_df, income.idxmin())} to ${income.max():,.0f} in "
+                         f"{_place(final_df, income.idxmax())}.")
+    occupations = _top_shares(final_df, prompt_encoder.OCCUPATION_MAJOR, prompt_encoder.OCCUPATION_TOTAL)
+    if occupations:
+        lines.append(f"- Largest occupation groups of the employed population: {occupations}.")
+    races = _top_shares(
+        final_df, prompt_encoder.RACE_ALONE + [prompt_encoder.RACE_TWO_OR_MORE], prompt_encoder.RACE_TOTAL
+    )
+    if races:
+        lines.append(f"- Largest racial groups: {races}.")
+    if aggregates is not None:
+        for group, row in aggregates.iterrows():
+            parts = [f"{int(row['ZIPs'])} ZIPs"] if "ZIPs" in row else []
+            if pd.notna(row.get("TotalPopulation")):
+                parts.append(f"population {row['TotalPopulation']:,.0f}")
+            if pd.notna(row.get("MedianHouseholdIncome")):
+                parts.append(f"median household income ${row['MedianHouseholdIncome']:,.0f}")
+            lines.append(f"- {group}: {', '.join(parts)}.")
+    return "\n".join(lines)
@@ -0,0 +1,228 @@
+"""
+Compact, token-budgeted encoding of the merged dataset for LLM prompts.
+
+Instead of pasting the raw merged frame (well over 100 columns per ZIP), the
+encoder:
+- drops duplicated name/geo columns and columns that are empty or all zero
+- keeps single-race counts and the "two/three/four/five+ races" rollups, and
+  keeps a specific multi-race combination only where it is not rare
+- turns counts into percentage shares of the relevant total
+- measures the result in tokens (tiktoken when installed, ~4 chars/token
+  otherwise) and coarsens it step by step until it fits the budget
+
+Config (env)
+- PROMPT_TOKEN_BUDGET  max tokens for the data section (default: 6000)
+- PROMPT_RARE_SHARE    a multi-race combination is kept only if it reaches this
+                       share of some ZIP's population (default: 0.01)
+"""
+import csv
+import io
+import os
+from functools import lru_cache
+from typing import List, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+import MainAI3 as core
+from dataset_schema import SHARE_DTYPE
+
+try:
+    import tiktoken
+except ImportError:  # optional; fall back to a character estimate
+    tiktoken = None
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_RARE_SHARE = float(os.getenv("PROMPT_RARE_SHARE", "0.01"))
+
+REDUNDANT_COLUMNS = ["ZCTA_Name", "ZCTA_Name_x", "ZCTA_Name_y", "NAME", core.ZCTA_GEO_COLUMN]
+
+# The B19001 brackets with their correct labels (the legacy Income_* ones are off past _004E)
+HOUSEHOLDS = core.household_income_labels["B19001_001E"]
+INCOME_BRACKETS = [label for _, label, _, _ in core.B19001_BRACKETS]
+OCCUPATION_TOTAL = core.CENSUS_TABLES["occupation"].total
+OCCUPATION_MAJOR = ["MgmtBusSciArts", "ServiceOcc", "SalesOfficeOcc", "NatResConstMaint", "ProdTransMoving"]
+OCCUPATION_DETAIL = [
+    label for label in core.occupation_vars.values()
+    if label != OCCUPATION_TOTAL and label not in OCCUPATION_MAJOR
+]
+
+RACE_TOTAL = core.CENSUS_TABLES["race"].total
+RACE_ALONE = [core.p8_labels[f"P8_{n:03d}N"] for n in range(3, 9)]
+RACE_TWO_OR_MORE = core.p8_labels["P8_009N"]
+RACE_ROLLUPS = [core.p8_labels[code] for code in ("P8_010N", "P8_026N", "P8_047N", "P8_063N")]
+RACE_COMBOS = [
+    label for code, label in core.p8_labels.items()
+    if label not in [RACE_TOTAL, RACE_TWO_OR_MORE, core.p8_labels["P8_002N"]] + RACE_ALONE + RACE_ROLLUPS
+]
+
+# Coarsening steps applied in order while the encoding is over budget
+LEVELS = [
+    "full",
+    "drop multi-race combinations",
+    "drop occupation detail",
+    "drop multi-race rollups",
+    "drop income brackets",
+]
+
+
+class EncodedDataset(NamedTuple):
+    text: str
+    tokens: int
+    level: str
+
+    @property
+    def notes(self) -> str:
+        return data_notes(self.level)
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # tiktoken downloads its BPE files on first use; offline hosts estimate instead
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Token count for `model` via tiktoken, or a ~4 chars/token estimate without it."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+
+def _shares(df: pd.DataFrame, columns, total: pd.Series) -> pd.DataFrame:
+    columns = [c for c in columns if c in df.columns]
+    total = total.astype(SHARE_DTYPE).replace(0, np.nan)
+    shares = df[columns].astype(SHARE_DTYPE).div(total, axis=0) * 100
+    return shares.round(1).add_suffix(" %")
+
+
+def _drop_empty(compact: pd.DataFrame) -> pd.DataFrame:
+    # Drop columns that carry no information
+    empty = [c for c in compact.columns if compact[c].isna().all() or (compact[c].fillna(0) == 0).all()]
+    return compact.drop(columns=empty)
+
+
+def compact_frame(
+    final_df: pd.DataFrame, level: int = 0, rare_share: float = PROMPT_RARE_SHARE, drop_empty: bool = True
+) -> pd.DataFrame:
+    """Reduce the merged frame to ZIP/town, key counts and rounded % shares."""
+    df = final_df.drop(columns=[c for c in REDUNDANT_COLUMNS if c in final_df.columns])
+    parts = [df[["ZipCode", "TownName"]]]
+
+    counts = [
+        c for c in ("TotalPopulation", "MedianIncome", HOUSEHOLDS, OCCUPATION_TOTAL, RACE_TOTAL) if c in df.columns
+    ]
+    parts.append(df[counts].round(0).astype("Int64"))
+
+    if HOUSEHOLDS in df.columns and level < 4:
+        parts.append(_shares(df, INCOME_BRACKETS, df[HOUSEHOLDS]))
+
+    if OCCUPATION_TOTAL in df.columns:
+        occupations = OCCUPATION_MAJOR + (OCCUPATION_DETAIL if level < 2 else [])
+        parts.append(_shares(df, occupations, df[OCCUPATION_TOTAL]))
+
+    if RACE_TOTAL in df.columns:
+        race = RACE_ALONE + [RACE_TWO_OR_MORE]
+        if level < 3:
+            race += RACE_ROLLUPS
+        if level < 1:
+            total = df[RACE_TOTAL].astype(SHARE_DTYPE).replace(0, np.nan)
+            race += [
+                c for c in RACE_COMBOS
+                if c in df.columns and (df[c].astype(SHARE_DTYPE) / total).max(skipna=True) >= rare_share
+            ]
+        parts.append(_shares(df, race, df[RACE_TOTAL]))
+
+    compact = pd.concat(parts, axis=1)
+    return _drop_empty(compact) if drop_empty else compact
+
+
+def encode_dataset(
+    final_df: pd.DataFrame, token_budget: int = PROMPT_TOKEN_BUDGET, model: str = "gpt-4o-mini"
+) -> EncodedDataset:
+    """
+    CSV text of compact_frame(final_df) at the finest level that fits
+    `token_budget`. If even the coarsest level is over budget it is returned
+    anyway; callers can check `tokens`.
+    """
+    for level, name in enumerate(LEVELS):
+        text = compact_frame(final_df, level=level).to_csv(index=False)
+        tokens = count_tokens(text, model)
+        if tokens <= token_budget:
+            break
+    return EncodedDataset(text, tokens, name)
+
+
+def encode_groups(
+    final_df: pd.DataFrame, groups: List[List[str]], token_budget: int = PROMPT_TOKEN_BUDGET,
+    model: str = "gpt-4o-mini",
+) -> List[EncodedDataset]:
+    """
+    encode_dataset of each group of ZIPs' rows, with the same text as encoding
+    each group on its own, but compacting and formatting the frame once for
+    all of them (the per-column work dominates for a few rows). A group over
+    budget at the full level is encoded on its own, coarsening as usual.
+    """
+    df = final_df.reset_index(drop=True)
+    # Keep every combination here; each group applies the rarity threshold to its own rows
+    full = compact_frame(df, rare_share=0.0, drop_empty=False)
+    # informative[i, j]: row i has a value other than null/0 in column j (see _drop_empty)
+    numeric = [pd.api.types.is_numeric_dtype(dtype) for dtype in full.dtypes]
+    informative = full.notna().to_numpy(bool)
+    informative[:, numeric] &= full.loc[:, numeric].to_numpy(dtype="float64", na_value=np.nan) != 0
+    position = {c: j for j, c in enumerate(full.columns)}
+    combos = [position[f"{c} %"] for c in RACE_COMBOS if f"{c} %" in position]
+    if combos:
+        labels = [full.columns[j][:-2] for j in combos]
+        total = df[RACE_TOTAL].astype(SHARE_DTYPE).replace(0, np.nan)
+        shares = df[labels].astype(SHARE_DTYPE).div(total, axis=0)
+        informative[:, combos] &= (shares >= PROMPT_RARE_SHARE).to_numpy(bool)
+    # Format every cell once; each group's CSV is a selection of them
+    header, *cells = csv.reader(io.StringIO(full.to_csv(index=False)))
+    zips = df["ZipCode"].astype(str).to_numpy()
+
+    encoded = []
+    for group in groups:
+        rows = np.isin(zips, group)
+        columns = informative[rows].any(axis=0).nonzero()[0]
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow([header[j] for j in columns])
+        writer.writerows([cells[i][j] for j in columns] for i in rows.nonzero()[0])
+        text = out.getvalue()
+        tokens = count_tokens(text, model)
+        if tokens <= token_budget:
+            encoded.append(EncodedDataset(text, tokens, LEVELS[0]))
+        else:
+            encoded.append(encode_dataset(df[rows], token_budget, model))
+    return encoded
+
+
+def data_notes(level: str = LEVELS[0]) -> str:
+    """How to read the columns encoded at `level` (EncodedDataset.level), naming only those it keeps."""
+    step = LEVELS.index(level)
+    shares = [f"occupations of {OCCUPATION_TOTAL} (civilian employed population 16+)", "race of the P8 Total"]
+    if step < 4:
+        shares.insert(0, f"household income brackets (B19001) of {HOUSEHOLDS}")
+    if step == 0:
+        race = (
+            "Multi-race combinations below the rarity threshold are folded into their "
+            "'Population of N races' rollups"
+        )
+    elif step < 3:
+        race = "Specific multi-race combinations are left out; they count in the 'Population of N races' rollups"
+    else:
+        race = f"Multi-race population is given only as '{RACE_TWO_OR_MORE}'"
+    return (
+        f"Columns ending in % are percentage shares: {', '.join(shares)}. "
+        f"{race}; empty or all-zero columns are omitted."
+    )
@@ -0,0 +1,124 @@
+"""
+Table/field projection for dataset requests.
+
+A request may name `tables` (any key of MainAI3.CENSUS_TABLES: income,
+occupation, race, or a view such as households) and/or `fields` (column
+labels such as MedianIncome or "Asian alone"). plan_query maps them onto the
+minimal set of Census calls - every chunk of a requested table, and only the
+chunks that hold the requested fields otherwise - plus the output columns.
+
+A view (the B19001 household income brackets) is fetched in its table's
+requests but is not part of the table's columns, nor of the default
+response (DEFAULT_COLUMNS); it appears when named.
+"""
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import pandas as pd
+
+import MainAI3 as core
+
+KEY_COLUMNS = ["ZipCode", "TownName"]
+
+# View -> the registry table whose requests carry it
+VIEWS = {view: name for name, table in core.CENSUS_TABLES.items() for view, _ in table.views}
+
+
+def _table_columns():
+    """{table or view: label columns}, each registry table followed by its views."""
+    columns = {}
+    for name, table in core.CENSUS_TABLES.items():
+        columns[name] = list(table.labels.values())
+        columns.update({view: table.view_labels(view) for view, _ in table.views})
+    return columns
+
+
+# Canonical table order; each entry is the label columns the table (or view) produces
+TABLES = _table_columns()
+# Denominators kept alongside any field of the table when with_totals=True
+TABLE_TOTALS = {name: table.total for name, table in core.CENSUS_TABLES.items() if table.total}
+TABLE_TOTALS.update({view: total for table in core.CENSUS_TABLES.values() for view, total in table.views if total})
+# (table, "get" list) for every API call of the full dataset
+CHUNKS = tuple((name, chunk) for name, table in core.CENSUS_TABLES.items() for chunk in table.chunks())
+
+FIELD_TABLES = {field: table for table, fields in TABLES.items() for field in fields}
+FIELD_CODES = {
+    label: code for table in core.CENSUS_TABLES.values() for label, code in table.columns.items()
+}
+# Response columns without a projection: every registry table, no views
+DEFAULT_COLUMNS = KEY_COLUMNS + [c for table, columns in TABLES.items() if table not in VIEWS for c in columns]
+
+
+class QueryPlan(NamedTuple):
+    tables: Tuple[str, ...]
+    chunks: Tuple[Tuple[str, Tuple[str, ...]], ...]
+    columns: Optional[List[str]]  # None = every column (full dataset)
+
+    @property
+    def is_full(self) -> bool:
+        return self.columns is None
+
+
+FULL_PLAN = QueryPlan(tuple(core.CENSUS_TABLES), CHUNKS, None)
+
+
+def parse_names(value: Union[None, str, Iterable[str]]) -> List[str]:
+    """Accept a comma-separated string or a list; drop blanks."""
+    if value is None:
+        return []
+    items = value.split(",") if isinstance(value, str) else value
+    return [item.strip() for item in items if item and item.strip()]
+
+
+def plan_query(tables=None, fields=None, with_totals: bool = False, with_views: bool = False) -> QueryPlan:
+    """
+    Build the plan for the requested `tables` and `fields` (either may be a
+    comma-separated string or a list). `with_views` adds the views of each
+    requested table. Raises ValueError on unknown names.
+    """
+    table_names = parse_names(tables)
+    field_names = parse_names(fields)
+    if not table_names and not field_names:
+        return FULL_PLAN
+
+    unknown = [t for t in table_names if t not in TABLES]
+    if unknown:
+        raise ValueError(f"Unknown tables {unknown}. Use any of {list(TABLES)}.")
+    unknown = [f for f in field_names if f not in FIELD_TABLES]
+    if unknown:
+        raise ValueError(f"Unknown fields {unknown}.")
+
+    if set(table_names) == set(core.CENSUS_TABLES) and not field_names:
+        return FULL_PLAN
+    if with_views:
+        table_names += [view for view, table in VIEWS.items() if table in table_names and view not in table_names]
+    wanted = set(table_names) | {FIELD_TABLES[f] for f in field_names}
+
+    columns = []
+    for table in TABLES:
+        if table in table_names:
+            columns += TABLES[table]
+        elif table in wanted and with_totals and table in TABLE_TOTALS:
+            columns.append(TABLE_TOTALS[table])
+    columns += [f for f in field_names if f not in columns]
+
+    # Views are fetched through their table's requests
+    sources = {VIEWS.get(t, t) for t in wanted}
+    whole = {VIEWS.get(t, t) for t in table_names}
+    codes = {FIELD_CODES[c] for c in columns}
+    chunks = tuple(
+        (table, chunk) for table, chunk in CHUNKS
+        if table in whole or (table in sources and codes.intersection(chunk))
+    )
+    return QueryPlan(tuple(t for t in core.CENSUS_TABLES if t in sources), chunks, KEY_COLUMNS + columns)
+
+
+def output_columns(plan: QueryPlan) -> List[str]:
+    """The response columns for `plan`: its own, or DEFAULT_COLUMNS for the full plan."""
+    return DEFAULT_COLUMNS if plan.columns is None else plan.columns
+
+
+def project(df: pd.DataFrame, plan: QueryPlan) -> pd.DataFrame:
+    """Select the plan's columns (missing ones come back as nulls)."""
+    if plan.columns is None:
+        return df
+    return df.reindex(columns=plan.columns)
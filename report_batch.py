@@ -0,0 +1,235 @@
+"""
+Batch AI reports from a JSONL job file.
+
+Each line is one job: an /api/ai-report body (zips, user_prompt, groups,
+tables, fields, temperature, mode) plus an optional "id". A run
+- loads the county dataset once (prebuilt snapshot, the shared store, or
+  one Census build) and answers every job from it, so no job fetches
+- generates reports through the same path as /api/ai-report, at most
+  --concurrency jobs at once and at most --rate model calls per minute
+  across them; reports and fragments already in the report cache cost none
+- writes <out>/<id>.json (the /api/ai-report body plus the job) and
+  <out>/<id>.md (the narrative) atomically as each job finishes, and a run
+  summary to <out>/_batch.json
+- skips jobs whose output already exists for the same job spec, so an
+  interrupted run resumes where it stopped. Failed jobs are retried
+  (--retries) and listed; the exit status is 1 if any are left. A job
+  served only the template summary (see llm_router.py) counts as failed
+
+Jobs without an id are named after a hash of their spec. Invalid jobs
+(unknown ZIPs, groups or fields) fail on their own without stopping the run.
+
+Config (env)
+- BATCH_CONCURRENCY   default for --concurrency (default: 4)
+- BATCH_RATE          default for --rate, model calls per minute; 0 = unlimited (default: 0)
+
+CLI
+    python MainAI3.py batch jobs.jsonl [--out reports] [--concurrency 4] [--rate 60]
+                                       [--retries 2] [--force]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from typing import List, NamedTuple, Optional
+
+DEFAULT_OUT = "reports"
+SUMMARY = "_batch.json"
+ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$")
+RETRY_BASE_SECONDS = 2.0
+
+
+class Job(NamedTuple):
+    id: str
+    spec: dict  # the /api/ai-report body
+    spec_hash: str
+    error: Optional[str] = None  # set when the line itself is unusable
+
+
+def spec_hash(spec: dict) -> str:
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def read_jobs(path: str, fields) -> List[Job]:
+    """Jobs of a JSONL file, in order; a malformed line becomes a job with `error` set."""
+    jobs, seen = [], set()
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            name = f"line-{number}"
+            try:
+                spec = json.loads(line)
+                if not isinstance(spec, dict):
+                    raise ValueError("not a JSON object")
+            except ValueError as exc:
+                jobs.append(Job(name, {}, "", f"invalid JSON: {exc}"))
+                continue
+            job_id = str(spec.pop("id", "") or "")
+            digest = spec_hash(spec)
+            unknown = sorted(set(spec) - set(fields))
+            if unknown:
+                error = f"unknown keys {unknown}; use {sorted(fields)}"
+            elif job_id and not ID_PATTERN.match(job_id):
+                error = f"id {job_id!r} must be letters, digits, '.', '_' or '-'"
+            elif (job_id or digest) in seen:
+                error = f"duplicate of job {job_id or digest!r}"
+            else:
+                error = None
+            if error:
+                jobs.append(Job(name, spec, digest, error))
+                continue
+            seen.add(job_id or digest)
+            jobs.append(Job(job_id or digest, spec, digest))
+    return jobs
+
+
+def _write_atomic(path: str, text: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def finished(out: str, job: Job) -> bool:
+    """True if `out` already holds this job's report for the same spec."""
+    try:
+        with open(os.path.join(out, f"{job.id}.json")) as f:
+            return json.load(f).get("spec_hash") == job.spec_hash
+    except (OSError, ValueError):
+        return False
+
+
+def write_report(out: str, job: Job, body: str):
+    report = json.loads(body)
+    record = {"id": job.id, "spec_hash": job.spec_hash, "job": job.spec, "generated_at": time.time(), **report}
+    question = job.spec.get("user_prompt")
+    markdown = [f"# {job.id}", "", f"ZIPs: {', '.join(report['zips'])}"]
+    if question:
+        markdown += ["", f"Question: {question.strip()}"]
+    markdown += ["", report["ai_summary"], ""]
+    # The narrative first: a .json on disk is what marks the job finished
+    _write_atomic(os.path.join(out, f"{job.id}.md"), "\n".join(markdown))
+    _write_atomic(os.path.join(out, f"{job.id}.json"), json.dumps(record, indent=2))
+
+
+def _invalid(exc: Exception) -> str:
+    if hasattr(exc, "errors"):
+        # pydantic ValidationError: one short line per field
+        return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors())
+    return str(getattr(exc, "detail", exc))
+
+
+async def run(jobs: List[Job], out: str, concurrency: int, retries: int, force: bool = False) -> dict:
+    """Generate every pending job; returns the run summary."""
+    import app
+    from fastapi import HTTPException
+
+    os.makedirs(out, exist_ok=True)
+    started = time.time()
+    summary = {"jobs": len(jobs), "done": [], "skipped": [], "failed": {}}
+    pending = []
+    for job in jobs:
+        if job.error:
+            summary["failed"][job.id] = job.error
+        elif not force and finished(out, job):
+            summary["skipped"].append(job.id)
+        else:
+            pending.append(job)
+    print(f"{len(jobs)} jobs: {len(pending)} to run, {len(summary['skipped'])} already done, "
+          f"{len(summary['failed'])} invalid", flush=True)
+    if not pending:
+        return summary
+
+    # The dataset once for every job: a fresh snapshot, a recent shared build, or one Census build
+    dataset = app.county_dataset
+    app.seed_from_snapshot()
+    if dataset.built_at is None or time.time() - dataset.built_at > dataset.refresh_seconds:
+        await dataset.refresh()
+    print(f"Dataset {dataset.version} ({dataset.source}) ready in {time.time() - started:.1f}s", flush=True)
+
+    slots = asyncio.Semaphore(concurrency)
+    count = 0
+
+    async def one(job: Job):
+        nonlocal count
+        async with slots:
+            job_started = time.time()
+            try:
+                # Same validation as the endpoint; a bad job is not retried
+                params = app._report_params(app.AiReportRequest(**job.spec))
+                attempts = retries + 1
+            except (HTTPException, ValueError) as exc:
+                error, attempts = _invalid(exc), 0
+            for attempt in range(attempts):
+                try:
+                    body = await app._generate_report(params)
+                    route = json.loads(body)["ai_route"]
+                    if route["path"] == "template":
+                        # A stand-in summary is not the job's report: retry, and never mark it done
+                        raise RuntimeError(f"no model answered in time ({route.get('error')})")
+                    await asyncio.to_thread(write_report, out, job, body)
+                    error = None
+                    break
+                except HTTPException as exc:
+                    error = str(exc.detail)
+                except Exception as exc:
+                    error = f"{type(exc).__name__}: {exc}"
+                if attempt < retries:
+                    await asyncio.sleep(RETRY_BASE_SECONDS * 2 ** attempt)
+            count += 1
+            if error is None:
+                summary["done"].append(job.id)
+                status = f"done   {json.loads(body).get('ai_cache', '')}"
+            else:
+                summary["failed"][job.id] = error
+                status = f"FAILED {error}"
+            print(f"[{count}/{len(pending)}] {job.id}: {status} ({time.time() - job_started:.1f}s)", flush=True)
+
+    await asyncio.gather(*(one(job) for job in pending))
+    return summary
+
+
+# -------------------------------------------------
+# CLI
+# -------------------------------------------------
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("jobs", help="JSONL file, one /api/ai-report body (plus optional id) per line")
+    parser.add_argument("--out", default=DEFAULT_OUT, help=f"Output directory (default: {DEFAULT_OUT})")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "4")),
+                        help="Reports generated at once")
+    parser.add_argument("--rate", type=float, default=float(os.getenv("BATCH_RATE", "0")),
+                        help="Model calls per minute across all jobs (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=2, help="Retries per failed job")
+    parser.add_argument("--force", action="store_true", help="Regenerate jobs that already have output")
+
+
+def main(args: argparse.Namespace) -> int:
+    import app
+    import census_client
+
+    try:
+        app._ensure_openai_key()
+    except Exception as exc:
+        print(getattr(exc, "detail", exc), file=sys.stderr)
+        return 2
+    if args.rate:
+        app.openai_limiter = census_client.TokenBucket(args.rate / 60, max(1, args.concurrency))
+
+    started = time.time()
+    # model_fields on pydantic 2, __fields__ on 1 (FastAPI accepts either)
+    fields = getattr(app.AiReportRequest, "model_fields", None) or app.AiReportRequest.__fields__
+    jobs = read_jobs(args.jobs, fields)
+    summary = asyncio.run(run(jobs, args.out, max(1, args.concurrency), max(0, args.retries), args.force))
+    summary["elapsed_seconds"] = round(time.time() - started, 1)
+    _write_atomic(os.path.join(args.out, SUMMARY), json.dumps(summary, indent=2))
+
+    print(f"{len(summary['done'])} done, {len(summary['skipped'])} skipped, {len(summary['failed'])} failed "
+          f"in {summary['elapsed_seconds']}s -> {args.out}")
+    for job_id, error in summary["failed"].items():
+        print(f"  {job_id}: {error}")
+    return 1 if summary["failed"] else 0
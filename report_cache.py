@@ -0,0 +1,106 @@
+"""
+Content-addressed cache for AI reports, with in-flight request coalescing.
+
+Reports are keyed by a hash of the exact prompt (as produced by
+app.build_prompt, so it already covers the ZIP set, the data and the user
+prompt) plus the model parameters. They are stored in SQLite with TTL and
+LRU eviction (see census_cache.SqliteCache), so they survive restarts.
+Concurrent identical requests share one upstream call: within a process by
+joining the in-flight task, across worker processes through a lock on the
+shared store (see shared_cache.py).
+
+Config (env)
+- REPORT_CACHE_PATH       SQLite file (default: .cache/report_cache.sqlite3)
+- REPORT_CACHE_TTL        seconds; 0 = never expire (default: 7 days)
+- REPORT_CACHE_MAX_BYTES  size bound (default: 32 MB)
+- REPORT_CACHE_DISABLED   set to 1 to always call the model (coalescing still applies)
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import shared_cache
+from census_cache import SqliteCache, open_store
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "report_cache.sqlite3")
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+ENDPOINT = "chat.completions"
+# Longest a worker may hold a report's lock; covers a slow completion
+LOCK_TTL = 180
+
+
+def report_key(prompt: str, **params) -> str:
+    """Hash of the prompt plus model parameters (model, temperature, max_tokens, ...)."""
+    raw = json.dumps({"prompt": prompt, **params}, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Uncached(str):
+    """A report `create` returns that is passed on to its callers but not stored (a degraded stand-in)."""
+
+
+class ReportCache:
+    """Persistent report store plus single-flight coalescing of identical requests."""
+
+    def __init__(self, store: Optional[SqliteCache]):
+        self.store = store
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def lookup(self, key: str) -> Optional[str]:
+        """Return the stored report for `key`, or None."""
+        if self.store is None:
+            return None
+        found = await asyncio.to_thread(self.store.get_many, [key])
+        return found.get(key)
+
+    async def save(self, key: str, text: str):
+        if self.store is not None:
+            await asyncio.to_thread(self.store.set_many, [(key, text)], ENDPOINT)
+
+    async def get_or_create(self, key: str, create: Callable[[], Awaitable[str]]) -> Tuple[str, str]:
+        """
+        Return (text, source) for `key`, where source is "hit" (served from
+        the store), "coalesced" (joined an identical in-flight request) or
+        "miss" (this call ran `create`).
+        """
+        text = await self.lookup(key)
+        if text is not None:
+            return text, "hit"
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._create(key, create))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            # shield: one client disconnecting must not cancel the shared call
+            return await asyncio.shield(task)
+        text, _ = await asyncio.shield(task)
+        return text, "coalesced"
+
+    async def _create(self, key: str, create: Callable[[], Awaitable[str]]) -> Tuple[str, str]:
+        async with shared_cache.single_flight_async(self.store, f"report:{key}", ttl=LOCK_TTL):
+            # Another worker may have written it while we waited for the lock
+            text = await self.lookup(key)
+            if text is not None:
+                return text, "hit"
+            text = await create()
+            if not isinstance(text, Uncached):
+                await self.save(key, text)
+            return text, "miss"
+
+
+def from_env() -> ReportCache:
+    if os.getenv("REPORT_CACHE_DISABLED", "").strip().lower() in ("1", "true", "yes"):
+        return ReportCache(None)
+    return ReportCache(
+        open_store(
+            "report",
+            os.getenv("REPORT_CACHE_PATH", DEFAULT_PATH),
+            ttl=int(os.getenv("REPORT_CACHE_TTL", DEFAULT_TTL)),
+            max_bytes=int(os.getenv("REPORT_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+        )
+    )
@@ -0,0 +1,179 @@
+"""
+Background job queue for AI reports.
+
+`submit` returns a job right away; a fixed pool of worker tasks drains a
+priority queue (lower number first, FIFO within a priority), so at most
+`workers` reports are generated at once no matter how many are submitted,
+and interactive endpoints stay responsive. Clients poll a job (optionally
+long-polling until it changes) or subscribe to its status changes. Finished
+jobs are kept for `retention` seconds, then dropped.
+
+Config (env)
+- REPORT_JOB_WORKERS     concurrent report generations (default: 2)
+- REPORT_JOB_QUEUE_MAX   queued jobs before submit is refused (default: 100)
+- REPORT_JOB_RETENTION   seconds a finished job stays readable (default: 3600)
+"""
+import asyncio
+import itertools
+import logging
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRIORITY = 5
+FINISHED = ("done", "error")
+
+
+class QueueFull(RuntimeError):
+    """Raised by submit when REPORT_JOB_QUEUE_MAX jobs are already waiting."""
+
+
+class Job:
+    def __init__(self, params: Any, priority: int):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.priority = priority
+        self.status = "queued"
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[str] = None  # encoded JSON body
+        self.error: Optional[str] = None
+        self._changed = asyncio.Event()
+
+    def _set(self, status: str):
+        self.status = status
+        # Wake everyone waiting on this change, then re-arm for the next one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_change(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for the next status change."""
+        if self.status in FINISHED:
+            return False
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """Priority queue of report jobs processed by `workers` background tasks."""
+
+    def __init__(
+        self,
+        runner: Callable[[Any], Awaitable[str]],
+        workers: int = 2,
+        max_queued: int = 100,
+        retention: float = 3600,
+    ):
+        self._runner = runner
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._tasks = []
+
+    def submit(self, params: Any, priority: int = DEFAULT_PRIORITY) -> Job:
+        """Queue a job for `params`; raises QueueFull when the queue is at capacity."""
+        self._expire()
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if self._queue.qsize() >= self.max_queued:
+            raise QueueFull(f"{self._queue.qsize()} report jobs already queued")
+        job = Job(params, priority)
+        self._jobs[job.id] = job
+        self._queue.put_nowait((priority, next(self._seq), job.id))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> Optional[int]:
+        """Jobs ahead of `job` in the queue (0 = next), or None once it has started."""
+        if job.status != "queued" or self._queue is None:
+            return None
+        # Peek at the heap (entries are (priority, seq, job_id)); fine at REPORT_JOB_QUEUE_MAX sizes
+        entries = list(self._queue._queue)
+        mine = next((entry for entry in entries if entry[2] == job.id), None)
+        return None if mine is None else sum(1 for entry in entries if entry < mine)
+
+    def stats(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": self.workers, **counts}
+
+    async def events(self, job: Job, heartbeat: float = 15) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield the job's info now and after every status change until it
+        finishes, and None every `heartbeat` seconds without a change.
+        """
+        yield job.info()
+        while job.status not in FINISHED:
+            changed = await job.wait_change(heartbeat)
+            yield job.info() if changed or job.status in FINISHED else None
+
+    async def _work(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            job.started = time.time()
+            job._set("running")
+            try:
+                job.result = await self._runner(job.params)
+                status = "done"
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.exception("Report job %s failed", job.id)
+                job.error = getattr(exc, "detail", None) or str(exc)
+                status = "error"
+            job.finished = time.time()
+            job._set(status)
+
+    def _expire(self):
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def from_env(runner: Callable[[Any], Awaitable[str]]) -> JobQueue:
+    return JobQueue(
+        runner,
+        workers=int(os.getenv("REPORT_JOB_WORKERS", "2")),
+        max_queued=int(os.getenv("REPORT_JOB_QUEUE_MAX", "100")),
+        retention=float(os.getenv("REPORT_JOB_RETENTION", "3600")),
+    )
@@ -0,0 +1,239 @@
+"""
+Serialization, compression and revalidation for dataset responses.
+
+Formats (`?format=` or the Accept header)
+- records   {"zips": [...], "data": [{col: val, ...}, ...]}   (default, unchanged shape)
+- split     {"zips": [...], "columns": [...], "data": [[...], ...]}
+- columnar  {"zips": [...], "data": {col: [...], ...}}
+- arrow     Apache Arrow IPC stream   (application/vnd.apache.arrow.stream; needs pyarrow)
+- parquet   Parquet file              (application/vnd.apache.parquet; needs pyarrow)
+
+JSON is produced by pandas' C encoder (NaN -> null). Bodies are compressed
+with brotli (when installed) or gzip per Accept-Encoding. Encoded bodies are
+memoized per dataset version, so repeat requests skip serialization entirely,
+and the ETag lets clients revalidate with If-None-Match for a 304.
+"""
+import gzip
+import hashlib
+import io
+import json
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+from fastapi import HTTPException, Request, Response
+
+import metrics
+from dataset_store import slice_frame
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+
+@lru_cache(maxsize=None)
+def _arrow():
+    """(pyarrow, pyarrow.parquet), imported on first use (slow to import); None when not installed."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:  # optional; arrow/parquet formats answer 406 without it
+        return None
+    return pa, pq
+
+JSON_MIME = "application/json"
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+PARQUET_MIME = "application/vnd.apache.parquet"
+
+FORMATS = {
+    "records": JSON_MIME,
+    "split": JSON_MIME,
+    "columnar": JSON_MIME,
+    "arrow": ARROW_MIME,
+    "parquet": PARQUET_MIME,
+}
+ACCEPT_FORMATS = {
+    ARROW_MIME: "arrow",
+    "application/vnd.apache.arrow.file": "arrow",
+    PARQUET_MIME: "parquet",
+    "application/x-parquet": "parquet",
+}
+
+MIN_COMPRESS_BYTES = 512
+MEMO_ENTRIES = 256
+
+
+def negotiate_format(format_param: Optional[str], accept: Optional[str]) -> str:
+    """Pick a format from ?format= first, then the Accept header; default records."""
+    if format_param:
+        fmt = format_param.strip().lower()
+        if fmt not in FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unknown format {fmt}. Use one of {list(FORMATS)}.")
+    else:
+        fmt = "records"
+        for part in (accept or "").split(","):
+            mime = part.split(";")[0].strip().lower()
+            if mime in ACCEPT_FORMATS:
+                fmt = ACCEPT_FORMATS[mime]
+                break
+    if FORMATS[fmt] != JSON_MIME and _arrow() is None:
+        raise HTTPException(status_code=406, detail=f"Format {fmt} requires pyarrow on the server.")
+    return fmt
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> str:
+    offered = {
+        part.split(";")[0].strip().lower()
+        for part in (accept_encoding or "").split(",")
+        if not part.strip().endswith("q=0")
+    }
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return "identity"
+
+
+def records_json(df: pd.DataFrame) -> str:
+    """JSON array of row objects, via pandas' encoder (NaN -> null)."""
+    return df.to_json(orient="records", double_precision=15)
+
+
+def raw_json_object(fields: Dict[str, object], raw: Dict[str, str]) -> str:
+    """JSON object from normal `fields` plus already-encoded JSON fragments in `raw`."""
+    items = [f"{json.dumps(k)}:{json.dumps(v)}" for k, v in fields.items()]
+    items += [f"{json.dumps(k)}:{v}" for k, v in raw.items()]
+    return "{" + ",".join(items) + "}"
+
+
+def serialize(df: pd.DataFrame, zips: List[str], fmt: str) -> bytes:
+    if fmt == "records":
+        return raw_json_object({"zips": zips}, {"data": records_json(df)}).encode("utf-8")
+    if fmt == "split":
+        return raw_json_object(
+            {"zips": zips}, {"columns": json.dumps(list(df.columns)), "data": df.to_json(orient="values", double_precision=15)}
+        ).encode("utf-8")
+    if fmt == "columnar":
+        # {"col": {"0": v, ...}} -> {"col": [v, ...]} without a Python-level row loop
+        columns = ",".join(
+            f"{json.dumps(col)}:{df[col].to_json(orient='values', double_precision=15)}" for col in df.columns
+        )
+        return raw_json_object({"zips": zips}, {"data": "{" + columns + "}"}).encode("utf-8")
+
+    pa, pq = _arrow()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Only the ZIPs: the pandas metadata (a JSON description of every column)
+    # outweighs the data of a county-sized frame
+    table = table.replace_schema_metadata({b"zips": ",".join(zips).encode()})
+    sink = io.BytesIO()
+    if fmt == "arrow":
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        # Per-column statistics, the stored Arrow schema (another copy of every
+        # column's description) and dictionaries of mostly distinct counts are
+        # overhead for a response; the body is compressed as a whole
+        # (Content-Encoding), so pages are not
+        with pq.ParquetWriter(
+            sink, table.schema, compression="none", write_statistics=False, store_schema=False,
+            use_dictionary=["TownName"],
+        ) as writer:
+            writer.write_table(table)
+            writer.add_key_value_metadata(table.schema.metadata)
+    return sink.getvalue()
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+class RepresentationCache:
+    """LRU of encoded response bodies keyed by dataset version + request shape."""
+
+    def __init__(self, max_entries: int = MEMO_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+
+    def get(self, etag: str) -> Optional[Tuple[bytes, str]]:
+        entry = self._entries.get(etag)
+        if entry is not None:
+            self._entries.move_to_end(etag)
+        return entry
+
+    def put(self, etag: str, body: bytes, encoding: str):
+        self._entries[etag] = (body, encoding)
+        self._entries.move_to_end(etag)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def make_etag(version: str, *parts) -> str:
+    digest = hashlib.sha1(json.dumps([version, *parts]).encode("utf-8")).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Compare weakly: proxies may add W/ to our strong tags
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates
+
+
+representations = RepresentationCache()
+
+
+def dataset_response(
+    request: Request,
+    frame: pd.DataFrame,
+    version: Optional[str],
+    zips: List[str],
+    fmt: str,
+    columns: Optional[List[str]] = None,
+    route: str = "/api/zip-data",
+) -> Response:
+    """
+    Build (or reuse) the encoded response for `zips` (and optionally only
+    `columns`) sliced from `frame`, answering 304 when If-None-Match already
+    matches. Without a `version` (an ad hoc frame) nothing is memoized and no
+    ETag is sent.
+    """
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    headers = {
+        "Vary": "Accept, Accept-Encoding",
+        # Always revalidate; unchanged data costs a 304 with no body
+        "Cache-Control": "no-cache",
+    }
+    etag = None
+    cached = None
+    if version is not None:
+        etag = make_etag(version, zips, fmt, encoding, columns)
+        headers["ETag"] = etag
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        cached = representations.get(etag)
+
+    if cached is None:
+        with metrics.stage("serialize"):
+            df = slice_frame(frame, zips)
+            if columns is not None:
+                df = df.reindex(columns=columns)
+            body = serialize(df, zips, fmt)
+            used = encoding if len(body) >= MIN_COMPRESS_BYTES else "identity"
+            cached = (compress(body, used), used)
+        if etag is not None:
+            representations.put(etag, *cached)
+
+    body, used = cached
+    metrics.response_bytes.observe(len(body), route=route, format=fmt)
+    if used != "identity":
+        headers["Content-Encoding"] = used
+    return Response(content=body, media_type=FORMATS[fmt], headers=headers)
@@ -0,0 +1,363 @@
+"""
+Cache storage shared by every worker process, plus cross-process refresh locks.
+
+With several uvicorn workers (or replicas) each process would otherwise warm
+its own copy of the Census rows, the county dataset and the AI reports. All
+three caches sit on one of two backends with the same interface
+(get_many / set_many / delete_many / keys / purge / stats / try_lock / unlock):
+
+- sqlite (default): census_cache.SqliteCache. One file per cache, shared by
+  every process on the host (SQLite does the file locking); refresh locks
+  live in a table of the same file.
+- redis: RedisCache below, for replicas on more than one host. It speaks
+  RESP directly, so no client library is needed and any Redis-protocol
+  server works, including bench/fake_redis.py for local runs. Size is
+  bounded by the server (maxmemory + allkeys-lru), not by *_MAX_BYTES.
+
+`single_flight` / `single_flight_async` wrap a refresh so only one worker
+runs it per key at a time. The others wait for the lock, then re-read the
+cache the winner filled. Waiting is bounded by CACHE_LOCK_WAIT; after that a
+waiter does the work itself rather than fail.
+
+Config (env)
+- CACHE_BACKEND     sqlite | redis (default: sqlite)
+- CACHE_REDIS_URL   redis://[:password@]host:port/db (default: redis://127.0.0.1:6379/0)
+- CACHE_LOCK_WAIT   seconds to wait for another worker's refresh (default: 30)
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BACKEND = os.getenv("CACHE_BACKEND", "sqlite").strip().lower()
+REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://127.0.0.1:6379/0")
+LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", "30"))
+LOCK_POLL_SECONDS = 0.05
+
+
+# -------------------------------------------------
+# RESP client
+# -------------------------------------------------
+class RedisError(Exception):
+    """Error reply from the server."""
+
+
+def _encode(args) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+def _read_reply(stream):
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("connection closed by server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode("utf-8")
+    if kind == b"-":
+        return RedisError(rest.decode("utf-8"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        return None if size < 0 else stream.read(size + 2)[:-2]
+    if kind == b"*":
+        size = int(rest)
+        return None if size < 0 else [_read_reply(stream) for _ in range(size)]
+    raise ConnectionError(f"unexpected reply {line[:32]!r}")
+
+
+class RespClient:
+    """Minimal RESP2 client: one connection per thread, pipelined commands, one reconnect."""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int((parsed.path or "/0").strip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        self._local.conn = (sock, sock.makefile("rb"))
+        setup = ([("AUTH", self.password)] if self.password else []) + ([("SELECT", self.db)] if self.db else [])
+        if setup:
+            self._roundtrip(setup)
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn:
+            conn[1].close()
+            conn[0].close()
+
+    def _roundtrip(self, commands):
+        sock, stream = self._local.conn
+        sock.sendall(b"".join(_encode(c) for c in commands))
+        # Read every reply before raising so the stream stays in sync
+        replies = [_read_reply(stream) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def pipeline(self, commands: List[tuple]) -> list:
+        """Send `commands` in one write and return their replies in order."""
+        for attempt in (0, 1):
+            try:
+                if getattr(self._local, "conn", None) is None:
+                    self._connect()
+                return self._roundtrip(commands)
+            except (OSError, ConnectionError):
+                self._close()
+                if attempt:
+                    raise
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+
+# -------------------------------------------------
+# Redis-protocol cache backend
+# -------------------------------------------------
+class RedisCache:
+    """
+    Same interface as census_cache.SqliteCache on a Redis-protocol server.
+
+    Entries are stored as {"v": value, "c": created, "e": endpoint} under
+    "<namespace>:<key>". The server keeps them for twice the TTL so expired
+    rows can still be served while the Census API is down; the TTL itself
+    is checked on read. Connection failures degrade to cache misses, and the
+    maintenance calls (purge, delete_many, stats, keys) to an empty result.
+    """
+
+    def __init__(self, url: str, namespace: str, ttl: int = 0, max_bytes: int = 0):
+        self.url = url
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.client = RespClient(url)
+
+    def _name(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _expired(self, created, now):
+        return bool(self.ttl) and now - created > self.ttl
+
+    def get_many(self, keys, include_expired=False):
+        if not keys:
+            return {}
+        keys = list(keys)
+        try:
+            values = self.client.execute("MGET", *[self._name(k) for k in keys])
+        except (OSError, ConnectionError, RedisError) as exc:
+            logger.warning("Shared cache read failed (%s): %s", self.url, exc)
+            return {}
+        now = time.time()
+        found = {}
+        for key, raw in zip(keys, values):
+            if raw is None:
+                continue
+            entry = json.loads(raw)
+            if include_expired or not self._expired(entry["c"], now):
+                found[key] = entry["v"]
+        return found
+
+    def set_many(self, items, endpoint=""):
+        now = time.time()
+        expiry = ("PX", int(self.ttl * 2000)) if self.ttl else ()
+        commands = [
+            ("SET", self._name(key), json.dumps({"v": value, "c": now, "e": endpoint}), *expiry)
+            for key, value in items
+        ]
+        if not commands:
+            return
+        try:
+            self.client.pipeline(commands)
+        except (OSError, ConnectionError, RedisError) as exc:
+            logger.warning("Shared cache write failed (%s): %s", self.url, exc)
+
+    def _entries(self) -> Iterable[Tuple[str, bytes]]:
+        """Yield (name, raw value) for every entry in the namespace."""
+        cursor = "0"
+        while True:
+            cursor, names = self.client.execute("SCAN", cursor, "MATCH", f"{self.namespace}:*", "COUNT", 1000)
+            cursor = cursor.decode("utf-8")
+            if names:
+                yield from zip(names, self.client.execute("MGET", *names))
+            if cursor == "0":
+                return
+
+    def purge(self, expired_only=False, endpoint=None):
+        if expired_only and not self.ttl:
+            return 0
+        now = time.time()
+        victims = []
+        try:
+            for name, raw in self._entries():
+                if raw is None:
+                    continue
+                entry = json.loads(raw)
+                if expired_only and not self._expired(entry["c"], now):
+                    continue
+                if endpoint and entry.get("e") != endpoint:
+                    continue
+                victims.append(name)
+            for start in range(0, len(victims), 500):
+                self.client.execute("DEL", *victims[start:start + 500])
+        except (OSError, ConnectionError, RedisError) as exc:
+            logger.warning("Shared cache purge failed (%s): %s", self.url, exc)
+            return 0
+        return len(victims)
+
+    def delete_many(self, keys):
+        names = [self._name(k) for k in keys]
+        removed = 0
+        try:
+            for start in range(0, len(names), 500):
+                removed += self.client.execute("DEL", *names[start:start + 500])
+        except (OSError, ConnectionError, RedisError) as exc:
+            logger.warning("Shared cache delete failed (%s): %s", self.url, exc)
+        return removed
+
+    def stats(self):
+        per_endpoint: Dict[str, Dict[str, int]] = {}
+        error = None
+        try:
+            for _, raw in self._entries():
+                if raw is None:
+                    continue
+                bucket = per_endpoint.setdefault(json.loads(raw).get("e", ""), {"entries": 0, "bytes": 0})
+                bucket["entries"] += 1
+                bucket["bytes"] += len(raw)
+        except (OSError, ConnectionError, RedisError) as exc:
+            logger.warning("Shared cache stats failed (%s): %s", self.url, exc)
+            per_endpoint, error = {}, f"store unavailable: {exc}"
+        stats = {
+            "url": self.url,
+            "namespace": self.namespace,
+            "ttl": self.ttl,
+            "entries": sum(b["entries"] for b in per_endpoint.values()),
+            "bytes": sum(b["bytes"] for b in per_endpoint.values()),
+            "endpoints": per_endpoint,
+        }
+        if error:
+            stats["error"] = error
+        return stats
+
+    def keys(self, endpoint=None):
+        prefix = len(self.namespace) + 1
+        try:
+            return [
+                name.decode("utf-8")[prefix:] for name, raw in self._entries()
+                if raw is not None and (not endpoint or json.loads(raw).get("e") == endpoint)
+            ]
+        except (OSError, ConnectionError, RedisError) as exc:
+            logger.warning("Shared cache scan failed (%s): %s", self.url, exc)
+            return []
+
+    def try_lock(self, name: str, ttl: float) -> Optional[str]:
+        """Take lock `name` for `ttl` seconds unless someone holds it; returns a token or None."""
+        token = uuid.uuid4().hex
+        reply = self.client.execute("SET", f"lock:{self.namespace}:{name}", token, "NX", "PX", int(ttl * 1000))
+        return token if reply == "OK" else None
+
+    def unlock(self, name: str, token: str):
+        lock = f"lock:{self.namespace}:{name}"
+        # Only delete our own lock; it may have expired and been taken over
+        if self.client.execute("GET", lock) == token.encode("utf-8"):
+            self.client.execute("DEL", lock)
+
+
+# -------------------------------------------------
+# Cross-process single flight
+# -------------------------------------------------
+# A broken cache must never fail the request it is meant to speed up
+_BACKEND_ERRORS = (OSError, ConnectionError, RedisError, sqlite3.Error)
+
+
+def _lock_result(waited: bool, token: Optional[str]) -> str:
+    if token is None:
+        return "timeout"
+    return "waited" if waited else "acquired"
+
+
+@contextmanager
+def single_flight(store, name: str, ttl: float = 120, wait: Optional[float] = None):
+    """
+    Hold the cross-process lock `name` on `store` for the block; no-op when
+    `store` is None. Callers should re-read the cache inside the block, since
+    a worker that held the lock first has probably filled it.
+    """
+    if store is None:
+        yield
+        return
+    wait = LOCK_WAIT if wait is None else wait
+    give_up = time.monotonic() + wait
+    token, waited = None, False
+    try:
+        while True:
+            token = store.try_lock(name, ttl)
+            if token is not None or time.monotonic() >= give_up:
+                break
+            waited = True
+            time.sleep(LOCK_POLL_SECONDS)
+        metrics.cache_locks.inc(result=_lock_result(waited, token))
+    except _BACKEND_ERRORS as exc:
+        logger.warning("Cache lock %s unavailable: %s", name, exc)
+        metrics.cache_locks.inc(result="error")
+    try:
+        yield
+    finally:
+        if token is not None:
+            try:
+                store.unlock(name, token)
+            except _BACKEND_ERRORS as exc:
+                logger.warning("Cache unlock %s failed (expires on its own): %s", name, exc)
+
+
+@asynccontextmanager
+async def single_flight_async(store, name: str, ttl: float = 120, wait: Optional[float] = None):
+    """single_flight for coroutines: lock calls run in a thread, waiting yields to the event loop."""
+    if store is None:
+        yield
+        return
+    wait = LOCK_WAIT if wait is None else wait
+    give_up = time.monotonic() + wait
+    token, waited = None, False
+    try:
+        while True:
+            token = await asyncio.to_thread(store.try_lock, name, ttl)
+            if token is not None or time.monotonic() >= give_up:
+                break
+            waited = True
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+        metrics.cache_locks.inc(result=_lock_result(waited, token))
+    except _BACKEND_ERRORS as exc:
+        logger.warning("Cache lock %s unavailable: %s", name, exc)
+        metrics.cache_locks.inc(result="error")
+    try:
+        yield
+    finally:
+        if token is not None:
+            try:
+                await asyncio.to_thread(store.unlock, name, token)
+            except _BACKEND_ERRORS as exc:
+                logger.warning("Cache unlock %s failed (expires on its own): %s", name, exc)
@@ -0,0 +1,207 @@
+"""
+Prebuilt dataset snapshot for fast cold starts.
+
+`python snapshot.py build` (at image build or deploy time) materializes the
+dataset once and writes it to SNAPSHOT_PATH:
+- one Fortran-ordered .npy file per value dtype (Int32 counts, ...), plus a
+  null mask for nullable dtypes, so each column is a contiguous slice
+- meta.json: column layout, the ZipCode/TownName keys, the registry labels
+  per table, the dataset version, build time and the key of the registry and
+  ZIP universe it was built for
+
+At startup app.py maps the arrays (np.load(mmap_mode="r")) and wraps them as
+columns without copying, so the first request is served from the snapshot
+instead of waiting on the Census fetch chain. The refresh loop takes over once
+the snapshot is older than DATASET_REFRESH_SECONDS. A snapshot built for
+another registry or universe is ignored.
+
+Config (env)
+- SNAPSHOT_PATH      snapshot directory (default: snapshot/)
+- SNAPSHOT_DISABLED  set to 1 to ignore the snapshot
+
+CLI
+    python snapshot.py build [--out snapshot]
+    python snapshot.py info
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dataset_store import index_by_zip
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshot")
+FORMAT = 1
+META = "meta.json"
+
+
+def snapshot_path() -> Optional[str]:
+    """SNAPSHOT_PATH, or None when disabled."""
+    if os.getenv("SNAPSHOT_DISABLED", "").strip().lower() in ("1", "true", "yes"):
+        return None
+    return os.getenv("SNAPSHOT_PATH", DEFAULT_PATH)
+
+
+def _masked(dtype) -> bool:
+    # Nullable extension dtypes (Int32, Float32, boolean) keep values and nulls apart
+    return pd.api.types.is_extension_array_dtype(dtype) and hasattr(dtype, "numpy_dtype")
+
+
+def write(path: str, frame: pd.DataFrame, version: str, built_at: float, key: str, tables: dict):
+    """Write `frame` (plus metadata) as a snapshot directory, replacing any previous one."""
+    frame = frame.reset_index(drop=True)
+    tmp = path.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    columns, blocks = [], {}
+    for name in frame.columns:
+        dtype = frame[name].dtype
+        if pd.api.types.is_numeric_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype):
+            names = blocks.setdefault(str(dtype), [])
+            columns.append({"name": name, "block": str(dtype), "position": len(names)})
+            names.append(name)
+            continue
+        values = frame[name].astype(object).where(frame[name].notna(), None).tolist()
+        entry = {"name": name, "dtype": str(dtype), "values": values}
+        if isinstance(dtype, pd.CategoricalDtype):
+            entry["categories"] = dtype.categories.tolist()
+        columns.append(entry)
+
+    layout = {}
+    for dtype_name, names in blocks.items():
+        part, dtype = frame[names], frame[names[0]].dtype
+        stem = dtype_name.replace("[", "_").replace("]", "")
+        if _masked(dtype):
+            values = part.to_numpy(dtype=dtype.numpy_dtype, na_value=dtype.numpy_dtype.type(0))
+            np.save(os.path.join(tmp, f"{stem}.mask.npy"), np.asfortranarray(part.isna().to_numpy()))
+            layout[dtype_name] = {"file": f"{stem}.npy", "mask": f"{stem}.mask.npy"}
+        else:
+            values = part.to_numpy()
+            layout[dtype_name] = {"file": f"{stem}.npy"}
+        np.save(os.path.join(tmp, f"{stem}.npy"), np.asfortranarray(values))
+
+    meta = {
+        "format": FORMAT,
+        "key": key,
+        "version": version,
+        "built_at": built_at,
+        "rows": len(frame),
+        "columns": columns,
+        "blocks": layout,
+        "tables": tables,
+    }
+    with open(os.path.join(tmp, META), "w") as f:
+        json.dump(meta, f)
+
+    # Swap directories so a reader never sees a half-written snapshot
+    old = path.rstrip("/") + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def read_meta(path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(path, META)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def read(path: str, key: Optional[str] = None) -> Optional[Tuple[pd.DataFrame, str, float]]:
+    """
+    (frame indexed by ZipCode, version, built_at) mapped from the snapshot at
+    `path`, or None if there is none or it was built for another `key`.
+    """
+    meta = read_meta(path)
+    if meta is None:
+        return None
+    if meta.get("format") != FORMAT or (key is not None and meta["key"] != key):
+        logger.warning("Ignoring snapshot %s: built for another registry, universe or format", path)
+        return None
+
+    blocks = {}
+    for dtype_name, files in meta["blocks"].items():
+        values = np.load(os.path.join(path, files["file"]), mmap_mode="r")
+        mask = np.load(os.path.join(path, files["mask"]), mmap_mode="r") if "mask" in files else None
+        blocks[dtype_name] = (values, mask, pd.api.types.pandas_dtype(dtype_name))
+
+    data = {}
+    for column in meta["columns"]:
+        if "block" in column:
+            values, mask, dtype = blocks[column["block"]]
+            i = column["position"]
+            data[column["name"]] = (
+                dtype.construct_array_type()(values[:, i], mask[:, i], copy=False) if mask is not None else values[:, i]
+            )
+        elif "categories" in column:
+            data[column["name"]] = pd.Categorical(column["values"], categories=column["categories"])
+        else:
+            data[column["name"]] = pd.array(column["values"], dtype=column["dtype"])
+
+    return index_by_zip(pd.DataFrame(data, copy=False)), meta["version"], meta["built_at"]
+
+
+def registry_tables() -> dict:
+    """Label metadata of every registry table, as recorded in meta.json."""
+    import MainAI3 as core
+
+    return {
+        name: {
+            "description": table.description,
+            "vintage": table.vintage,
+            "total": table.total,
+            "labels": dict(table.labels),
+            "views": {view: table.view_labels(view) for view, _ in table.views},
+        }
+        for name, table in core.CENSUS_TABLES.items()
+    }
+
+
+# -------------------------------------------------
+# CLI
+# -------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the prebuilt dataset snapshot.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Materialize the dataset and write the snapshot")
+    build.add_argument("--out", default=os.getenv("SNAPSHOT_PATH", DEFAULT_PATH))
+    info = sub.add_parser("info", help="Show the snapshot's metadata")
+    info.add_argument("--path", default=os.getenv("SNAPSHOT_PATH", DEFAULT_PATH))
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        meta = read_meta(args.path)
+        if meta is None:
+            parser.error(f"no snapshot at {args.path}")
+        summary = {k: meta[k] for k in ("key", "version", "built_at", "rows")}
+        summary["columns"] = len(meta["columns"])
+        summary["tables"] = {name: len(table["labels"]) for name, table in meta["tables"].items()}
+        summary["bytes"] = sum(os.path.getsize(os.path.join(args.path, f)) for f in os.listdir(args.path))
+        print(json.dumps(summary, indent=2))
+        return
+
+    import asyncio
+
+    import app
+
+    started = time.time()
+    frame, version, built_at = asyncio.run(app.county_dataset.build())
+    write(args.out, frame, version, built_at, app.county_dataset.key, registry_tables())
+    print(f"{len(frame)} ZIPs x {frame.shape[1]} columns (version {version}) -> {args.out} "
+          f"in {time.time() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Multi-vintage time series of the Census tables.
+
+Published vintages never change, so each (table, vintage) is fetched and
+assembled once, for the whole ZIP universe, and stored immutably (no TTL, no
+size eviction) in a store every worker shares (see shared_cache.py). A series
+request loads the vintages it needs and builds only the missing ones. All
+missing vintages are fetched together in one round: every chunk of every
+vintage at once, bounded by the caller's builder. The vintages are then
+stacked into one long frame with a Vintage column, one row per (ZIP,
+vintage). Once the store is filled, a ten-year trend reads stored frames and
+makes no Census calls.
+
+A vintage with a rejected chunk (e.g. an older ACS release without one of
+the variable codes, answered with a 400) is served with those columns empty
+but not stored, so it is fetched again next time. `drop` removes stored
+vintages, e.g. ones stored before a registry fix.
+
+ACS tables are published for MainAI3.ACS_VINTAGES; the DHC race table only
+for 2020, so its columns are empty in other years. Before 2020 the API
+nests ZCTAs in states; the registry adds in=state:<GEO_STATE> for those
+vintages (see CensusTable.geo_within), so a national universe starts at 2020.
+
+Config (env)
+- SERIES_CACHE_PATH      SQLite file (default: .cache/series_store.sqlite3)
+- SERIES_CACHE_DISABLED  set to 1 to keep vintages in process memory only
+- ACS_LATEST_VINTAGE     newest ACS 5-year release to allow (default: 2023)
+
+CLI
+    python timeseries.py fill [--from 2012] [--to 2021] [--tables income,occupation]
+    python timeseries.py list
+    python timeseries.py drop --from 2012 --to 2014 [--tables income]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple
+
+import pandas as pd
+
+import MainAI3 as core
+import dataset_schema
+import shared_cache
+from census_cache import open_store
+from dataset_store import decode_frame, encode_frame, index_by_zip
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "series_store.sqlite3")
+ENDPOINT = "vintage"
+# Longest a worker may hold the build lock for a set of vintages
+LOCK_TTL = 300
+
+# async (tables, zip_codes) -> assembled frame per table, in order (see MainAI3.assemble_table)
+Builder = Callable[[List[core.CensusTable], List[str]], Awaitable[List[pd.DataFrame]]]
+
+
+async def fetch_tables(tables: List[core.CensusTable], zip_codes: List[str]) -> List[pd.DataFrame]:
+    """Default builder: each table via MainAI3.fetch_table, all in parallel threads."""
+    return list(await asyncio.gather(*(asyncio.to_thread(core.fetch_table, t, zip_codes) for t in tables)))
+
+
+def default_vintages() -> List[int]:
+    """The ten ACS vintages up to the dataset's own."""
+    return [v for v in core.ACS_VINTAGES if core.ACS_VINTAGE - 10 < v <= core.ACS_VINTAGE]
+
+
+def published(names: Sequence[str], vintages: Sequence[int]) -> List[Tuple[str, int]]:
+    """(table, vintage) pairs that exist; raises ValueError for a year none of `names` has."""
+    nested = sorted(v for v in set(vintages) if v < core.ZCTA_UNNESTED_FROM)
+    if nested and len(core.UNIVERSE.states) > 1:
+        # Those vintages only answer ZCTAs within one state (GEO_STATE)
+        raise ValueError(
+            f"Vintages {nested} nest ZCTAs in states; a {core.UNIVERSE.scope} universe needs "
+            f"{core.ZCTA_UNNESTED_FROM} or later."
+        )
+    pairs = [(name, v) for v in vintages for name in names if v in core.CENSUS_TABLES[name].vintages]
+    missing = sorted(set(vintages) - {v for _, v in pairs})
+    if missing:
+        spans = ", ".join(f"{n} {core.vintage_span(core.CENSUS_TABLES[n].vintages)}" for n in names)
+        raise ValueError(f"No data for {missing}; available: {spans}.")
+    return pairs
+
+
+class VintageStore:
+    """Immutable (table, vintage) frames for `zip_codes`, with in-process memoization."""
+
+    def __init__(self, zip_codes: List[str], store=None, builder: Builder = fetch_tables):
+        self.zip_codes = list(zip_codes)
+        self.store = store
+        self._builder = builder
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._universe = hashlib.sha1(",".join(self.zip_codes).encode("utf-8")).hexdigest()[:12]
+
+    def key(self, name: str, vintage: int) -> str:
+        """Storage key: table, vintage, its variable codes and the ZIP universe."""
+        table = core.CENSUS_TABLES[name].at(vintage)
+        raw = json.dumps([table.base_url.split("/data/", 1)[-1], [v.code for v in table.variables]])
+        return f"{name}|{vintage}|{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]}|{self._universe}"
+
+    def _load(self, keys: List[str]) -> Dict[str, pd.DataFrame]:
+        found = self.store.get_many(keys) if self.store is not None else {}
+        return {key: decode_frame(entry["frame"]).set_index("ZipCode") for key, entry in found.items()}
+
+    def _save(self, frames: Dict[str, Tuple[int, pd.DataFrame]]):
+        if self.store is None:
+            return
+        now = time.time()
+        self.store.set_many(
+            ((key, {"vintage": vintage, "fetched_at": now, "frame": encode_frame(frame.reset_index())})
+             for key, (vintage, frame) in frames.items()),
+            ENDPOINT,
+        )
+
+    async def tables(self, pairs: List[Tuple[str, int]]) -> Dict[Tuple[str, int], pd.DataFrame]:
+        """Assembled frame (indexed by ZipCode) per (table, vintage); builds only what is missing."""
+        keys = {pair: self.key(*pair) for pair in pairs}
+        missing = [k for k in keys.values() if k not in self._frames]
+        if missing:
+            self._frames.update(await asyncio.to_thread(self._load, missing))
+            missing = [k for k in missing if k not in self._frames]
+        if missing:
+            lock = "series:" + hashlib.sha1("|".join(sorted(missing)).encode("utf-8")).hexdigest()
+            async with shared_cache.single_flight_async(self.store, lock, ttl=LOCK_TTL):
+                # Another worker may have stored them while we waited
+                self._frames.update(await asyncio.to_thread(self._load, missing))
+                todo = [pair for pair, key in keys.items() if key not in self._frames]
+                if todo:
+                    tables = [core.CENSUS_TABLES[name].at(vintage) for name, vintage in todo]
+                    built = dict(zip(todo, await self._builder(tables, self.zip_codes)))
+                    fresh = {}
+                    for pair, frame in built.items():
+                        if frame.attrs.get("rejected"):
+                            logger.warning("Not storing %s %s: %s", *pair, "; ".join(frame.attrs["rejected"]))
+                        else:
+                            fresh[keys[pair]] = (pair[1], frame)
+                    await asyncio.to_thread(self._save, fresh)
+                    self._frames.update({key: frame for key, (_, frame) in fresh.items()})
+                    # Incomplete vintages answer this request only
+                    return {pair: built[pair] if pair in built else self._frames[key] for pair, key in keys.items()}
+        return {pair: self._frames[key] for pair, key in keys.items()}
+
+    async def series(self, names: Sequence[str], vintages: Sequence[int]) -> Tuple[pd.DataFrame, str]:
+        """
+        (frame, version): Vintage, ZipCode, TownName and the tables' columns,
+        one row per ZIP and vintage, indexed by ZipCode (ZIP-major, years
+        ascending). The version hashes the stored keys, which never change.
+        """
+        vintages = sorted(set(vintages))
+        pairs = published(names, vintages)
+        frames = await self.tables(pairs)
+        parts = []
+        for vintage in vintages:
+            present = [frames[(name, vintage)] for name in names if (name, vintage) in frames]
+            part = core.join_tables(present, self.zip_codes)
+            part.insert(0, "Vintage", pd.array([vintage] * len(part), dtype="Int16"))
+            parts.append(part)
+        # Tables missing from a year (race outside 2020) become null columns
+        columns = ["Vintage"] + dataset_schema.KEY_COLUMNS
+        columns += [label for name in names for label in core.CENSUS_TABLES[name].columns]
+        frame = pd.concat(parts, ignore_index=True).reindex(columns=columns)
+        frame = frame.sort_values(["ZipCode", "Vintage"], kind="stable").reset_index(drop=True)
+        version = hashlib.sha1("|".join(self.key(*pair) for pair in pairs).encode("utf-8")).hexdigest()[:16]
+        return index_by_zip(frame), version
+
+    def drop(self, names: Sequence[str], vintages: Sequence[int]) -> int:
+        """Remove the stored (table, vintage) frames, under any variable list; returns the count."""
+        prefixes = tuple(f"{name}|{vintage}|" for name in names for vintage in vintages)
+        self._frames = {k: f for k, f in self._frames.items() if not k.startswith(prefixes)}
+        if self.store is None:
+            return 0
+        victims = [key for key in self.store.keys(ENDPOINT) if key.startswith(prefixes)]
+        return self.store.delete_many(victims) if victims else 0
+
+    def stored(self) -> Dict[str, List[int]]:
+        """Vintages present in the store (or this process, without one), per table."""
+        keys = self.store.keys(ENDPOINT) if self.store is not None else list(self._frames)
+        found: Dict[str, List[int]] = {}
+        for key in keys:
+            name, vintage = key.split("|")[:2]
+            found.setdefault(name, []).append(int(vintage))
+        return {name: sorted(years) for name, years in found.items()}
+
+
+def store_from_env():
+    """Shared store for vintages, or None when disabled."""
+    if os.getenv("SERIES_CACHE_DISABLED", "").strip().lower() in ("1", "true", "yes"):
+        return None
+    # Vintages are immutable: never expire, never evict
+    return open_store("vintage", os.getenv("SERIES_CACHE_PATH", DEFAULT_PATH), ttl=0, max_bytes=0)
+
+
+# -------------------------------------------------
+# CLI
+# -------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill or inspect the multi-vintage store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fill = sub.add_parser("fill", help="Fetch and store every missing vintage")
+    fill.add_argument("--from", dest="start", type=int, default=min(default_vintages()))
+    fill.add_argument("--to", dest="end", type=int, default=core.ACS_VINTAGE)
+    fill.add_argument("--tables", default="income,occupation", help="Comma-separated registry tables")
+
+    sub.add_parser("list", help="Show the stored vintages per table")
+
+    drop = sub.add_parser("drop", help="Remove stored vintages so they are fetched again")
+    drop.add_argument("--from", dest="start", type=int, required=True)
+    drop.add_argument("--to", dest="end", type=int, help="Last vintage (default: --from)")
+    drop.add_argument("--tables", default=",".join(core.CENSUS_TABLES), help="Comma-separated registry tables")
+
+    args = parser.parse_args(argv)
+    vintages = VintageStore(core.UNIVERSE.zips, store_from_env())
+
+    if args.command == "fill":
+        names = [n.strip() for n in args.tables.split(",") if n.strip()]
+        started = time.time()
+        frame, version = asyncio.run(vintages.series(names, range(args.start, args.end + 1)))
+        print(f"{len(frame)} rows ({args.start}-{args.end}, {', '.join(names)}) ready in {time.time() - started:.2f}s")
+    elif args.command == "drop":
+        names = [n.strip() for n in args.tables.split(",") if n.strip()]
+        removed = vintages.drop(names, range(args.start, (args.end or args.start) + 1))
+        print(f"Removed {removed} stored vintages")
+    else:
+        print(json.dumps(vintages.stored(), indent=2))
+
+
+if __name__ == "__main__":
+    main()